@@ -0,0 +1,530 @@
+"""Renderer backends: where the engine's screen space primitives end up
+
+Every backend takes whole batches as arrays:
+
+    clear(color)
+    draw_lines(segments, color, width)      (N, 4) x0 y0 x1 y1
+    draw_points(points, color, size)        (N, 2) x y, size x size squares
+    draw_triangles(triangles, depth, color) (N, 3, 2) x y corners, (N, 3) view space z
+    draw_textured(triangles, depth, uvs, texture, shade)
+                                            same plus (N, 3, 2) corner uvs, a textures.Texture
+                                            and (N,) intensity, returns the unshaded texels
+    blit(image)                             (height, width, 3) uint8 over the whole frame
+    present()                               show the frame (window backends)
+    image()                                 (height, width, 3) uint8 copy of the frame
+
+color is one (r, g, b) or an (N, 3) array with one colour per primitive.
+Segments are clipped to the screen first (clip_segments()), ones with a
+non-finite end are dropped.
+Textured triangles are rasterized by NumPy on every backend (textured()),
+pygame only gets the finished pixels.
+
+    pygame     pygame.draw into a Surface (the window or offscreen),
+               triangles are depth sorted per call (painter's algorithm)
+    software   NumPy rasterizer into an RGB array with a z-buffer,
+               present() copies it into a pygame Surface if there is one
+    null       draws nothing, for timing the transform/projection work
+               on its own
+
+Every backend counts the draw calls and primitives of the frame in counts,
+clear() and blit() start them over.
+
+    backend = create("software", 800, 800)
+
+conformance.py renders the same scenes with every backend and compares.
+"""
+import numpy as np
+import pygame
+
+import mesh
+
+NEAR = 0.01               # triangle pixels closer to the camera than this are dropped
+RASTER_BLOCK = 1 << 20    # candidate pixels per rasterizer pass, bounds the temporary memory
+TEXTURE_TILE = 8          # screen pixels per side of the tiles that share one mip level per triangle
+
+
+def per_primitive(color, count):
+    """(count, 3) uint8 colours from one (r, g, b) or an (N, 3) array"""
+    color = np.asarray(color, dtype=np.uint8)
+    if color.ndim == 1:
+        return np.broadcast_to(color, (count, 3))
+    return color
+
+
+def clip_segments(segments, xmin, ymin, xmax, ymax):
+    """Clip (N, 4) x0 y0 x1 y1 segments to the box xmin <= x <= xmax, ymin <= y <= ymax (Liang-Barsky)
+
+    Returns (index of the segments kept, (M, 4) float64 clipped segments).
+    Segments with a non-finite coordinate (a vertex at z = 0) and those
+    entirely outside are dropped, the rest keep their direction.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    index = np.flatnonzero(np.isfinite(segments).all(axis=1))
+    x0, y0, x1, y1 = segments[index].T
+    dx, dy = x1 - x0, y1 - y0
+    t0, t1 = np.zeros(len(index)), np.ones(len(index))
+    inside = np.ones(len(index), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+            # p < 0 enters the boundary's inner side, p > 0 leaves it, p == 0 runs along it
+            inside &= (p != 0) | (q >= 0)
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    keep = inside & (t0 <= t1)
+    t0, t1 = t0[keep, None], t1[keep, None]
+    start = np.stack([x0, y0], axis=1)[keep]
+    delta = np.stack([dx, dy], axis=1)[keep]
+    return index[keep], np.concatenate([start + t0 * delta, start + t1 * delta], axis=1)
+
+def rasterize(triangles, attributes, width, height):
+    """Fragments of (N, 3, 2) screen triangles, yielded in blocks of whole triangles
+
+    attributes (N, 3, K) per corner values are interpolated linearly on
+    screen. Yields (pixel index, triangle, (F, K) values) per block, pixel
+    centres inside a triangle are covered by it.
+    """
+    triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+    if not len(triangles):
+        return
+    attributes = np.asarray(attributes, dtype=np.float64).reshape(len(triangles), 3, -1)
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    double_area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    kept = np.flatnonzero(double_area != 0)
+    triangles, attributes, double_area = triangles[kept], attributes[kept], double_area[kept]
+
+    # Pixel bounding boxes clipped to the screen
+    lo = np.maximum(np.floor(triangles.min(axis=1)), 0).astype(np.int64)
+    hi = np.minimum(np.ceil(triangles.max(axis=1)), (width, height)).astype(np.int64)
+    size = np.maximum(hi - lo, 0)
+    area = size[:, 0] * size[:, 1]
+
+    # Per triangle planes v = A i + B j + C over the pixel offsets (i, j) in
+    # its box: the three barycentric weights (edge functions normalized by
+    # the signed area, so both windings are >= 0 inside) and the attributes
+    planes = np.empty((len(triangles), 3, 3 + attributes.shape[2]))
+    for w, (p, q) in enumerate(((1, 2), (2, 0), (0, 1))):
+        p, q = triangles[:, p], triangles[:, q]
+        planes[:, 0, w] = (p[:, 1] - q[:, 1]) / double_area
+        planes[:, 1, w] = (q[:, 0] - p[:, 0]) / double_area
+        planes[:, 2, w] = ((q[:, 1] - p[:, 1]) * p[:, 0] - (q[:, 0] - p[:, 0]) * p[:, 1]) / double_area
+    planes[:, :, 3:] = np.einsum('nkw,nwa->nka', planes[:, :, :3], attributes)
+    # Evaluated at pixel centres, relative to the box corner
+    origin = lo + 0.5
+    planes[:, 2] += planes[:, 0] * origin[:, :1] + planes[:, 1] * origin[:, 1:]
+
+    # Blocks of whole triangles so huge ones cannot exhaust memory
+    start = 0
+    while start < len(triangles):
+        stop = start + max(1, int(np.searchsorted(np.cumsum(area[start:]), RASTER_BLOCK)))
+        index, tri, values = spans(planes[start:stop], lo[start:stop], size[start:stop], width)
+        yield index, kept[start + tri], values
+        start = stop
+
+def spans(planes, lo, size, width):
+    # One span per triangle row: where all three weights are >= 0, solved
+    # per row instead of tested per pixel
+    j, _ = mesh.concat_ranges(np.zeros(len(planes), dtype=np.int64), size[:, 1])
+    tri = np.repeat(np.arange(len(planes)), size[:, 1])
+    row = planes[tri]
+    first = np.zeros(len(tri))
+    last = size[tri, 0] - 1.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for w in range(3):
+            a = row[:, 0, w]
+            at_zero = row[:, 1, w] * j + row[:, 2, w]
+            bound = -at_zero / a
+            first = np.where(a > 0, np.maximum(first, np.ceil(bound)), first)
+            last = np.where(a < 0, np.minimum(last, np.floor(bound)), last)
+            last = np.where((a == 0) & (at_zero < 0), -1, last)
+    counts = np.maximum(last - first + 1, 0).astype(np.int64)
+
+    # Fragments of every span back to back
+    i, _ = mesh.concat_ranges(first.astype(np.int64), counts)
+    span = np.repeat(np.arange(len(tri)), counts)
+    values = row[span, 0, 3:] * i[:, None] + (row[:, 1, 3:] * j[:, None] + row[:, 2, 3:])[span]
+    tri = tri[span]
+    index = (lo[tri, 1] + j[span]) * width + lo[tri, 0] + i
+    return index, tri, values
+
+def nearest(index, depth, *columns):
+    """Only the smallest depth fragment per pixel, depth float32 >= 0
+
+    Returns index, depth and the columns, sorted by pixel.
+    """
+    # Non-negative float bits sort like the values, one int64 key sorts by pixel then depth
+    order = np.argsort((index << 32) | depth.view(np.uint32).astype(np.int64))
+    index = index[order]
+    first = np.ones(len(index), dtype=bool)
+    first[1:] = index[1:] != index[:-1]
+    return (index[first], depth[order][first]) + tuple(c[order][first] for c in columns)
+
+def nearest_fragments(triangles, depth, attributes, width, height):
+    """Nearest fragment per pixel of (N, 3, 2) screen triangles with (N, 3) view space z
+
+    attributes (N, 3, K) per corner values are interpolated perspective
+    correctly. Returns (pixel index, triangle, (F, K) values) sorted by
+    pixel; triangles reaching in front of NEAR are left out as the backends do.
+    """
+    triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+    depth = np.asarray(depth, dtype=np.float64).reshape(-1, 3)
+    # K from the last axis, there is nothing to infer it from without triangles
+    attributes = np.asarray(attributes, dtype=np.float64).reshape(len(triangles), 3, np.shape(attributes)[-1])
+    kept = np.flatnonzero((depth > NEAR).all(axis=1))
+    inverse = 1 / depth[kept, :, None]
+    blocks = []
+    for index, tri, values in rasterize(triangles[kept], np.concatenate([inverse, attributes[kept] * inverse], axis=2),
+                                        width, height):
+        # Sorted by the fragment number, only the winners' values are gathered
+        index, z, fragment = nearest(index, (1 / values[:, 0]).astype(np.float32), np.arange(len(index)))
+        values = values[fragment]
+        blocks.append((index, z, kept[tri[fragment]], values[:, 1:] / values[:, :1]))
+    if not blocks:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, attributes.shape[2]))
+    # Blocks overlap on screen, the nearest of them wins
+    index, z, tri, values = (np.concatenate(c) for c in zip(*blocks))
+    if len(blocks) > 1:
+        index, z, tri, values = nearest(index, z, tri, values)
+    return index, tri, values
+
+
+def gradients(triangles, attributes):
+    """(N, 2, K) screen x and y derivatives of the (N, 3, K) corner attributes"""
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    e1, e2 = b - a, c - a
+    d1, d2 = attributes[:, 1] - attributes[:, 0], attributes[:, 2] - attributes[:, 0]
+    double_area = (e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0])[:, None]
+    return np.stack([(d1 * e2[:, 1:] - d2 * e1[:, 1:]) / double_area,
+                     (d2 * e1[:, :1] - d1 * e2[:, :1]) / double_area], axis=1)
+
+def textured(triangles, depth, uvs, texture, buffer, width, height):
+    """Visible fragments of textured triangles, depth tested against buffer (updated)
+
+    u/z, v/z and 1/z are linear on screen, so u and v are interpolated
+    perspective correctly as their ratios. The mip level comes from the
+    texel footprint at the centre of every TEXTURE_TILE tile a triangle
+    covers. Yields (pixel index, triangle, (F, 3) uint8 texels) per block.
+    """
+    triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+    depth = np.asarray(depth, dtype=np.float64).reshape(-1, 3)
+    uvs = np.asarray(uvs, dtype=np.float64).reshape(-1, 3, 2)
+    kept = np.flatnonzero((depth > NEAR).all(axis=1))
+    triangles = triangles[kept]
+    q = 1 / depth[kept, :, None]
+    attributes = np.concatenate([q, uvs[kept] * q], axis=2)  # 1/z, u/z, v/z
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = gradients(triangles, attributes)
+    # One row per triangle so each block gathers once: first corner x y, its
+    # 1/z u/z v/z, their x and y slopes, the smallest corner 1/z
+    table = np.concatenate([triangles[:, 0], attributes[:, 0], slopes.reshape(-1, 6),
+                            q[:, :, 0].min(axis=1, keepdims=True)], axis=1).astype(np.float32)
+    texel_w, texel_h = texture.size
+    half = TEXTURE_TILE / 2
+
+    for index, tri, values in rasterize(triangles, attributes, width, height):
+        index, z, tri = nearest(index, (1 / values[:, 0]).astype(np.float32), tri)
+        closer = z < buffer[index]
+        index, tri = index[closer], tri[closer]
+        buffer[index] = z[closer]
+
+        # float32 from here on, plenty for texel positions and half the memory traffic
+        row = table[tri].T
+        y, x = np.divmod(index, width)
+        x, y = x.astype(np.float32), y.astype(np.float32)
+        dx, dy = x + 0.5 - row[0], y + 0.5 - row[1]
+        q = row[2] + row[5] * dx + row[8] * dy
+        u = (row[3] + row[6] * dx + row[9] * dy) / q
+        v = (row[4] + row[7] * dx + row[10] * dy) / q
+
+        # The same at the centre of the pixel's tile, where the footprint is taken
+        dx += (x // TEXTURE_TILE) * TEXTURE_TILE + (half - 0.5) - x
+        dy += (y // TEXTURE_TILE) * TEXTURE_TILE + (half - 0.5) - y
+        # Far outside a thin triangle 1/z can extrapolate to <= 0
+        q = np.maximum(row[2] + row[5] * dx + row[8] * dy, row[11])
+        u_tile = (row[3] + row[6] * dx + row[9] * dy) / q
+        v_tile = (row[4] + row[7] * dx + row[10] * dy) / q
+        # d(u/z / 1/z) = (d(u/z) - u d(1/z)) / (1/z) per screen axis, scaled to texels
+        footprint = np.maximum(
+            np.hypot((row[6] - u_tile * row[5]) * texel_w, (row[7] - v_tile * row[5]) * texel_h),
+            np.hypot((row[9] - u_tile * row[8]) * texel_w, (row[10] - v_tile * row[8]) * texel_h)) / q
+        yield index, kept[tri], texture.sample(u, v, footprint)
+
+class Backend:
+    name = None
+
+    def __init__(self, width, height, surface=None):
+        """surface is the pygame Surface present() shows the frame on, if any"""
+        self.width = width
+        self.height = height
+        self.surface = surface
+        self.background = (0, 0, 0)
+        self.counts = {'calls': 0, 'lines': 0, 'points': 0, 'triangles': 0}
+
+    def count(self, kind=None, primitives=0):
+        """One more draw call this frame, of primitives lines, points or triangles"""
+        self.counts['calls'] += 1
+        if kind is not None:
+            self.counts[kind] += primitives
+
+    def reset_counts(self):
+        self.counts = dict.fromkeys(self.counts, 0)
+
+    def clear(self, color):
+        raise NotImplementedError
+
+    def draw_lines(self, segments, color, width=1):
+        raise NotImplementedError
+
+    def draw_points(self, points, color, size=1):
+        raise NotImplementedError
+
+    def draw_triangles(self, triangles, depth, color):
+        raise NotImplementedError
+
+    def draw_textured(self, triangles, depth, uvs, texture, shade):
+        """Perspective correct textured triangles, texels scaled by the (N,) shade intensity
+
+        Depth tested against depth_buffer() if the backend keeps one,
+        otherwise only among themselves. Returns the (height * width, 3)
+        uint8 unshaded texels of the pixels drawn (black elsewhere).
+        """
+        self.count('triangles', len(triangles))
+        buffer = self.depth_buffer()
+        if buffer is None:
+            buffer = np.full(self.width * self.height, np.inf, dtype=np.float32)
+        shade = np.clip(np.asarray(shade, dtype=np.float32), 0, 1)
+        albedo = np.zeros((self.width * self.height, 3), dtype=np.uint8)
+        calls = self.counts['calls']
+        for index, tri, texels in textured(triangles, depth, uvs, texture, buffer, self.width, self.height):
+            albedo[index] = texels
+            self.set_pixels(index, (texels * shade[tri, None]).astype(np.uint8))
+        self.counts['calls'] = calls  # still the one call, however many set_pixels() it took
+        return albedo
+
+    def blit(self, image):
+        raise NotImplementedError
+
+    def present(self):
+        pass
+
+    def image(self):
+        raise NotImplementedError
+
+    def depth_buffer(self):
+        """(height * width,) float32 view space z of the last triangles, None if not kept"""
+        return None
+
+    def set_pixels(self, index, color):
+        """Overwrite the pixels at flat indices (y * width + x) with one (r, g, b) or one per pixel"""
+        raise NotImplementedError
+
+    def flip(self):
+        # Only the window surface is flipped, offscreen surfaces are read back with image()
+        if self.surface is not None and self.surface is pygame.display.get_surface():
+            pygame.display.flip()
+
+
+class PygameBackend(Backend):
+    name = 'pygame'
+
+    def __init__(self, width, height, surface=None):
+        super().__init__(width, height, surface if surface is not None else pygame.Surface((width, height)))
+
+    def clear(self, color):
+        self.reset_counts()
+        self.count()
+        self.background = color
+        self.surface.fill(color)
+
+    def draw_lines(self, segments, color, width=1):
+        self.count('lines', len(segments))
+        surface = self.surface
+        # pygame clips as well, but cannot take infinite or huge coordinates
+        kept, segments = clip_segments(segments, -width, -width, self.width + width, self.height + width)
+        if np.ndim(color) != 1:
+            color = np.asarray(color)[kept]
+        segments = segments.astype(np.int64)
+        # Flat lists: a list per segment would be thousands of containers
+        # alive at once, enough to start a garbage collection every frame
+        segments = zip(*[iter(np.asarray(segments).ravel().tolist())] * 4)
+        if np.ndim(color) == 1:
+            for x0, y0, x1, y1 in segments:
+                pygame.draw.line(surface, color, (x0, y0), (x1, y1), width)
+            return
+        colors = zip(*[iter(np.asarray(color).ravel().tolist())] * 3)
+        for (x0, y0, x1, y1), c in zip(segments, colors):
+            pygame.draw.line(surface, c, (x0, y0), (x1, y1), width)
+
+    def draw_points(self, points, color, size=1):
+        self.count('points', len(points))
+        colors = per_primitive(color, len(points)).tolist()
+        half = size // 2
+        for (x, y), c in zip(np.asarray(points).tolist(), colors):
+            pygame.draw.rect(self.surface, c, (x - half, y - half, size, size))
+
+    def draw_triangles(self, triangles, depth, color):
+        self.count('triangles', len(triangles))
+        triangles = np.asarray(triangles)
+        colors = per_primitive(color, len(triangles))
+        # Farthest first, so nearer triangles paint over them
+        order = np.argsort(-np.asarray(depth).mean(axis=1), kind='stable')
+        for corners, c in zip(triangles[order].tolist(), colors[order].tolist()):
+            pygame.draw.polygon(self.surface, c, corners)
+
+    def blit(self, image):
+        self.reset_counts()
+        self.count()
+        pygame.surfarray.blit_array(self.surface, image.swapaxes(0, 1))
+
+    def present(self):
+        self.flip()
+
+    def image(self):
+        return pygame.surfarray.array3d(self.surface).swapaxes(0, 1).copy()
+
+    def set_pixels(self, index, color):
+        self.count()
+        pixels = pygame.surfarray.pixels3d(self.surface)  # locks the surface until released
+        pixels[index % self.width, index // self.width] = color
+        del pixels
+
+
+class SoftwareBackend(Backend):
+    name = 'software'
+
+    def __init__(self, width, height, surface=None):
+        super().__init__(width, height, surface)
+        self.pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        self.depth = np.full(width * height, np.inf, dtype=np.float32)
+
+    def clear(self, color):
+        self.reset_counts()
+        self.count()
+        self.background = color
+        self.pixels[:] = color
+        self.depth.fill(np.inf)
+
+    def plot(self, xs, ys, colors):
+        """Write pixels, later ones win where several land on the same pixel"""
+        ok = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        self.pixels[ys[ok], xs[ok]] = colors[ok]
+
+    def draw_lines(self, segments, color, width=1):
+        # Clipped first: samples are taken along the whole segment, so one
+        # far off screen (or at infinity, a vertex at z = 0) would be billions
+        count = len(np.asarray(segments).reshape(-1, 4))
+        self.count('lines', count)
+        kept, segments = clip_segments(segments, -width, -width, self.width + width, self.height + width)
+        segments = segments.astype(np.int64)
+        if len(segments) == 0:
+            return
+        colors = per_primitive(color, count)[kept]
+        x0, y0, x1, y1 = segments.T
+        dx, dy = x1 - x0, y1 - y0
+        # One sample per pixel along the major axis (DDA), all segments back to back
+        steps = np.maximum(np.abs(dx), np.abs(dy)) + 1
+        k, _ = mesh.concat_ranges(np.zeros(len(segments), dtype=np.int64), steps)
+        seg = np.repeat(np.arange(len(segments)), steps)
+        t = k / np.maximum(steps - 1, 1)[seg]
+        xs = np.floor(x0[seg] + dx[seg] * t + 0.5).astype(np.int64)
+        ys = np.floor(y0[seg] + dy[seg] * t + 0.5).astype(np.int64)
+        colors = colors[seg]
+        if width > 1:
+            # Square brush, width pixels wide
+            offsets = np.arange(width) - (width - 1) // 2
+            ox, oy = np.meshgrid(offsets, offsets)
+            xs = (xs[:, None] + ox.ravel()).ravel()
+            ys = (ys[:, None] + oy.ravel()).ravel()
+            colors = np.repeat(colors, width * width, axis=0)
+        self.plot(xs, ys, colors)
+
+    def draw_points(self, points, color, size=1):
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        self.count('points', len(points))
+        colors = per_primitive(color, len(points))
+        offsets = np.arange(size) - size // 2
+        ox, oy = np.meshgrid(offsets, offsets)
+        xs = (points[:, :1] + ox.ravel()).ravel()
+        ys = (points[:, 1:] + oy.ravel()).ravel()
+        self.plot(xs, ys, np.repeat(colors, size * size, axis=0))
+
+    def draw_triangles(self, triangles, depth, color):
+        """Z-buffered, depth is interpolated perspective correctly (1/z is linear on screen)"""
+        triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 2)
+        depth = np.asarray(depth, dtype=np.float64).reshape(-1, 3)
+        self.count('triangles', len(triangles))
+        keep = (depth > NEAR).all(axis=1)
+        colors = per_primitive(color, len(triangles))[keep]
+        for index, tri, values in rasterize(triangles[keep], 1 / depth[keep, :, None], self.width, self.height):
+            z = (1 / values[:, 0]).astype(np.float32)
+            # Nearest fragment per pixel, then the depth test against the buffer
+            index, z, tri = nearest(index, z, tri)
+            closer = z < self.depth[index]
+            index = index[closer]
+            self.depth[index] = z[closer]
+            self.pixels.reshape(-1, 3)[index] = colors[tri[closer]]
+
+    def depth_buffer(self):
+        return self.depth
+
+    def set_pixels(self, index, color):
+        self.count()
+        self.pixels.reshape(-1, 3)[index] = color
+
+    def blit(self, image):
+        self.reset_counts()
+        self.count()
+        self.pixels[:] = image
+        self.depth.fill(np.inf)
+
+    def present(self):
+        if self.surface is not None:
+            pygame.surfarray.blit_array(self.surface, self.pixels.swapaxes(0, 1))
+            self.flip()
+
+    def image(self):
+        return self.pixels.copy()
+
+
+class NullBackend(Backend):
+    name = 'null'
+
+    def clear(self, color):
+        self.reset_counts()
+        self.count()
+        self.background = color
+
+    def draw_lines(self, segments, color, width=1):
+        self.count('lines', len(segments))
+
+    def draw_points(self, points, color, size=1):
+        self.count('points', len(points))
+
+    def draw_triangles(self, triangles, depth, color):
+        self.count('triangles', len(triangles))
+
+    def draw_textured(self, triangles, depth, uvs, texture, shade):
+        self.count('triangles', len(triangles))
+        return None
+
+    def blit(self, image):
+        self.reset_counts()
+        self.count()
+
+    def set_pixels(self, index, color):
+        self.count()
+
+    def image(self):
+        return np.full((self.height, self.width, 3), self.background, dtype=np.uint8)
+
+
+BACKENDS = {cls.name: cls for cls in (PygameBackend, SoftwareBackend, NullBackend)}
+
+
+def create(name, width, height, surface=None):
+    """Backend by name (see BACKENDS)"""
+    try:
+        cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown backend {name!r}, expected one of {', '.join(BACKENDS)}") from None
+    return cls(width, height, surface)
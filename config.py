@@ -0,0 +1,160 @@
+"""Engine settings: defaults < ENGINE_* environment < TOML file < command line
+
+    python v2.py --config fast.toml --resolution 1280x720 --fps 0
+
+A TOML file holds any of the DEFAULTS keys at the top level:
+
+    resolution = [1280, 720]        # or width = ... / height = ...
+    mesh = "models/bunny.obj"       # OBJ or preprocessed NPZ, default the penguin
+    texture = "models/bunny.png"    # solid mode texture, default the OBJ material's map_Kd
+    render_mode = "solid"           # wireframe | solid
+    backend = "software"            # pygame | software | null
+    fps = 0                         # frame cap, 0 for uncapped
+    adaptive = true                 # trade quality for speed to hold target_ms
+    vsync = true
+    stream_threads = 4              # chunk loader threads for stream_mesh
+    cache = false                   # skip the preprocessed mesh cache
+
+Every key is also a command line flag (--render-mode solid, --no-vsync).
+"""
+import argparse
+import math
+import os
+
+import backends
+import mesh
+import telemetry
+
+DEFAULTS = {
+    'width': 800,
+    'height': 800,
+    'mesh': None,               # OBJ/NPZ path, None for the built-in penguin
+    'point_cloud': None,        # scan to render instead, see pointcloud.py
+    'stream_mesh': None,        # chunked mesh to stream instead, see streaming.py
+    'stream_budget_mb': 256.0,  # resident chunk data
+    'stream_threads': 1,        # chunk loader threads
+    'render_mode': 'wireframe',
+    'shadows': False,           # solid mode shadows from a model-fixed light
+    'shadow_size': 1024,        # shadow map texels per side
+    'texture': None,            # image for solid meshes with UVs, None for the OBJ's map_Kd
+    'texture_budget_mb': 64.0,  # decoded textures kept in the shared cache
+    'edge_shading': 'light',
+    'backend': 'pygame',
+    'fps': 60,                  # frame cap, 0 for uncapped
+    'adaptive': False,          # lower quality to hold target_ms, see pacing.py
+    'target_ms': 1000 / 60,     # frame time the adaptive controller aims for
+    'vsync': False,
+    'spin': True,
+    'spin_speed': math.pi / 4,  # radians per second
+    'distance': 1.0,            # initial camera distance (dz)
+    'on_demand': False,         # only redraw on input
+    'cache': True,              # cache preprocessed meshes
+    'cache_dir': mesh.CACHE_DIR,
+    'background_load': True,    # load mesh/texture files on worker threads, see loader.py
+    'profile_allocations': False,  # trace allocations and GC pauses per frame, see profiling.py
+    'telemetry': None,          # frame metrics export, a file path or udp://host:port, see telemetry.py
+    'telemetry_interval': telemetry.DEFAULT_INTERVAL,  # seconds between exports
+    'telemetry_sample': 1.0,    # fraction of the frames recorded
+    'background': '#101010',
+    'foreground': '#50FF50',
+}
+
+CHOICES = {
+    'render_mode': ('wireframe', 'solid'),
+    'edge_shading': ('light', 'depth', 'flat'),
+    'backend': tuple(backends.BACKENDS),
+}
+
+# Settings that can also come from the environment
+ENVIRONMENT = {
+    'ENGINE_MESH': 'mesh',
+    'ENGINE_POINT_CLOUD': 'point_cloud',
+    'ENGINE_STREAM_MESH': 'stream_mesh',
+    'ENGINE_STREAM_BUDGET_MB': 'stream_budget_mb',
+    'ENGINE_RENDER_MODE': 'render_mode',
+    'ENGINE_TEXTURE': 'texture',
+    'ENGINE_EDGE_SHADING': 'edge_shading',
+    'ENGINE_BACKEND': 'backend',
+    'ENGINE_PROFILE_ALLOCATIONS': 'profile_allocations',
+    'ENGINE_TELEMETRY': 'telemetry',
+    'ENGINE_TELEMETRY_INTERVAL': 'telemetry_interval',
+    'ENGINE_TELEMETRY_SAMPLE': 'telemetry_sample',
+}
+
+
+def coerce(key, value):
+    """value converted to the type of the key's default, ValueError if it does not fit"""
+    if key not in DEFAULTS:
+        raise ValueError(f"unknown setting {key!r}")
+    default = DEFAULTS[key]
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            if value.lower() not in ('1', '0', 'true', 'false', 'yes', 'no', 'on', 'off'):
+                raise ValueError(f"{key}: expected a boolean, got {value!r}")
+            value = value.lower() in ('1', 'true', 'yes', 'on')
+        value = bool(value)
+    elif isinstance(default, int):
+        # A float only if it is whole, fps = 59.9 is a mistake, not 59
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f"{key}: expected a whole number, got {value!r}")
+        value = int(value)
+    elif isinstance(default, float):
+        value = float(value)
+    elif value is not None:
+        value = str(value)
+    if key in CHOICES and value not in CHOICES[key]:
+        raise ValueError(f"{key}: expected one of {', '.join(CHOICES[key])}, got {value!r}")
+    return value
+
+def update(settings, values):
+    """Coerce and apply values (a dict, 'resolution' as [width, height] allowed) to settings"""
+    values = dict(values)
+    if 'resolution' in values:
+        values['width'], values['height'] = values.pop('resolution')
+    for key, value in values.items():
+        settings[key] = coerce(key, value)
+    return settings
+
+def from_environment(environ=os.environ):
+    """DEFAULTS overridden by the ENGINE_* variables that are set"""
+    return update(dict(DEFAULTS), {key: environ[name] for name, key in ENVIRONMENT.items()
+                                   if environ.get(name)})
+
+def load(path, settings=None):
+    """settings (default from_environment()) overridden by a TOML file"""
+    try:
+        import tomllib
+    except ImportError:  # before Python 3.11, the same parser is the tomli package
+        import tomli as tomllib
+    with open(path, 'rb') as f:
+        values = tomllib.load(f)
+    try:
+        return update(dict(settings or from_environment()), values)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{path}: {e}") from None
+
+
+def resolution(text):
+    width, _, height = text.lower().partition('x')
+    return [int(width), int(height)]
+
+def parser():
+    p = argparse.ArgumentParser(description="3D wireframe engine")
+    p.add_argument('--config', metavar='FILE', help="TOML settings file")
+    p.add_argument('--resolution', type=resolution, metavar='WxH')
+    for key, default in DEFAULTS.items():
+        flag = '--' + key.replace('_', '-')
+        if isinstance(default, bool):
+            p.add_argument(flag, action=argparse.BooleanOptionalAction, default=None)
+        else:
+            p.add_argument(flag, choices=CHOICES.get(key), default=None,
+                           type=str if default is None else type(default),
+                           help=f"default {default}")
+    return p
+
+def from_args(argv=None):
+    """Settings from the environment, --config FILE and the command line flags"""
+    args = vars(parser().parse_args(argv))
+    path = args.pop('config')
+    settings = load(path) if path else from_environment()
+    return update(settings, {key: value for key, value in args.items() if value is not None})
@@ -0,0 +1,210 @@
+"""Backend conformance check: same scenes, every backend, compare the images
+
+    python conformance.py                 # exits 1 if a backend does not conform
+    python conformance.py --save out/     # also writes every image and the diffs
+
+The pygame backend is the reference. Rasterization rules differ slightly
+between backends (line ends, thick line shape, polygon edge pixels), so
+images are not compared exactly: a covered pixel only counts as missing
+if the other image has nothing within TOLERANCE_PX pixels of it, and
+colours are compared where both images are covered. The null backend
+must leave the background alone and count every primitive, and every
+backend must count the same draw calls and primitives.
+"""
+import argparse
+import os
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import backends
+import textures
+
+WIDTH, HEIGHT = 200, 200
+BACKGROUND = (16, 16, 16)
+FOREGROUND = (80, 255, 80)
+TOLERANCE_PX = 1
+MAX_MISSING = 0.03      # fraction of covered pixels without a match in the other image
+MAX_COLOR_ERROR = 12.0  # mean absolute channel difference where both are covered
+
+
+# Scenes: draw(backend) using only the backend interface
+
+def scene_lines(b):
+    b.clear(BACKGROUND)
+    angles = np.linspace(0, 2 * np.pi, 24, endpoint=False)
+    ends = np.stack([100 + 90 * np.cos(angles), 100 + 90 * np.sin(angles)], axis=1).astype(int)
+    segments = np.concatenate([np.full((24, 2), 100), ends], axis=1)
+    b.draw_lines(segments[::2], FOREGROUND, 1)
+    colors = np.stack([np.linspace(60, 255, 12), np.full(12, 120), np.linspace(255, 60, 12)], axis=1)
+    b.draw_lines(segments[1::2], colors.astype(np.uint8), 3)
+
+def scene_points(b):
+    b.clear(BACKGROUND)
+    grid = np.stack(np.meshgrid(np.arange(10, 200, 20), np.arange(10, 200, 20)), axis=-1).reshape(-1, 2)
+    b.draw_points(grid, FOREGROUND, 5)
+
+def scene_triangles(b):
+    # Drawn near to far, so only a depth test (or depth sort) gets the overlaps right
+    b.clear(BACKGROUND)
+    triangles = np.array([
+        [[20, 20], [180, 40], [60, 180]],
+        [[40, 150], [190, 190], [170, 10]],
+        [[100, 0], [10, 100], [150, 120]],
+    ])
+    depth = np.array([[1.0, 1.0, 1.0], [2.0, 2.0, 2.0], [3.0, 3.0, 3.0]])
+    colors = np.array([[255, 80, 80], [80, 255, 80], [80, 80, 255]], dtype=np.uint8)
+    b.draw_triangles(triangles, depth, colors)
+
+def scene_textured(b):
+    # A quad leaning away from the camera: perspective correction and mip levels both show
+    b.clear(BACKGROUND)
+    cells = (np.indices((32, 32)) // 4).sum(axis=0) % 2
+    texture = textures.Texture(np.where(cells[..., None] == 0, 220, 50).astype(np.uint8).repeat(3, axis=2))
+    # Floor rectangle x -1..1, y -1, z 1.2..8, projected like v2.py does
+    x, z = np.array([-1, 1, 1, -1]), np.array([1.2, 1.2, 8, 8])
+    corners = np.stack([100 + 100 * x / z, 100 + 100 / z], axis=1)
+    triangles = corners[[[0, 1, 2], [0, 2, 3]]]
+    depth = z[[[0, 1, 2], [0, 2, 3]]]
+    uvs = np.array([[[0, 0], [4, 0], [4, 4]], [[0, 0], [4, 4], [0, 4]]])
+    b.draw_textured(triangles, depth, uvs, texture, np.array([1.0, 0.8]))
+
+def scene_empty(b):
+    # Batches of nothing, as v2.py hands over when every primitive is culled
+    b.clear(BACKGROUND)
+    b.draw_lines(np.zeros((0, 4)), FOREGROUND, 1)
+    b.draw_points(np.zeros((0, 2)), FOREGROUND, 5)
+    b.draw_triangles(np.zeros((0, 3, 2)), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8))
+    texture = textures.Texture(np.full((4, 4, 3), 200, dtype=np.uint8))
+    b.draw_textured(np.zeros((0, 3, 2)), np.zeros((0, 3)), np.zeros((0, 3, 2)), texture, np.zeros(0))
+
+def scene_offscreen(b):
+    # Lines far off screen, crossing it, and with an end at infinity (a
+    # vertex at z = 0): clipped to the screen, the last ones dropped
+    b.clear(BACKGROUND)
+    big = 1e7
+    segments = np.array([
+        [-big, 100, big, 100],
+        [100, -big, 100, big],
+        [-big, -big, big, big],
+        [50, 20, 150, -big],
+        [-5000, 300, 5000, 300],
+        [20, 180, np.inf, 10],
+        [np.nan, 0, 10, 10],
+    ])
+    b.draw_lines(segments, FOREGROUND, 3)
+
+def scene_near_plane(mode):
+    # A 2 x 2 x 2 cube with the camera on its front face and then inside
+    # it: edges and triangles reaching behind the camera are dropped
+    def draw(b):
+        import mesh
+        import v2
+        cube = mesh.prepare(
+            np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32),
+            *mesh.pack_faces([[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]]),
+            cache_dir=None)
+        penguin = v2.model
+        v2.set_model(cube)
+        try:
+            v2.backend = b
+            v2.render_mode = mode
+            v2.angle, v2.pitch, v2.pan_x, v2.pan_y = 0.3, 0.2, 0, 0
+            for v2.dz in (1.0, 0.5):
+                v2.draw()
+        finally:
+            v2.set_model(penguin)
+    return draw
+
+def scene_penguin(mode):
+    def draw(b):
+        import v2
+        v2.backend = b
+        v2.render_mode = mode
+        v2.angle, v2.pitch, v2.pan_x, v2.pan_y, v2.dz = 0.8, 0.3, 0, 0, 1
+        v2.draw()
+    return draw
+
+SCENES = {
+    'lines': (scene_lines, {'lines': 24}),
+    'points': (scene_points, {'points': 100}),
+    'triangles': (scene_triangles, {'triangles': 3}),
+    'textured': (scene_textured, {'triangles': 2}),
+    'empty': (scene_empty, {'calls': 5, 'lines': 0, 'points': 0, 'triangles': 0}),
+    'offscreen': (scene_offscreen, {'lines': 7}),
+    'near_plane_wireframe': (scene_near_plane('wireframe'), None),
+    'near_plane_solid': (scene_near_plane('solid'), None),
+    'penguin_wireframe': (scene_penguin('wireframe'), None),
+    'penguin_solid': (scene_penguin('solid'), None),
+}
+
+
+def dilate(mask, radius):
+    out = mask.copy()
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            out |= np.roll(np.roll(mask, dy, axis=0), dx, axis=1)
+    return out
+
+def compare(reference, image, background, radius=TOLERANCE_PX):
+    """(missing fraction, extra fraction, mean colour error) of image against reference"""
+    ref_on = (reference != background).any(axis=2)
+    img_on = (image != background).any(axis=2)
+    missing = (ref_on & ~dilate(img_on, radius)).sum() / max(ref_on.sum(), 1)
+    extra = (img_on & ~dilate(ref_on, radius)).sum() / max(img_on.sum(), 1)
+    both = ref_on & img_on
+    error = np.abs(reference[both].astype(int) - image[both].astype(int)).mean() if both.any() else 0.0
+    return missing, extra, error
+
+
+def run(width=WIDTH, height=HEIGHT, save=None):
+    """Render every scene with every backend, returns a list of failure messages"""
+    failures = []
+    for name, (draw, expected_counts) in SCENES.items():
+        size = (800, 800) if name.startswith('penguin') else (width, height)
+        images = {}
+        counts = {}
+        for backend_name in backends.BACKENDS:
+            b = backends.create(backend_name, *size)
+            draw(b)
+            images[backend_name] = b.image()
+            counts[backend_name] = b.counts
+            if backend_name == 'null':
+                if (images['null'] != BACKGROUND).any():
+                    failures.append(f"{name}: null backend drew something")
+                if expected_counts is not None and {k: b.counts[k] for k in expected_counts} != expected_counts:
+                    failures.append(f"{name}: null backend counted {b.counts}, expected {expected_counts}")
+        if counts['software'] != counts['pygame'] or counts['null'] != counts['pygame']:
+            failures.append(f"{name}: backends counted differently {counts}")
+
+        missing, extra, error = compare(images['pygame'], images['software'], BACKGROUND)
+        status = "ok"
+        if missing > MAX_MISSING or extra > MAX_MISSING or error > MAX_COLOR_ERROR:
+            status = "FAIL"
+            failures.append(f"{name}: software vs pygame missing {missing:.3f} extra {extra:.3f} "
+                            f"colour error {error:.1f}")
+        print(f"{name:20} missing {missing:6.3f}  extra {extra:6.3f}  colour error {error:5.1f}  {status}")
+
+        if save:
+            os.makedirs(save, exist_ok=True)
+            for backend_name, image in images.items():
+                pygame.image.save(pygame.surfarray.make_surface(image.swapaxes(0, 1)),
+                                  os.path.join(save, f"{name}_{backend_name}.png"))
+            diff = np.abs(images['pygame'].astype(int) - images['software'].astype(int)).astype(np.uint8)
+            pygame.image.save(pygame.surfarray.make_surface(diff.swapaxes(0, 1)),
+                              os.path.join(save, f"{name}_diff.png"))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--save', metavar='DIR', help="write the images and diffs to DIR")
+    args = parser.parse_args()
+    pygame.init()
+    failures = run(save=args.save)
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
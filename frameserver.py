@@ -0,0 +1,501 @@
+"""Remote frame server: render headless and push frames to socket clients
+
+    python frameserver.py --port 8765 --fps 30 --spin
+
+Open http://127.0.0.1:8765/ for a browser viewer (WebSocket), or connect
+with a plain TCP client (FrameClient below). Every client has its own
+camera; clients whose cameras are in the same state share one render and
+one image encoding per tick.
+
+Raw TCP messages are a 4 byte big endian length followed by the body, a
+WebSocket message is the body alone.
+
+    server -> client   FRAME_HEADER (kind, width, height, frame id) + payload
+    client -> server   UTF-8 JSON command
+
+The first message of a TCP client is a command as well (e.g. {} or
+{"format": "raw"}), it tells the server the connection is not HTTP.
+Commands set 'yaw', 'pitch', 'dz', 'pan_x', 'pan_y' or 'format'
+('png', 'jpeg' or 'raw'), or move the camera relatively with
+'orbit': [d_yaw, d_pitch], 'pan': [dx, dy] and 'zoom': steps.
+
+Raw frames are zlib compressed RGB: a keyframe first, then the XOR with
+the previous frame that client received. Each client has a one frame
+mailbox: a frame produced while the previous one is still being written
+replaces the waiting one instead of queueing behind it, so slow clients
+get fewer, never older, frames.
+
+Check the round trip over a local connection, exits 1 on a mismatch:
+
+    python frameserver.py --check
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Frames are rendered offscreen, no window needed
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import v2
+
+FRAME_HEADER = struct.Struct('>BHHI')
+KIND_PNG, KIND_JPEG, KIND_RAW_KEY, KIND_RAW_DELTA = 1, 2, 3, 4
+FORMATS = {'png': KIND_PNG, 'jpeg': KIND_JPEG, 'raw': KIND_RAW_KEY}
+MAX_MESSAGE = 1 << 16  # commands are small, anything bigger is a broken client
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+VIEWER_HTML = b"""<!doctype html>
+<html><head><title>3D Engine</title></head>
+<body style="margin:0;background:#101010">
+<img id="view" style="display:block;margin:auto;cursor:grab">
+<script>
+const ws = new WebSocket(`ws://${location.host}/ws`);
+ws.binaryType = "arraybuffer";
+const img = document.getElementById("view");
+ws.onmessage = (e) => {
+  const kind = new DataView(e.data).getUint8(0);
+  const type = kind === 2 ? "image/jpeg" : "image/png";
+  const url = URL.createObjectURL(new Blob([e.data.slice(9)], {type}));
+  img.onload = () => URL.revokeObjectURL(url);
+  img.src = url;
+};
+let drag = null;
+img.onmousedown = (e) => { drag = [e.clientX, e.clientY]; e.preventDefault(); };
+onmouseup = () => { drag = null; };
+onmousemove = (e) => {
+  if (!drag) return;
+  ws.send(JSON.stringify({orbit: [-(e.clientX - drag[0]) * 0.01, -(e.clientY - drag[1]) * 0.01]}));
+  drag = [e.clientX, e.clientY];
+};
+img.onwheel = (e) => { ws.send(JSON.stringify({zoom: Math.sign(e.deltaY)})); e.preventDefault(); };
+</script></body></html>
+"""
+
+
+# Rendering and encoding
+
+def render_engine(camera):
+    """Render the v2.py scene offscreen for a (yaw, pitch, pan_x, pan_y, dz) camera, (H, W, 3) uint8"""
+    v2.angle, v2.pitch, v2.pan_x, v2.pan_y, v2.dz = camera
+    v2.draw()
+    return v2.backend.image()
+
+def encode_image(image, kind):
+    """PNG or JPEG bytes of an (H, W, 3) image"""
+    surface = pygame.surfarray.make_surface(image.swapaxes(0, 1))
+    buffer = io.BytesIO()
+    pygame.image.save(surface, buffer, "frame.jpg" if kind == KIND_JPEG else "frame.png")
+    return buffer.getvalue()
+
+def apply_command(camera, command):
+    """New camera tuple after a JSON command, see the module docstring"""
+    yaw, pitch, pan_x, pan_y, dz = camera
+    yaw = float(command.get('yaw', yaw))
+    pitch = float(command.get('pitch', pitch))
+    pan_x = float(command.get('pan_x', pan_x))
+    pan_y = float(command.get('pan_y', pan_y))
+    dz = float(command.get('dz', dz))
+    if 'orbit' in command:
+        yaw += float(command['orbit'][0])
+        pitch += float(command['orbit'][1])
+    if 'pan' in command:
+        pan_x += float(command['pan'][0])
+        pan_y += float(command['pan'][1])
+    if 'zoom' in command:
+        dz += float(command['zoom']) * v2.ZOOM_STEP
+    pitch = min(max(pitch, -v2.MAX_PITCH), v2.MAX_PITCH)
+    near, far = v2.zoom_limits()
+    dz = min(max(dz, near), far)
+    return (yaw, pitch, pan_x, pan_y, dz)
+
+
+# Connections
+
+class TCPConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def receive(self):
+        (size,) = struct.unpack('>I', await self.reader.readexactly(4))
+        if size > MAX_MESSAGE:
+            raise ConnectionError(f"message of {size} bytes")
+        return await self.reader.readexactly(size)
+
+    async def send(self, body):
+        self.writer.write(struct.pack('>I', len(body)) + body)
+        await self.writer.drain()
+
+
+class WebSocketConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def receive(self):
+        """Payload of the next text/binary message, answers pings, raises on close"""
+        while True:
+            b0, b1 = await self.reader.readexactly(2)
+            opcode = b0 & 0x0F
+            size = b1 & 0x7F
+            if size == 126:
+                (size,) = struct.unpack('>H', await self.reader.readexactly(2))
+            elif size == 127:
+                (size,) = struct.unpack('>Q', await self.reader.readexactly(8))
+            if size > MAX_MESSAGE:
+                raise ConnectionError(f"message of {size} bytes")
+            mask = await self.reader.readexactly(4) if b1 & 0x80 else b'\0\0\0\0'
+            payload = bytearray(await self.reader.readexactly(size))
+            for i in range(size):
+                payload[i] ^= mask[i & 3]
+            if opcode == 0x8:
+                raise ConnectionError("closed by client")
+            if opcode == 0x9:
+                await self.send(bytes(payload), opcode=0xA)
+            elif opcode in (0x1, 0x2):
+                return bytes(payload)
+
+    async def send(self, body, opcode=0x2):
+        size = len(body)
+        if size < 126:
+            header = struct.pack('>BB', 0x80 | opcode, size)
+        elif size < 1 << 16:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, size)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, size)
+        self.writer.write(header + body)
+        await self.writer.drain()
+
+
+class Client:
+    def __init__(self, connection, camera):
+        self.connection = connection
+        self.camera = camera
+        self.kind = KIND_PNG
+        self.needs_frame = True
+        self.mailbox = None       # newest frame not written yet
+        self.wakeup = asyncio.Event()
+        self.previous = None      # last raw image sent, base of the next delta
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, frame):
+        if self.mailbox is not None:
+            self.dropped += 1
+        self.mailbox = frame
+        self.wakeup.set()
+
+
+# Server
+
+class FrameServer:
+    def __init__(self, render=render_engine, fps=30, spin=False, camera=(0, 0, 0, 0, 1)):
+        """render(camera) -> (height, width, 3) uint8 image, called from one worker thread"""
+        self.render = render
+        self.fps = fps
+        self.spin = spin
+        self.camera = camera
+        self.clients = set()
+        self.handlers = set()
+        self.frame_id = 0
+        self.spin_angle = 0.0
+        self.renders = 0
+        # pygame is not thread safe, all rendering and encoding goes through one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        self.server = None
+        self.ticker_task = None
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.accept, host, port)
+        self.ticker_task = asyncio.create_task(self.ticker())
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.ticker_task.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        for task in list(self.handlers):
+            task.cancel()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    async def accept(self, reader, writer):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        try:
+            start = await reader.readexactly(4)
+            if start == b'GET ':
+                connection = await self.http(reader, writer)
+                if connection is None:
+                    return
+                first = None
+            else:
+                (size,) = struct.unpack('>I', start)
+                if size > MAX_MESSAGE:
+                    return
+                connection = TCPConnection(reader, writer)
+                first = await reader.readexactly(size)
+            await self.serve(connection, first)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, KeyError, TypeError, IndexError):
+            pass  # client went away or sent garbage, drop it
+        except asyncio.CancelledError:
+            pass  # server closing
+        finally:
+            self.handlers.discard(task)
+            writer.close()
+
+    async def http(self, reader, writer):
+        """Serve the viewer page or upgrade to a WebSocket, returns the WebSocketConnection"""
+        request = await reader.readuntil(b'\r\n\r\n')
+        lines = request.decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or key is None:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: "
+                         + str(len(VIEWER_HTML)).encode() + b"\r\nConnection: close\r\n\r\n" + VIEWER_HTML)
+            await writer.drain()
+            return None
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        await writer.drain()
+        return WebSocketConnection(reader, writer)
+
+    async def serve(self, connection, first):
+        client = Client(connection, self.camera)
+        if first is not None:
+            self.command(client, first)
+        self.clients.add(client)
+        sender = asyncio.create_task(self.sender(client))
+        try:
+            while True:
+                self.command(client, await connection.receive())
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+
+    def command(self, client, message):
+        command = json.loads(message)
+        if not isinstance(command, dict):
+            raise ValueError("command must be a JSON object")
+        if 'format' in command:
+            client.kind = FORMATS[command['format']]
+            if client.kind == KIND_JPEG and not pygame.image.get_extended():
+                client.kind = KIND_PNG  # pygame built without JPEG support
+            client.previous = None
+        client.camera = apply_command(client.camera, command)
+        client.needs_frame = True
+
+    async def sender(self, client):
+        loop = asyncio.get_running_loop()
+        while True:
+            await client.wakeup.wait()
+            client.wakeup.clear()
+            frame = client.mailbox
+            client.mailbox = None
+            if frame is None:
+                continue
+            frame_id, image, encoded = frame
+            height, width = image.shape[:2]
+            kind = client.kind
+            if kind in (KIND_PNG, KIND_JPEG):
+                payload = encoded.get(kind)
+                if payload is None:
+                    # Format changed after the frame was encoded
+                    payload = await loop.run_in_executor(self.executor, encode_image, image, kind)
+            else:
+                base = client.previous
+                if base is None or base.shape != image.shape:
+                    payload = await loop.run_in_executor(None, zlib.compress, image.tobytes(), 1)
+                else:
+                    kind = KIND_RAW_DELTA
+                    delta = np.bitwise_xor(image, base)
+                    payload = await loop.run_in_executor(None, zlib.compress, delta.tobytes(), 1)
+                client.previous = image
+            await client.connection.send(FRAME_HEADER.pack(kind, width, height, frame_id) + payload)
+            client.sent += 1
+
+    def view(self, camera):
+        """Camera key actually rendered, with the shared spin added to the yaw"""
+        return (camera[0] + self.spin_angle,) + tuple(camera[1:])
+
+    async def ticker(self):
+        while True:
+            await asyncio.sleep(1 / self.fps)
+            if self.spin:
+                self.spin_angle += v2.SPIN_SPEED / self.fps
+            await self.tick()
+
+    async def tick(self):
+        """Render and hand out a frame to every client waiting for one"""
+        loop = asyncio.get_running_loop()
+        waiting = [c for c in self.clients if c.needs_frame or self.spin]
+
+        # One render, and one encoding per image format, per distinct view
+        groups = {}
+        for client in waiting:
+            # Cleared before rendering, a command arriving meanwhile asks for the next frame
+            client.needs_frame = False
+            groups.setdefault(self.view(client.camera), []).append(client)
+        for view, clients in groups.items():
+            image = await loop.run_in_executor(self.executor, self.render, view)
+            self.renders += 1
+            encoded = {}
+            for kind in {c.kind for c in clients} & {KIND_PNG, KIND_JPEG}:
+                encoded[kind] = await loop.run_in_executor(self.executor, encode_image, image, kind)
+            self.frame_id += 1
+            for client in clients:
+                client.offer((self.frame_id, image, encoded))
+
+
+# Client
+
+class FrameClient:
+    """Plain TCP client, decodes raw frames back to (H, W, 3) arrays"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.previous = None
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765, format='png'):
+        reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer)
+        await client.send({'format': format})
+        return client
+
+    async def send(self, command):
+        body = json.dumps(command).encode()
+        self.writer.write(struct.pack('>I', len(body)) + body)
+        await self.writer.drain()
+
+    async def read_frame(self):
+        """(kind, frame id, image) where image is PNG/JPEG bytes or a decoded raw array"""
+        (size,) = struct.unpack('>I', await self.reader.readexactly(4))
+        body = await self.reader.readexactly(size)
+        kind, width, height, frame_id = FRAME_HEADER.unpack_from(body)
+        payload = body[FRAME_HEADER.size:]
+        if kind in (KIND_RAW_KEY, KIND_RAW_DELTA):
+            image = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(height, width, 3)
+            if kind == KIND_RAW_DELTA:
+                image = np.bitwise_xor(image, self.previous)
+            self.previous = image
+            return kind, frame_id, image
+        return kind, frame_id, payload
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+# Round trip check
+
+async def check():
+    """Serve v2 on a free port and compare what FrameClients decode with render_engine()
+
+    The ticker is stopped and tick() driven by hand, so which clients share
+    a frame does not depend on timing. Returns a list of failure messages.
+    """
+    import config
+    v2.configure(config.update(dict(config.DEFAULTS), {'width': 160, 'height': 120, 'fps': 0,
+                                                       'backend': 'software'}))
+    loop = asyncio.get_running_loop()
+    server = FrameServer()
+    port = await server.start(port=0)
+    server.ticker_task.cancel()
+    failures = []
+
+    async def settled(ready):
+        # Commands travel over the socket, wait until the server has them
+        for _ in range(500):
+            if ready():
+                return
+            await asyncio.sleep(0.01)
+        raise TimeoutError("server never got the commands")
+
+    async def expected(client):
+        return await loop.run_in_executor(server.executor, render_engine, server.view(client.camera))
+
+    def compare(name, got, want):
+        if got.shape != want.shape:
+            failures.append(f"{name}: decoded a {got.shape} frame, render_engine() made {want.shape}")
+        elif (got != want).any():
+            failures.append(f"{name}: {int((got != want).any(axis=-1).sum())} pixels differ from render_engine()")
+
+    raw = await FrameClient.connect(port=port, format='raw')
+    pngs = [await FrameClient.connect(port=port, format='png') for _ in range(2)]
+    try:
+        await settled(lambda: len(server.clients) == 3)
+        raw_client = next(c for c in server.clients if c.kind == KIND_RAW_KEY)
+
+        # Same camera for everyone: one render, the PNG clients share its encoding
+        await server.tick()
+        kind, _, image = await raw.read_frame()
+        want = await expected(raw_client)
+        if kind != KIND_RAW_KEY:
+            failures.append(f"raw: first frame is kind {kind}, expected a keyframe")
+        compare("raw keyframe", image, want)
+        frames = [await client.read_frame() for client in pngs]
+        if server.renders != 1:
+            failures.append(f"shared png: {server.renders} renders for one view, expected 1")
+        if len({frame_id for _, frame_id, _ in frames}) != 1 or frames[0][2] != frames[1][2]:
+            failures.append("shared png: clients with the same view got different frames")
+        surface = pygame.image.load(io.BytesIO(frames[0][2]), "frame.png")
+        compare("shared png", pygame.surfarray.array3d(surface).swapaxes(0, 1), want)
+
+        # A moved camera comes as a delta against the keyframe
+        await raw.send({'orbit': [0.4, 0.2], 'zoom': 1})
+        await settled(lambda: raw_client.needs_frame)
+        await server.tick()
+        kind, _, image = await raw.read_frame()
+        if kind != KIND_RAW_DELTA:
+            failures.append(f"raw: second frame is kind {kind}, expected a delta")
+        compare("raw delta", image, await expected(raw_client))
+    finally:
+        for client in [raw] + pngs:
+            await client.close()
+        await server.close()
+    return failures
+
+
+async def run(args):
+    server = FrameServer(fps=args.fps, spin=args.spin)
+    port = await server.start(args.host, args.port)
+    print(f"Serving frames on {args.host}:{port}, viewer at http://{args.host}:{port}/")
+    await server.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream rendered frames to socket/WebSocket clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--spin", action="store_true", help="rotate the model like the viewer does")
+    parser.add_argument("--check", action="store_true", help="check a local round trip and exit")
+    args = parser.parse_args()
+    if args.check:
+        failures = asyncio.run(check())
+        for failure in failures:
+            print(f"FAILED {failure}")
+        print("frameserver round trip " + ("FAILED" if failures else "ok"))
+        sys.exit(1 if failures else 0)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,241 @@
+"""Golden image regression check, with timings of the same renders
+
+    python golden.py                      # compare against golden/, exits 1 on a regression
+    python golden.py --update             # re-render the golden images (review them first!)
+    python golden.py --timings runs.ndjson --out /tmp/golden   # log timings, keep failing images
+
+Every case renders a fixed camera of the penguin or of a synthetic mesh
+(cube, sphere, torus) headless at GOLDEN_SIZE with default settings, so
+nothing in the environment changes the output. Images are compared with
+conformance.compare(): a pixel only counts as missing or extra if the
+other image has nothing within a pixel of it, colours are compared where
+both are covered. Golden images come from the pygame backend; other
+backends are held to the looser conformance.py limits.
+
+Convex meshes cannot shadow themselves, so their shadow cases must look
+the same as with an empty shadow map: any pixel the shadow pass darkens
+there is shadow acne and fails the case, whatever the golden image says.
+
+Timings redraw each case REPEATS times with the projection cache dropped,
+so the whole transform/project/draw path is measured.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import config
+import conformance
+import mesh
+import v2
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+GOLDEN_SIZE = (400, 400)
+REPEATS = 20
+MAX_MISSING = 0.002      # same backend: practically identical
+MAX_COLOR_ERROR = 2.0
+CONVEX = ('cube', 'sphere')  # meshes that cannot shadow themselves
+
+# (yaw, pitch, pan_x, pan_y, dz)
+CAMERAS = {
+    'front': (0.0, 0.0, 0.0, 0.0, 1.0),
+    'quarter': (0.8, 0.3, 0.0, 0.0, 1.0),
+    'top': (0.3, 1.2, 0.0, 0.0, 1.2),
+    'close': (2.5, -0.4, 0.1, -0.05, 0.85),
+}
+
+
+# Synthetic meshes, about the penguin's size, as (vertices, faces)
+
+def cube():
+    vertices = [(x, y, z) for x in (-0.4, 0.4) for y in (-0.4, 0.4) for z in (-0.4, 0.4)]
+    faces = [[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1], [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]]
+    return vertices, faces
+
+def sphere(rings=8, segments=16, radius=0.5):
+    vertices = [(0, radius, 0)]
+    for r in range(1, rings):
+        theta = math.pi * r / rings
+        for s in range(segments):
+            phi = 2 * math.pi * s / segments
+            vertices.append((radius * math.sin(theta) * math.cos(phi), radius * math.cos(theta),
+                             radius * math.sin(theta) * math.sin(phi)))
+    vertices.append((0, -radius, 0))
+    ring = lambda r, s: 1 + (r - 1) * segments + s % segments
+    faces = [[0, ring(1, s + 1), ring(1, s)] for s in range(segments)]
+    for r in range(1, rings - 1):
+        faces += [[ring(r, s), ring(r, s + 1), ring(r + 1, s + 1), ring(r + 1, s)] for s in range(segments)]
+    bottom = len(vertices) - 1
+    faces += [[ring(rings - 1, s), ring(rings - 1, s + 1), bottom] for s in range(segments)]
+    return vertices, faces
+
+def torus(major=24, minor=12, r_major=0.4, r_minor=0.15):
+    vertices = []
+    for i in range(major):
+        u = 2 * math.pi * i / major
+        for j in range(minor):
+            v = 2 * math.pi * j / minor
+            d = r_major + r_minor * math.cos(v)
+            vertices.append((d * math.cos(u), r_minor * math.sin(v), d * math.sin(u)))
+    index = lambda i, j: (i % major) * minor + j % minor
+    faces = [[index(i, j), index(i, j + 1), index(i + 1, j + 1), index(i + 1, j)]
+             for i in range(major) for j in range(minor)]
+    return vertices, faces
+
+def textured_cube():
+    """cube() with the whole texture on every face, as (vertices, faces, corner uvs)"""
+    vertices, faces = cube()
+    return vertices, faces, [(0, 0), (1, 0), (1, 1), (0, 1)] * len(faces)
+
+def checker(size=64, squares=8):
+    """(size, size, 3) uint8 checkerboard with a red corner square, so flips show"""
+    cells = np.indices((size, size)) * squares // size
+    image = np.where(((cells[0] + cells[1]) % 2 == 0)[..., None], 230, 40).astype(np.uint8).repeat(3, axis=2)
+    image[:size // squares, :size // squares] = (230, 40, 40)
+    return image
+
+def synthetic(make):
+    vertices, faces, *corner_uvs = make()
+    face_indices, face_offsets = mesh.pack_faces(faces)
+    corner_uvs = np.array(corner_uvs[0], dtype=np.float32) if corner_uvs else None
+    return mesh.prepare(np.array(vertices, dtype=np.float32), face_indices, face_offsets, cache_dir=None,
+                        corner_uvs=corner_uvs)
+
+MESHES = {
+    'penguin': lambda: v2.load_model(cache=False),
+    'cube': lambda: synthetic(cube),
+    'sphere': lambda: synthetic(sphere),
+    'torus': lambda: synthetic(torus),
+    'textured_cube': lambda: synthetic(textured_cube),
+}
+TEXTURE = os.path.join(GOLDEN_DIR, "textures", "checker.png")
+
+
+def cases():
+    """name -> (mesh, camera, settings)"""
+    out = {}
+    for camera in CAMERAS:
+        out[f'penguin_{camera}'] = ('penguin', camera, {})
+    for shading in ('depth', 'flat'):
+        out[f'penguin_quarter_{shading}'] = ('penguin', 'quarter', {'edge_shading': shading})
+    out['penguin_quarter_solid'] = ('penguin', 'quarter', {'render_mode': 'solid'})
+    out['penguin_quarter_solid_shadows'] = ('penguin', 'quarter', {'render_mode': 'solid', 'shadows': True})
+    for name in ('cube', 'sphere', 'torus'):
+        out[f'{name}_quarter'] = (name, 'quarter', {})
+        out[f'{name}_quarter_solid'] = (name, 'quarter', {'render_mode': 'solid'})
+        out[f'{name}_quarter_solid_shadows'] = (name, 'quarter', {'render_mode': 'solid', 'shadows': True})
+    for camera in ('quarter', 'close'):
+        out[f'textured_cube_{camera}'] = ('textured_cube', camera, {'render_mode': 'solid', 'texture': TEXTURE})
+    return out
+
+CASES = cases()
+
+
+def render(model, camera, options, backend):
+    """(image, frame times in ms) of one case"""
+    settings = config.update(dict(config.DEFAULTS), {'resolution': GOLDEN_SIZE, 'backend': backend,
+                                                     'spin': False, **options})
+    v2.configure(settings, model)
+    v2.angle, v2.pitch, v2.pan_x, v2.pan_y, v2.dz = CAMERAS[camera]
+    v2.draw()
+    image = v2.backend.image()
+    times = []
+    for _ in range(REPEATS):
+        v2.projected_camera = None
+        start = time.perf_counter()
+        v2.draw()
+        times.append((time.perf_counter() - start) * 1000)
+    return image, times
+
+def shadow_acne(image):
+    """Pixels of image, the last render(), that differ with nothing in the shadow map"""
+    v2.shadow_map.depth.fill(np.inf)
+    v2.draw()
+    v2.shadow_map.to_light = None  # render it again next time
+    return int((v2.backend.image() != image).any(axis=-1).sum())
+
+def save_image(path, image):
+    pygame.image.save(pygame.surfarray.make_surface(image.swapaxes(0, 1)), path)
+
+def load_image(path):
+    return pygame.surfarray.array3d(pygame.image.load(path)).swapaxes(0, 1)
+
+
+def run(backend='pygame', update=False, out=None, names=None):
+    """Render every case, returns (failure messages, {case: timing dict})"""
+    max_missing, max_error = MAX_MISSING, MAX_COLOR_ERROR
+    if backend != 'pygame':
+        max_missing, max_error = conformance.MAX_MISSING, conformance.MAX_COLOR_ERROR
+    background = v2.hex_to_rgb(config.DEFAULTS['background'])
+    if not os.path.exists(TEXTURE):
+        os.makedirs(os.path.dirname(TEXTURE), exist_ok=True)
+        save_image(TEXTURE, checker())
+    models = {}
+    failures = []
+    timings = {}
+    for name, (mesh_name, camera, options) in CASES.items():
+        if names and name not in names:
+            continue
+        if mesh_name not in models:
+            models[mesh_name] = MESHES[mesh_name]()
+        image, times = render(models[mesh_name], camera, options, backend)
+        timings[name] = {'median_ms': round(statistics.median(times), 3), 'min_ms': round(min(times), 3)}
+        path = os.path.join(GOLDEN_DIR, f"{name}.png")
+        acne = shadow_acne(image) if options.get('shadows') and mesh_name in CONVEX else 0
+        if acne:
+            failures.append(f"{name}: {acne} pixels in shadow on a convex mesh")
+
+        if update:
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            save_image(path, image)
+            print(f"{name:28} written  {timings[name]['median_ms']:8.2f} ms")
+            continue
+        if not os.path.exists(path):
+            failures.append(f"{name}: no golden image, run with --update")
+            print(f"{name:28} MISSING GOLDEN")
+            continue
+
+        golden = load_image(path)
+        if golden.shape != image.shape:
+            missing, extra, error = 1.0, 1.0, 0.0
+        else:
+            missing, extra, error = conformance.compare(golden, image, background)
+        ok = missing <= max_missing and extra <= max_missing and error <= max_error
+        if not ok:
+            failures.append(f"{name}: missing {missing:.4f} extra {extra:.4f} colour error {error:.2f}")
+            if out:
+                os.makedirs(out, exist_ok=True)
+                save_image(os.path.join(out, f"{name}.png"), image)
+                if golden.shape == image.shape:
+                    diff = np.abs(golden.astype(int) - image.astype(int)).astype(np.uint8)
+                    save_image(os.path.join(out, f"{name}_diff.png"), diff)
+        print(f"{name:28} missing {missing:6.4f}  extra {extra:6.4f}  colour error {error:5.2f}  "
+              f"{timings[name]['median_ms']:8.2f} ms  {'ok' if ok and not acne else 'FAIL'}")
+    return failures, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--update', action='store_true', help="write the golden images instead of comparing")
+    parser.add_argument('--backend', default='pygame', choices=('pygame', 'software'))
+    parser.add_argument('--out', metavar='DIR', help="write failing images and diffs to DIR")
+    parser.add_argument('--timings', metavar='FILE', help="append this run's timings as one JSON line")
+    parser.add_argument('cases', nargs='*', help="only these cases")
+    args = parser.parse_args()
+
+    failures, timings = run(args.backend, args.update, args.out, args.cases)
+    if args.timings:
+        with open(args.timings, 'a') as f:
+            f.write(json.dumps({'ts': time.time(), 'backend': args.backend, 'repeats': REPEATS,
+                                'cases': timings}, separators=(',', ':')) + "\n")
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,59 @@
+"""Per-frame lighting over whole arrays
+
+One directional light plus ambient, Lambert shading. Normals come from
+Mesh.face_normals() (flat) or Mesh.vertex_normals() (Gouraud) and stay
+in model space: instead of rotating every normal with the camera, the
+light direction is rotated back into model space once per frame, so
+shading is a single (N, 3) @ (3,) product.
+
+Intensities are in [0, 1] and turned into colours by blending from the
+background to the foreground colour, so shaded wireframes fade into the
+background instead of going black.
+"""
+import numpy as np
+
+AMBIENT = 0.2
+DIFFUSE = 0.8
+# Direction towards the light in view space, upper left and slightly
+# behind the viewer (the camera looks down +z)
+LIGHT_DIRECTION = (-0.4, 0.6, -0.7)
+FAR_SHADE = 0.3  # depth shading: intensity of the farthest bucket, the nearest is 1
+
+
+def normalize(v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+def lambert(normals, to_light, ambient=AMBIENT, diffuse=DIFFUSE):
+    """Intensity of surfaces with the given unit normals, to_light in the same space"""
+    return ambient + diffuse * np.clip(normals @ normalize(to_light), 0, None)
+
+def gouraud(mesh, to_light):
+    """Per-vertex intensity (V,), interpolated along edges/triangles when drawn"""
+    return lambert(mesh.vertex_normals(), to_light)
+
+def flat(mesh, to_light):
+    """Per-face intensity (F,)"""
+    return lambert(mesh.face_normals(), to_light)
+
+def depth_buckets(z, count):
+    """Quantize view space depths into count buckets, 0 for the nearest"""
+    if not len(z):
+        return np.zeros(0, dtype=int)
+    near, far = float(z.min()), float(z.max())
+    return np.digitize(z, np.linspace(near, far, count + 1)[1:-1])
+
+def bucket_intensity(count, far_shade=FAR_SHADE):
+    """Intensity of every depth bucket, 1 for the nearest down to far_shade for the farthest"""
+    return 1 - (1 - far_shade) * np.arange(count) / max(count - 1, 1)
+
+def edge_intensity(vertex_intensity, edges):
+    """Mean intensity of the two end points of every edge"""
+    return (vertex_intensity[edges[:, 0]] + vertex_intensity[edges[:, 1]]) * 0.5
+
+def tint(intensity, color, background):
+    """(N, 3) uint8 colours between background (0) and color (1)"""
+    color = np.asarray(color, dtype=np.float32)
+    background = np.asarray(background, dtype=np.float32)
+    rgb = background + (color - background) * np.clip(intensity, 0, 1)[:, None]
+    return rgb.astype(np.uint8)
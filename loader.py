@@ -0,0 +1,189 @@
+"""Background asset loading on worker threads, with progress and partial results
+
+Reading and preprocessing a large OBJ takes seconds, done in the frame
+loop the window stops answering until it is through. A Loader runs such
+work on its own threads instead: every submitted file becomes a Job the
+frame loop polls without blocking, several jobs (a mesh and its texture,
+say) load at the same time.
+
+While a mesh loads its Job hands over the vertices read so far in chunks
+(see mesh.load_obj(progress=...)), so the renderer can show the bounding
+box or a point sample of the part that is in before the mesh is ready.
+
+    assets = Loader(on_update=lambda job: wake_up())
+    job = assets.mesh("models/dragon.obj")
+    ...
+    if job.done:
+        model = job.result()        # re-raises what the load raised
+    else:
+        lo, hi = job.bounds()       # of job.partial(), None before any vertex
+
+The workers are daemon threads, so quitting never waits for a load.
+Parsing is pure Python and holds the GIL, the interpreter still hands it
+to the frame loop every switch interval, which keeps input responsive.
+"""
+import queue
+import threading
+
+import numpy as np
+
+import mesh
+import textures
+
+WORKERS = 2
+READ_SHARE = 0.8  # of a mesh job's progress, the rest is preprocessing
+
+
+class Cancelled(Exception):
+    """Raised inside a job's work once Job.cancel() was called"""
+
+
+class Job:
+    STAGES = ('queued', 'reading', 'preprocessing', 'done', 'failed', 'cancelled')
+
+    def __init__(self, name, on_update=None):
+        self.name = name
+        self.stage = 'queued'
+        self.progress = 0.0  # 0..1
+        self.on_update = on_update
+        self.lock = threading.Lock()
+        self.chunks = []     # (k, 3) float32 vertex blocks handed over so far
+        self.lo = self.hi = None
+        self.value = None
+        self.error = None
+        self.cancelled = False
+        self.finished = threading.Event()
+
+    @property
+    def done(self):
+        """True once the work finished, failed or was cancelled"""
+        return self.finished.is_set()
+
+    def check(self):
+        """Called by the work between steps, raises Cancelled once cancel() was called"""
+        if self.cancelled:
+            raise Cancelled(self.name)
+
+    def update(self, stage=None, progress=None, vertices=None):
+        """Called by the work: new stage, progress and a block of vertices read"""
+        self.check()
+        with self.lock:
+            if stage is not None:
+                self.stage = stage
+            if progress is not None:
+                self.progress = progress
+            if vertices is not None and len(vertices):
+                self.chunks.append(vertices)
+                lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+                self.lo = lo if self.lo is None else np.minimum(self.lo, lo)
+                self.hi = hi if self.hi is None else np.maximum(self.hi, hi)
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def partial(self):
+        """(N, 3) float32 vertices handed over so far"""
+        with self.lock:
+            if len(self.chunks) > 1:
+                self.chunks = [np.concatenate(self.chunks)]
+            return self.chunks[0] if self.chunks else np.empty((0, 3), dtype=np.float32)
+
+    def bounds(self):
+        """(lo, hi) corners of the vertices so far, None before the first block"""
+        with self.lock:
+            return None if self.lo is None else (self.lo, self.hi)
+
+    def result(self, timeout=None):
+        """The work's return value, waits for it; re-raises its exception"""
+        if not self.finished.wait(timeout):
+            raise TimeoutError(self.name)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def cancel(self):
+        """Stop at the next update() or check(), a queued job does not start"""
+        self.cancelled = True
+
+    def run(self, work):
+        try:
+            if self.cancelled:
+                raise Cancelled(self.name)
+            self.value = work(self)
+            stage = 'done'
+        except Cancelled as e:
+            self.error, stage = e, 'cancelled'
+        except Exception as e:
+            self.error, stage = e, 'failed'
+        with self.lock:
+            self.stage = stage
+            self.progress = 1.0
+            self.chunks = []  # the result has them, or nobody wants them
+        self.finished.set()
+        if self.on_update is not None:
+            self.on_update(self)
+
+
+class Loader:
+    def __init__(self, workers=WORKERS, on_update=None):
+        """on_update(job) is called on the worker thread on every progress step and at the end"""
+        self.on_update = on_update
+        self.queue = queue.Queue()
+        self.threads = [threading.Thread(target=self.work, name=f"asset-loader-{i}", daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            job, work = item
+            job.run(work)
+
+    def submit(self, name, work):
+        """Job running work(job) on the next free worker"""
+        job = Job(name, self.on_update)
+        self.queue.put((job, work))
+        return job
+
+    def mesh(self, path, eps=mesh.WELD_EPSILON, cache_dir=mesh.CACHE_DIR):
+        """Job loading a mesh file like mesh.load(), partial vertices while it reads an OBJ"""
+        return self.submit(path, lambda job: load_mesh(job, path, eps, cache_dir))
+
+    def texture(self, path, mesh_path=None):
+        """Job loading an image like load_texture()"""
+        return self.submit(path or mesh_path, lambda job: load_texture(path, mesh_path))
+
+    def close(self):
+        """Cancel what is still queued and stop the workers once they are free"""
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].cancel()
+                item[0].run(None)
+        for _ in self.threads:
+            self.queue.put(None)
+
+
+def load_texture(path, mesh_path=None):
+    """Image through the shared textures.cache; without a path the one the
+    material of an OBJ mesh_path names, None if there is none"""
+    if not path and mesh_path and mesh_path.lower().endswith('.obj'):
+        path = textures.material_texture(mesh_path)
+    return textures.load(path) if path else None
+
+def load_mesh(job, path, eps=mesh.WELD_EPSILON, cache_dir=mesh.CACHE_DIR):
+    job.update('reading', 0.0)
+    if path.endswith('.npz'):
+        return mesh.load_mesh(path)
+
+    def progress(fraction, vertices):
+        job.update(progress=fraction * READ_SHARE, vertices=vertices)
+        if fraction >= 1.0:
+            job.update('preprocessing', READ_SHARE)
+    # Preprocessing a large mesh takes as long as reading it, it checks in too
+    return mesh.load(path, eps, cache_dir, progress, job.check)
@@ -0,0 +1,733 @@
+"""Mesh loading and load-time preprocessing
+
+Meshes are kept as NumPy arrays instead of the per-vertex dicts used by
+v2.py:
+
+    vertices      (V, 3) float32
+    face_indices  flat int32 vertex indices of all faces
+    face_offsets  (F + 1,) int32, face i is face_indices[offsets[i]:offsets[i + 1]]
+    edges         (E, 2) int32 unique undirected edges of the original polygons
+    triangles     (M, 3) int32 triangulation of the faces (ear clipping)
+    tri_faces     (M,) int32 face each triangle came from
+    uvs           (V, 2) float32 texture coordinates, None for untextured meshes
+    sources       (V,) int32 input vertex each vertex was made from, None unless preprocessed
+
+Preprocessing welds coincident vertices, drops degenerate and duplicate
+faces, reorders faces/vertices for cache locality and triangulates the
+faces into a fixed-stride array; wireframes keep drawing the authored
+polygon outlines from edges. OBJ texture coordinates belong to face
+corners; a vertex used with different UVs (a texture seam) is split into
+one vertex per UV so they can be stored per vertex. The result is cached
+as a binary .npz mesh so it only has to be computed once per input.
+Welding, seam splitting and reordering renumber the vertices, sources maps
+them back so per-vertex data of the input (skin weights, say) can follow.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mesh_cache")
+# Bump when the preprocessing output changes so stale caches are ignored
+CACHE_VERSION = 3
+
+WELD_EPSILON = 1e-6
+AREA_EPSILON = 1e-12
+PROGRESS_LINES = 1 << 16  # OBJ lines between load_obj() progress calls
+CHECK_FACES = 1 << 12     # faces between optimize() checkpoint calls in the slow loops
+
+# Forsyth vertex cache optimisation parameters
+CACHE_SIZE = 32
+CACHE_DECAY_POWER = 1.5
+LAST_FACE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+
+class DirtyRanges:
+    """Pending half-open [start, stop) vertex ranges, merged when taken"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    def add(self, start, stop):
+        if stop > start:
+            self.ranges.append((start, stop))
+
+    def take(self):
+        """Sorted, non-overlapping ranges added since the last take()"""
+        merged = []
+        for start, stop in sorted(self.ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+        self.ranges.clear()
+        return merged
+
+
+class Mesh:
+    # Vertices per bounding box block, updates only refit the blocks they touch
+    BOUNDS_BLOCK = 4096
+
+    def __init__(self, vertices, face_indices, face_offsets, edges=None, triangles=None, tri_faces=None,
+                 uvs=None, sources=None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self.face_indices = np.ascontiguousarray(face_indices, dtype=np.int32)
+        self.face_offsets = np.ascontiguousarray(face_offsets, dtype=np.int32)
+        if edges is None:
+            edges = unique_edges(self.face_indices, self.face_offsets)
+        self.edges = np.ascontiguousarray(edges, dtype=np.int32).reshape(-1, 2)
+        if triangles is None or tri_faces is None:
+            triangles, tri_faces = triangulate(self.vertices, self.face_indices, self.face_offsets)
+        self.triangles = np.ascontiguousarray(triangles, dtype=np.int32).reshape(-1, 3)
+        self.tri_faces = np.ascontiguousarray(tri_faces, dtype=np.int32)
+        self.uvs = None if uvs is None else np.ascontiguousarray(uvs, dtype=np.float32).reshape(-1, 2)
+        self.sources = None if sources is None else np.ascontiguousarray(sources, dtype=np.int32)
+
+        # Derived data, built on first use and then kept up to date
+        # incrementally from the ranges passed to update_vertices().
+        # Edges only depend on the topology and never need rebuilding.
+        self._trackers = []
+        self._normals_dirty = self.track()
+        self._vertex_normals_dirty = self.track()
+        self._bounds_dirty = self.track()
+        self._vertex_faces = None
+        self._face_normals = None
+        self._face_areas = None
+        self._vertex_normals = None
+        self._block_bounds = None
+
+    @property
+    def face_count(self):
+        return len(self.face_offsets) - 1
+
+    def faces(self):
+        """Faces as a list of index lists, like fs in v2.py"""
+        return unpack_faces(self.face_indices, self.face_offsets)
+
+    def columns(self):
+        """Vertices as {'x', 'y', 'z'} arrays, usable with the v2.py transforms"""
+        return {'x': self.vertices[:, 0], 'y': self.vertices[:, 1], 'z': self.vertices[:, 2]}
+
+    def nbytes(self):
+        return (self.vertices.nbytes + self.face_indices.nbytes + self.face_offsets.nbytes
+                + self.edges.nbytes + self.triangles.nbytes + self.tri_faces.nbytes
+                + (0 if self.uvs is None else self.uvs.nbytes)
+                + (0 if self.sources is None else self.sources.nbytes))
+
+    # Partial updates
+
+    def track(self):
+        """New DirtyRanges that receives every vertex range updated from now on
+
+        Used by anything caching per-vertex results (e.g. projected screen
+        coordinates) to redo only the vertices that changed.
+        """
+        ranges = DirtyRanges()
+        self._trackers.append(ranges)
+        return ranges
+
+    def mark_dirty(self, start, stop):
+        for ranges in self._trackers:
+            ranges.add(start, stop)
+
+    def update_vertices(self, start, values):
+        """Overwrite the vertices from start on with (n, 3) values in place"""
+        values = np.asarray(values, dtype=np.float32).reshape(-1, 3)
+        stop = start + len(values)
+        if start < 0 or stop > len(self.vertices):
+            raise IndexError(f"vertex range {start}:{stop} out of bounds for {len(self.vertices)} vertices")
+        self.vertices[start:stop] = values
+        self.mark_dirty(start, stop)
+
+    def update_vertex_indices(self, indices, values):
+        """Overwrite scattered vertices, each run of consecutive indices is one dirty range"""
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        self.vertices[indices] = np.asarray(values, dtype=np.float32).reshape(-1, 3)
+        if len(indices) == 0:
+            return
+        indices = np.unique(indices)
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        starts = indices[np.concatenate([[0], breaks])]
+        stops = indices[np.concatenate([breaks - 1, [len(indices) - 1]])] + 1
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            self.mark_dirty(start, stop)
+
+    def vertex_faces(self):
+        """Faces using each vertex as CSR (faces, offsets), vertex v is in faces[offsets[v]:offsets[v + 1]]"""
+        if self._vertex_faces is None:
+            counts = np.diff(self.face_offsets)
+            face_of_corner = np.repeat(np.arange(self.face_count, dtype=np.int32), counts)
+            order = np.argsort(self.face_indices, kind='stable')
+            offsets = np.zeros(len(self.vertices) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(self.face_indices, minlength=len(self.vertices)))
+            self._vertex_faces = (face_of_corner[order], offsets)
+        return self._vertex_faces
+
+    def faces_touching(self, ranges):
+        """Unique faces that use any vertex of the given ranges"""
+        faces, offsets = self.vertex_faces()
+        parts = [faces[offsets[start]:offsets[stop]] for start, stop in ranges]
+        if not parts:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(parts))
+
+    # Derived data
+
+    def face_normals(self):
+        """Unit face normals (F, 3), refreshed only for faces around updated vertices"""
+        if self._face_normals is None:
+            self._normals_dirty.take()
+            vectors = face_vectors(self.vertices, self.face_indices, self.face_offsets)
+            self._face_normals, self._face_areas = split_face_vectors(vectors)
+        elif self._normals_dirty:
+            touched = self.faces_touching(self._normals_dirty.take())
+            vectors = face_vectors(self.vertices, self.face_indices, self.face_offsets, touched)
+            self._face_normals[touched], self._face_areas[touched] = split_face_vectors(vectors)
+        return self._face_normals
+
+    def face_areas(self):
+        self.face_normals()
+        return self._face_areas
+
+    def vertex_normals(self):
+        """Unit area weighted vertex normals (V, 3)
+
+        After an update only the vertices sharing a face with an updated
+        vertex are recomputed.
+        """
+        face_normals = self.face_normals()
+        if self._vertex_normals is None:
+            self._vertex_normals_dirty.take()
+            vertices = np.arange(len(self.vertices))
+            self._vertex_normals = np.zeros((len(self.vertices), 3), dtype=np.float32)
+        elif self._vertex_normals_dirty:
+            faces = self.faces_touching(self._vertex_normals_dirty.take())
+            corners, _ = concat_ranges(self.face_offsets[faces], np.diff(self.face_offsets)[faces])
+            vertices = np.unique(self.face_indices[corners])
+        else:
+            return self._vertex_normals
+
+        # Sum the area weighted normals of the faces around each vertex
+        faces, offsets = self.vertex_faces()
+        starts = offsets[vertices]
+        counts = offsets[vertices + 1] - starts
+        used = counts > 0
+        positions, group = concat_ranges(starts[used], counts[used])
+        around = faces[positions]
+        weighted = face_normals[around] * self._face_areas[around, None]
+        sums = np.zeros((len(vertices), 3), dtype=np.float32)
+        if len(positions):
+            sums[used] = np.add.reduceat(weighted, group, axis=0)
+        self._vertex_normals[vertices] = split_face_vectors(sums)[0]
+        return self._vertex_normals
+
+    def bounds(self):
+        """Axis aligned (min, max) box of all vertices"""
+        block = self.BOUNDS_BLOCK
+        if self._block_bounds is None:
+            self._bounds_dirty.take()
+            dirty_blocks = range((len(self.vertices) + block - 1) // block)
+            self._block_bounds = np.empty((len(dirty_blocks), 2, 3), dtype=np.float32)
+        else:
+            dirty_blocks = sorted({b for start, stop in self._bounds_dirty.take()
+                                   for b in range(start // block, (stop - 1) // block + 1)})
+        for b in dirty_blocks:
+            chunk = self.vertices[b * block:(b + 1) * block]
+            self._block_bounds[b, 0] = chunk.min(axis=0)
+            self._block_bounds[b, 1] = chunk.max(axis=0)
+        if len(self._block_bounds) == 0:
+            return np.zeros(3, dtype=np.float32), np.zeros(3, dtype=np.float32)
+        return self._block_bounds[:, 0].min(axis=0), self._block_bounds[:, 1].max(axis=0)
+
+
+def face_vectors(vertices, face_indices, face_offsets, faces=None):
+    """Newell normal of each face (or of the given faces), its length is twice the face area"""
+    if faces is None:
+        faces = np.arange(len(face_offsets) - 1)
+    if len(faces) == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+    starts = face_offsets[faces]
+    counts = face_offsets[faces + 1] - starts
+    # Position of every corner of the selected faces in face_indices,
+    # and of the corner after it (wrapping to the first corner)
+    corner, group = concat_ranges(starts, counts)
+    following = corner + 1
+    following[group + counts - 1] = starts
+    a = vertices[face_indices[corner]]
+    b = vertices[face_indices[following]]
+    return np.add.reduceat(np.cross(a, b), group, axis=0)
+
+def concat_ranges(starts, counts):
+    """Positions of the ranges [start, start + count) back to back, and where each range begins"""
+    group = np.zeros(len(starts), dtype=np.int64)
+    group[1:] = np.cumsum(counts)[:-1]
+    return np.arange(int(np.sum(counts))) + np.repeat(starts - group, counts), group
+
+def split_face_vectors(vectors):
+    """Newell normals to (unit normals, areas), zero area faces get a zero normal"""
+    length = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+    normals = np.divide(vectors, length[:, None], out=np.zeros_like(vectors), where=length[:, None] > 0)
+    return normals, 0.5 * length
+
+
+# Conversions
+
+def from_dicts(vs, fs):
+    """Convert v2.py style vertex dicts and face lists to arrays"""
+    vertices = np.array([(v['x'], v['y'], v['z']) for v in vs], dtype=np.float32)
+    face_indices, face_offsets = pack_faces(fs)
+    return vertices, face_indices, face_offsets
+
+def pack_faces(faces):
+    """Ragged face lists to flat indices + offsets"""
+    offsets = np.zeros(len(faces) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(f) for f in faces])
+    indices = np.fromiter((i for f in faces for i in f), dtype=np.int32, count=offsets[-1])
+    return indices, offsets
+
+def unpack_faces(face_indices, face_offsets):
+    return [face_indices[a:b].tolist() for a, b in zip(face_offsets[:-1], face_offsets[1:])]
+
+def unique_edges(face_indices, face_offsets):
+    """Undirected edges of all faces, each shared edge only once"""
+    if len(face_indices) == 0:
+        return np.zeros((0, 2), dtype=np.int32)
+    # Edge i goes from vertex i to the next vertex of the same face,
+    # the last vertex of a face wraps around to its first
+    nxt = np.arange(1, len(face_indices) + 1)
+    nxt[face_offsets[1:] - 1] = face_offsets[:-1]
+    a = face_indices
+    b = face_indices[nxt]
+    edges = np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    # np.unique sorts by first vertex, neighbouring edges share vertices
+    return np.unique(edges, axis=0).astype(np.int32)
+
+
+# Triangulation
+
+def triangulate(vertices, face_indices, face_offsets):
+    """Split faces into triangles, returns (triangles (M, 3), tri_faces (M,))
+
+    Faces are handled in groups of equal vertex count. Triangles pass
+    through, convex polygons become fans, both vectorized per group;
+    only concave polygons go through ear clipping one by one. Triangles
+    keep the winding of their polygon and come out in face order.
+    """
+    counts = np.diff(face_offsets)
+    parts = []
+    for n in np.unique(counts).tolist():
+        if n < 3:
+            continue
+        faces = np.flatnonzero(counts == n)
+        corners = face_indices[face_offsets[faces][:, None] + np.arange(n)]  # (G, n)
+        if n == 3:
+            parts.append((corners, faces))
+            continue
+
+        # Convex if every corner turns the same way as the face normal
+        points = vertices[corners].astype(np.float64)
+        edge_vectors = np.roll(points, -1, axis=1) - points
+        turns = np.cross(edge_vectors, np.roll(edge_vectors, -1, axis=1))
+        normal = np.cross(points, np.roll(points, -1, axis=1)).sum(axis=1)
+        convex = (np.einsum('gnk,gk->gn', turns, normal) >= 0).all(axis=1)
+
+        k = np.arange(1, n - 1)
+        fans = np.stack([np.broadcast_to(corners[convex, :1], (convex.sum(), n - 2)),
+                         corners[convex][:, k], corners[convex][:, k + 1]], axis=2)
+        parts.append((fans.reshape(-1, 3), np.repeat(faces[convex], n - 2)))
+
+        for face, polygon, pts, nrm in zip(faces[~convex], corners[~convex], points[~convex], normal[~convex]):
+            # Project onto the plane the polygon faces most, then clip ears in 2D
+            drop = int(np.argmax(np.abs(nrm)))
+            keep = [a for a in range(3) if a != drop]
+            ears = ear_clip(pts[:, keep])
+            parts.append((polygon[ears].reshape(-1, 3), np.full(len(ears), face)))
+
+    if not parts:
+        return np.zeros((0, 3), dtype=np.int32), np.zeros(0, dtype=np.int32)
+    triangles = np.concatenate([t for t, _ in parts]).astype(np.int32)
+    tri_faces = np.concatenate([f for _, f in parts]).astype(np.int32)
+    order = np.argsort(tri_faces, kind='stable')
+    return triangles[order], tri_faces[order]
+
+def ear_clip(points):
+    """Triangulate a simple polygon given by (n, 2) points, returns (n - 2, 3) corner indices"""
+    n = len(points)
+    x, y = points[:, 0], points[:, 1]
+    area = float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+    # Clip in counter clockwise order, flip the triangles back at the end
+    ring = list(range(n)) if area >= 0 else list(range(n - 1, -1, -1))
+
+    triangles = []
+    while len(ring) > 3:
+        for k in range(len(ring)):
+            i0, i1, i2 = ring[k - 1], ring[k], ring[(k + 1) % len(ring)]
+            a, b, c = points[i0], points[i1], points[i2]
+            if (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0]) <= 0:
+                continue  # reflex or collinear corner
+            others = points[[i for i in ring if i not in (i0, i1, i2)]]
+            if len(others) and point_in_triangle(others, a, b, c).any():
+                continue
+            triangles.append((i0, i1, i2))
+            del ring[k]
+            break
+        else:
+            # Self intersecting or degenerate leftovers, close them with a fan
+            triangles.extend((ring[0], ring[k], ring[k + 1]) for k in range(1, len(ring) - 1))
+            ring = []
+            break
+    if ring:
+        triangles.append(tuple(ring))
+
+    triangles = np.array(triangles, dtype=np.int64).reshape(-1, 3)
+    return triangles if area >= 0 else triangles[:, ::-1]
+
+def point_in_triangle(p, a, b, c):
+    """Which of the (k, 2) points are inside or on the counter clockwise triangle abc"""
+    def side(u, v):
+        return (v[0] - u[0]) * (p[:, 1] - u[1]) - (v[1] - u[1]) * (p[:, 0] - u[0])
+    return (side(a, b) >= 0) & (side(b, c) >= 0) & (side(c, a) >= 0)
+
+
+# OBJ loading
+
+def load_obj(path, progress=None):
+    """Read v/vt/f records of a Wavefront OBJ file
+
+    Returns (vertices, face_indices, face_offsets, corner_uvs), corner_uvs
+    is (len(face_indices), 2) float32 or None if the file has no vt records.
+    Corners without a vt reference get (0, 0).
+
+    progress(fraction, new_vertices) is called every PROGRESS_LINES lines
+    and at the end with the fraction of the file read and the (k, 3)
+    vertices read since the previous call.
+    """
+    vertices = []
+    texcoords = []
+    faces = []
+    corner_texcoords = []
+    total = max(os.path.getsize(path), 1)
+    done = 0
+    reported = 0
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if progress is not None:
+                done += len(line)
+                if n % PROGRESS_LINES == 0:
+                    progress(min(done / total, 1.0), np.array(vertices[reported:], dtype=np.float32).reshape(-1, 3))
+                    reported = len(vertices)
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'v':
+                vertices.append([float(c) for c in parts[1:4]])
+            elif parts[0] == 'vt':
+                texcoords.append([float(c) for c in parts[1:3]])
+            elif parts[0] == 'f':
+                face = []
+                for ref in parts[1:]:
+                    refs = ref.split('/')
+                    i = int(refs[0])
+                    # OBJ indices start from 1, negative ones count from the end
+                    face.append(i - 1 if i > 0 else len(vertices) + i)
+                    t = int(refs[1]) if len(refs) > 1 and refs[1] else 0
+                    corner_texcoords.append(t - 1 if t > 0 else len(texcoords) + t if t < 0 else -1)
+                faces.append(face)
+    if progress is not None:
+        progress(1.0, np.array(vertices[reported:], dtype=np.float32).reshape(-1, 3))
+    face_indices, face_offsets = pack_faces(faces)
+    corner_uvs = None
+    if texcoords:
+        texcoords = np.array(texcoords + [[0.0, 0.0]], dtype=np.float32)  # -1 picks the (0, 0) row
+        corner_uvs = texcoords[np.array(corner_texcoords, dtype=np.int64)]
+    return np.array(vertices, dtype=np.float32).reshape(-1, 3), face_indices, face_offsets, corner_uvs
+
+
+# Preprocessing
+
+def weld_vertices(vertices, eps=WELD_EPSILON):
+    """Merge vertices closer than eps, returns (welded vertices, remap)
+
+    Vertices are hashed into a grid of cell size eps, so any vertex within
+    eps of another one is in the same or a neighbouring cell.
+    """
+    count = len(vertices)
+    remap = np.empty(count, dtype=np.int64)
+    if count == 0:
+        return vertices.copy(), remap
+
+    cells = np.floor(vertices / eps).astype(np.int64)
+    # Exact cell matches first, vectorized
+    keys, first, inverse = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Then merge representatives of neighbouring cells that are within eps
+    grid = {tuple(k): n for n, k in enumerate(keys.tolist())}
+    reps = vertices[first]
+    rep_of = np.arange(len(keys))
+    offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+               if (dx, dy, dz) != (0, 0, 0)]
+    eps2 = eps * eps
+    for n, (cx, cy, cz) in enumerate(keys.tolist()):
+        if rep_of[n] != n:
+            continue
+        for dx, dy, dz in offsets:
+            m = grid.get((cx + dx, cy + dy, cz + dz))
+            if m is None or m <= n or rep_of[m] != m:
+                continue
+            d = reps[m] - reps[n]
+            if float(d @ d) <= eps2:
+                rep_of[m] = n
+
+    # Compact the surviving representatives in order of first appearance
+    order = np.argsort(first, kind='stable')
+    new_index = np.full(len(keys), -1, dtype=np.int64)
+    kept = order[rep_of[order] == order]
+    new_index[kept] = np.arange(len(kept))
+    new_index = new_index[rep_of]
+    remap[:] = new_index[inverse]
+    return vertices[first[kept]], remap
+
+def split_seams(vertices, face_indices, corner_uvs):
+    """One vertex per distinct (vertex, UV) pair of the face corners
+
+    Returns (vertices, face_indices, uvs) with per vertex uvs, vertices no
+    face uses are dropped.
+    """
+    corner_uvs = np.ascontiguousarray(corner_uvs, dtype=np.float32).reshape(-1, 2)
+    # Compare UVs by their bits, only exactly equal ones share a vertex
+    keys = np.column_stack([face_indices.astype(np.int64), corner_uvs.view(np.int32).astype(np.int64)])
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return vertices[face_indices[first]], inverse.reshape(-1).astype(np.int32), corner_uvs[first]
+
+def clean_faces(vertices, faces, area_eps=AREA_EPSILON, checkpoint=None):
+    """Drop faces that collapsed to less than 3 vertices, have no area or are duplicates"""
+    seen = set()
+    result = []
+    for n, face in enumerate(faces):
+        if checkpoint is not None and n % CHECK_FACES == 0:
+            checkpoint()
+        # Welding can make neighbouring indices of a face equal
+        face = [i for n, i in enumerate(face) if i != face[n - 1]] if len(face) > 1 else face
+        if len(set(face)) < 3:
+            continue
+        if polygon_area(vertices[face]) <= area_eps:
+            continue
+        # Same vertex set is the same face, whatever the winding or start vertex
+        key = tuple(sorted(face))
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(face)
+    return result
+
+def polygon_area(points):
+    """Area of a planar polygon via Newell's method"""
+    normal = np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0)
+    return 0.5 * float(np.sqrt(normal @ normal))
+
+def optimize_face_order(faces, vertex_count, cache_size=CACHE_SIZE, checkpoint=None):
+    """Reorder faces for post-transform cache locality (Forsyth)"""
+    if not faces:
+        return []
+
+    vertex_faces = [[] for _ in range(vertex_count)]
+    for f, face in enumerate(faces):
+        for v in face:
+            vertex_faces[v].append(f)
+
+    remaining = [len(fl) for fl in vertex_faces]
+    position = [-1] * vertex_count
+    added = [False] * len(faces)
+
+    def vertex_score(v):
+        if remaining[v] == 0:
+            return -1.0
+        score = 0.0
+        pos = position[v]
+        if pos >= 0:
+            if pos < 3:
+                score = LAST_FACE_SCORE
+            else:
+                score = (1.0 - (pos - 3) / (cache_size - 3)) ** CACHE_DECAY_POWER
+        return score + VALENCE_BOOST_SCALE * remaining[v] ** -VALENCE_BOOST_POWER
+
+    vscore = [vertex_score(v) for v in range(vertex_count)]
+    fscore = [sum(vscore[v] for v in face) for face in faces]
+
+    order = []
+    cache = []
+    best = max(range(len(faces)), key=fscore.__getitem__)
+    cursor = 0
+    while best is not None:
+        if checkpoint is not None and len(order) % CHECK_FACES == 0:
+            checkpoint()
+        added[best] = True
+        order.append(best)
+        face = faces[best]
+
+        for v in face:
+            remaining[v] -= 1
+            vertex_faces[v].remove(best)
+
+        # Face vertices go to the front of the LRU cache
+        old_cache = cache
+        cache = list(dict.fromkeys(face))
+        cache += [v for v in old_cache if v not in cache]
+        evicted = cache[cache_size:]
+        cache = cache[:cache_size]
+        for v in evicted:
+            position[v] = -1
+        for n, v in enumerate(cache):
+            position[v] = n
+
+        # Rescore everything touched by the cache change, pick the best candidate
+        touched = set()
+        for v in cache + evicted:
+            vscore[v] = vertex_score(v)
+            touched.update(vertex_faces[v])
+        best = None
+        best_score = -1.0
+        for f in touched:
+            s = fscore[f] = sum(vscore[v] for v in faces[f])
+            if s > best_score:
+                best, best_score = f, s
+
+        if best is None:
+            # Nothing in the cache left to continue with, start a new strip
+            while cursor < len(faces) and added[cursor]:
+                cursor += 1
+            best = cursor if cursor < len(faces) else None
+    return [faces[f] for f in order]
+
+def optimize_vertex_order(vertices, faces, uvs=None):
+    """Renumber vertices (and their uvs) by first use in the face stream, drops unused ones"""
+    new_index = {}
+    for face in faces:
+        for v in face:
+            if v not in new_index:
+                new_index[v] = len(new_index)
+    order = np.fromiter(new_index.keys(), dtype=np.int64, count=len(new_index))
+    faces = [[new_index[v] for v in face] for face in faces]
+    return vertices[order], faces, None if uvs is None else uvs[order]
+
+def optimize(vertices, face_indices, face_offsets, eps=WELD_EPSILON, corner_uvs=None, checkpoint=None):
+    """Full load-time preprocessing pass, returns a Mesh
+
+    checkpoint() is called between the stages and every CHECK_FACES faces
+    in the slow ones, an exception it raises aborts the pass.
+    """
+    checkpoint = checkpoint or (lambda: None)
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    vertices, remap = weld_vertices(vertices, eps)
+    checkpoint()
+    # Input vertex of every welded one, the first of those welded into it
+    _, sources = np.unique(remap, return_index=True)
+    face_indices = remap[face_indices]
+    uvs = None
+    if corner_uvs is not None:
+        # Split and renumber indices into the vertices, which then follow them
+        split, face_indices, uvs = split_seams(np.arange(len(vertices)), face_indices, corner_uvs)
+        vertices, sources = vertices[split], sources[split]
+        checkpoint()
+    faces = unpack_faces(face_indices, face_offsets)
+    faces = clean_faces(vertices, faces, checkpoint=checkpoint)
+    faces = optimize_face_order(faces, len(vertices), checkpoint=checkpoint)
+    checkpoint()
+    order, faces, uvs = optimize_vertex_order(np.arange(len(vertices)), faces, uvs)
+    face_indices, face_offsets = pack_faces(faces)
+    return Mesh(vertices[order], face_indices, face_offsets, uvs=uvs, sources=sources[order])
+
+
+# Binary mesh cache
+
+def temporary_file(folder, suffix=".tmp"):
+    """(open binary file, path) of a new uniquely named file in folder
+
+    Like tempfile.mkstemp(), but with the permissions open() gives, the
+    umask applies: the umask can only be read by setting it, for the whole
+    process, while other threads create files.
+    """
+    while True:
+        path = os.path.join(folder, os.urandom(8).hex() + suffix)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        except FileExistsError:
+            continue
+        return os.fdopen(fd, 'wb'), path
+
+def save_mesh(path, mesh):
+    """Write mesh to path, or to an open binary file"""
+    extra = {name: getattr(mesh, name) for name in ('uvs', 'sources') if getattr(mesh, name) is not None}
+    with (open(path, 'wb') if isinstance(path, (str, os.PathLike)) else path) as f:
+        np.savez(f, version=CACHE_VERSION, vertices=mesh.vertices,
+                 face_indices=mesh.face_indices, face_offsets=mesh.face_offsets,
+                 edges=mesh.edges, triangles=mesh.triangles, tri_faces=mesh.tri_faces, **extra)
+
+def load_mesh(path):
+    with np.load(path) as data:
+        if int(data['version']) != CACHE_VERSION:
+            raise ValueError(f"{path}: mesh cache version {int(data['version'])}, "
+                             f"expected {CACHE_VERSION}")
+        uvs = data['uvs'] if 'uvs' in data.files else None
+        sources = data['sources'] if 'sources' in data.files else None
+        return Mesh(data['vertices'], data['face_indices'], data['face_offsets'], data['edges'],
+                    data['triangles'], data['tri_faces'], uvs, sources)
+
+def cache_key(vertices, face_indices, face_offsets, eps=WELD_EPSILON, corner_uvs=None):
+    h = hashlib.sha1()
+    h.update(f"{CACHE_VERSION}:{eps!r}".encode())
+    arrays = (vertices, face_indices, face_offsets) + (() if corner_uvs is None else (corner_uvs,))
+    for array in arrays:
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+def prepare(vertices, face_indices, face_offsets, eps=WELD_EPSILON, cache_dir=CACHE_DIR, corner_uvs=None,
+            checkpoint=None):
+    """optimize() with the result cached in cache_dir, pass cache_dir=None to skip caching
+
+    corner_uvs (len(face_indices), 2) are texture coordinates per face corner, as load_obj() reads them.
+    checkpoint is passed on to optimize().
+    """
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    face_indices = np.asarray(face_indices, dtype=np.int32)
+    face_offsets = np.asarray(face_offsets, dtype=np.int32)
+    if corner_uvs is not None:
+        corner_uvs = np.asarray(corner_uvs, dtype=np.float32).reshape(-1, 2)
+    if cache_dir is None:
+        return optimize(vertices, face_indices, face_offsets, eps, corner_uvs, checkpoint)
+
+    path = os.path.join(cache_dir, cache_key(vertices, face_indices, face_offsets, eps, corner_uvs) + ".npz")
+    if os.path.exists(path):
+        try:
+            return load_mesh(path)
+        except (OSError, ValueError, KeyError):
+            pass  # unreadable or stale, rebuild it
+    mesh = optimize(vertices, face_indices, face_offsets, eps, corner_uvs, checkpoint)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so a crash never leaves a torn cache entry,
+    # a unique one as other threads or processes may be writing the same entry
+    f, tmp = temporary_file(cache_dir)
+    try:
+        save_mesh(f, mesh)  # closes f
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return mesh
+
+def load(path, eps=WELD_EPSILON, cache_dir=CACHE_DIR, progress=None, checkpoint=None):
+    """Load an .obj (preprocessed and cached) or an already preprocessed .npz mesh,
+    progress as for load_obj(), checkpoint as for optimize()"""
+    if path.endswith('.npz'):
+        return load_mesh(path)
+    vertices, face_indices, face_offsets, corner_uvs = load_obj(path, progress)
+    return prepare(vertices, face_indices, face_offsets, eps=eps, cache_dir=cache_dir, corner_uvs=corner_uvs,
+                   checkpoint=checkpoint)
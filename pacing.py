@@ -0,0 +1,113 @@
+"""Adaptive quality: trade detail for speed to hold a frame time target
+
+clock.tick() only caps the frame rate, nothing gives when frames run
+long. QualityController watches the measured frame times and steps
+through QUALITY_LEVELS, 0 is full quality and every level after it is
+cheaper:
+
+    scale       render resolution scale, the frame is drawn smaller and scaled up
+    line_width  wireframe line width in pixels
+    min_edge    wireframe LOD, edges shorter than this on screen (pixels) are skipped
+    cull        solid mode back face culling
+
+Hysteresis keeps it from oscillating between two levels:
+
+- decisions use the median of the last WINDOW frames, single spikes
+  (a GC pause, a chunk load) do not count
+- it steps down when the median is over the target by DOWN_MARGIN, but
+  only steps up when it is under by UP_MARGIN, the better level costs more
+- after a change the next SETTLE frames are ignored and the window starts
+  over, so the median only sees frames of the new level
+- stepping up needs HOLD frames under the up threshold; if the level it
+  stepped up to has to be left again within RETRY frames, that level's
+  hold doubles (up to MAX_HOLD) so it is not retried every second
+
+Every change is logged (log, default print) and kept in decisions.
+
+    pacer = QualityController(target_ms=16.6)
+    if pacer.record(frame_ms):
+        apply(pacer.quality)
+"""
+import statistics
+from collections import deque
+
+TARGET_MS = 1000 / 60
+WINDOW = 30          # frames in the median
+SETTLE = 5           # frames ignored after a change (the first one is often a resize)
+DOWN_MARGIN = 0.10   # step down when the median is 10% over the target
+UP_MARGIN = 0.30     # step up only when it is 30% under
+HOLD = 60            # frames under the up threshold before stepping up
+MAX_HOLD = 1920
+RETRY = 120          # a level left again within this many frames failed
+
+QUALITY_LEVELS = (
+    {'scale': 1.0, 'line_width': 3, 'min_edge': 0.0, 'cull': False},
+    {'scale': 1.0, 'line_width': 2, 'min_edge': 1.0, 'cull': True},
+    {'scale': 0.75, 'line_width': 2, 'min_edge': 2.0, 'cull': True},
+    {'scale': 0.5, 'line_width': 1, 'min_edge': 3.0, 'cull': True},
+)
+
+
+class QualityController:
+    def __init__(self, target_ms=TARGET_MS, levels=QUALITY_LEVELS, window=WINDOW, log=print):
+        self.target_ms = target_ms
+        self.levels = levels
+        self.level = 0
+        self.times = deque(maxlen=window)
+        self.log = log
+        self.frames = 0
+        self.settle = 0
+        self.under = 0  # frames in a row under the up threshold
+        self.hold = [HOLD] * len(levels)  # frames under before stepping up to each level
+        self.raised = None  # (frame, level) of the last step up
+        self.decisions = deque(maxlen=100)
+
+    @property
+    def quality(self):
+        return self.levels[self.level]
+
+    def record(self, frame_ms):
+        """Feed the time one frame took, returns True if the quality level changed"""
+        self.frames += 1
+        if self.settle:
+            self.settle -= 1
+            return False
+        self.times.append(frame_ms)
+        if len(self.times) < self.times.maxlen:
+            return False
+
+        median = statistics.median(self.times)
+        if median > self.target_ms * (1 + DOWN_MARGIN):
+            self.under = 0
+            if self.level + 1 < len(self.levels):
+                if self.raised is not None and self.raised[1] == self.level and self.frames - self.raised[0] <= RETRY:
+                    # Just came up to this level and it does not hold, wait longer next time
+                    self.hold[self.level] = min(self.hold[self.level] * 2, MAX_HOLD)
+                self.change(self.level + 1, 'over budget', median)
+                return True
+        elif median < self.target_ms * (1 - UP_MARGIN) and self.level > 0:
+            self.under += 1
+            if self.under >= self.hold[self.level - 1]:
+                self.raised = (self.frames, self.level - 1)
+                self.change(self.level - 1, 'under budget', median)
+                return True
+        else:
+            self.under = 0
+        return False
+
+    def change(self, level, reason, median):
+        decision = {'frame': self.frames, 'from': self.level, 'to': level, 'reason': reason,
+                    'median_ms': round(median, 2), 'target_ms': round(self.target_ms, 2)}
+        self.decisions.append(decision)
+        if self.log is not None:
+            self.log(f"quality {self.level} -> {level} ({reason}: median {median:.1f} ms, "
+                     f"target {self.target_ms:.1f} ms) {self.levels[level]}")
+        self.level = level
+        self.times.clear()
+        self.settle = SETTLE
+        self.under = 0
+
+    def reset(self):
+        """Back to full quality, e.g. after the scene changed"""
+        if self.level:
+            self.change(0, 'reset', statistics.median(self.times) if self.times else 0.0)
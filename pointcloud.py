@@ -0,0 +1,284 @@
+"""Point cloud rendering for very large scans
+
+Points are never loaded as Python objects. A scan (.npy or raw float32
+x y z triples) is memory-mapped and converted once into a level-of-detail
+file next to it:
+
+    <scan>.lod.npy   (N, 3) float32 points, reordered coarse to fine
+    <scan>.lod.npz   level/chunk offsets and per-chunk bounding boxes
+
+The reordering is a linearized octree: points are sorted by Morton code
+and each one gets the depth of the shallowest octree cell it is the first
+point of. Sorting by (level, Morton code) puts one point per occupied cell
+of every depth before any finer detail, so any prefix of the file is an
+evenly spread subsample of the scan and every chunk is spatially compact.
+
+PointRenderer splats chunks into a NumPy colour/depth framebuffer with a
+depth test, in file order, and stops when the per-frame time budget is
+spent. While the camera stays put the next frames continue where it
+stopped, so the image refines from coarse to fine.
+"""
+import os
+import time
+
+import numpy as np
+
+MAX_DEPTH = 10           # octree depth used for the LOD levels (1024^3 cells)
+CHUNK_POINTS = 1 << 16   # points per streamed chunk
+BUILD_BLOCK = 1 << 22    # points per block while building, bounds the temporary memory
+NEAR = 0.01              # points closer to the camera than this are clipped
+FRAME_BUDGET = 0.010     # seconds of splatting per frame
+FAR_SHADE = 0.3          # brightness of the farthest points, the nearest are at 1
+
+LOD_VERSION = 1
+
+
+def open_points(path):
+    """Memory-map an (N, 3) float32 .npy or a raw little endian float32 xyz file"""
+    if path.endswith('.npy'):
+        points = np.load(path, mmap_mode='r')
+    else:
+        points = np.memmap(path, dtype='<f4', mode='r')
+        if len(points) % 3:
+            raise ValueError(f"{path}: size is not a multiple of 3 float32 values")
+        points = points.reshape(-1, 3)
+    if points.ndim != 2 or points.shape[1] != 3:
+        raise ValueError(f"{path}: expected (N, 3) points, got {points.shape}")
+    return points
+
+
+# LOD build
+
+def part1by2(v):
+    """Spread the low 10 bits of v so there are two zero bits between each"""
+    v = v.astype(np.uint32)
+    v = (v | (v << 16)) & 0x030000FF
+    v = (v | (v << 8)) & 0x0300F00F
+    v = (v | (v << 4)) & 0x030C30C3
+    v = (v | (v << 2)) & 0x09249249
+    return v
+
+def morton_codes(points, lo, scale):
+    cells = np.clip(((points - lo) * scale).astype(np.int64), 0, (1 << MAX_DEPTH) - 1)
+    return part1by2(cells[:, 0]) | (part1by2(cells[:, 1]) << 1) | (part1by2(cells[:, 2]) << 2)
+
+def blockwise_bounds(points):
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    for start in range(0, len(points), BUILD_BLOCK):
+        block = np.asarray(points[start:start + BUILD_BLOCK], dtype=np.float64)
+        lo = np.minimum(lo, block.min(axis=0))
+        hi = np.maximum(hi, block.max(axis=0))
+    return lo, hi
+
+def build_lod(points, lod_points_path, lod_index_path):
+    """Write the coarse-to-fine reordering of points, see the module docstring"""
+    count = len(points)
+    if count == 0:
+        raise ValueError("empty point cloud")
+    lo, hi = blockwise_bounds(points)
+    scale = (1 << MAX_DEPTH) / np.maximum(hi - lo, 1e-12).max()
+
+    codes = np.empty(count, dtype=np.uint32)
+    for start in range(0, count, BUILD_BLOCK):
+        codes[start:start + BUILD_BLOCK] = morton_codes(
+            np.asarray(points[start:start + BUILD_BLOCK], dtype=np.float64), lo, scale)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+
+    # Level of a point: shallowest depth at which it is the first point of its cell
+    level = np.full(count, MAX_DEPTH + 1, dtype=np.uint8)
+    for depth in range(MAX_DEPTH, -1, -1):
+        cells = codes >> np.uint32(3 * (MAX_DEPTH - depth))
+        first = np.ones(count, dtype=bool)
+        first[1:] = cells[1:] != cells[:-1]
+        level[first] = depth
+    del codes
+
+    # Sort by level, Morton order is kept within a level (stable)
+    by_level = np.argsort(level, kind='stable')
+    order = order[by_level]
+    level = level[by_level]
+    del by_level
+    level_offsets = np.searchsorted(level, np.arange(MAX_DEPTH + 3)).astype(np.int64)
+
+    # Chunks never straddle two levels so coarse data can be read on its own
+    chunk_offsets = [0]
+    for start, stop in zip(level_offsets[:-1], level_offsets[1:]):
+        chunk_offsets.extend(range(start + CHUNK_POINTS, stop, CHUNK_POINTS))
+        if stop > chunk_offsets[-1]:
+            chunk_offsets.append(stop)
+    chunk_offsets = np.array(chunk_offsets, dtype=np.int64)
+
+    out = np.lib.format.open_memmap(lod_points_path + '.tmp', mode='w+', dtype=np.float32, shape=(count, 3))
+    chunk_bounds = np.empty((len(chunk_offsets) - 1, 2, 3), dtype=np.float32)
+    for c, (start, stop) in enumerate(zip(chunk_offsets[:-1], chunk_offsets[1:])):
+        # Gather in sorted index order for sequential reads of the source
+        idx = order[start:stop]
+        perm = np.argsort(idx)
+        chunk = np.empty((stop - start, 3), dtype=np.float32)
+        chunk[perm] = points[idx[perm]]
+        out[start:stop] = chunk
+        chunk_bounds[c, 0] = chunk.min(axis=0)
+        chunk_bounds[c, 1] = chunk.max(axis=0)
+    out.flush()
+    del out
+    os.replace(lod_points_path + '.tmp', lod_points_path)
+
+    with open(lod_index_path + '.tmp', 'wb') as f:
+        np.savez(f, version=LOD_VERSION, level_offsets=level_offsets,
+                 chunk_offsets=chunk_offsets, chunk_bounds=chunk_bounds)
+    os.replace(lod_index_path + '.tmp', lod_index_path)
+
+
+class PointCloud:
+    def __init__(self, points, level_offsets, chunk_offsets, chunk_bounds):
+        self.points = points
+        self.level_offsets = level_offsets
+        self.chunk_offsets = chunk_offsets
+        self.chunk_bounds = chunk_bounds
+
+    @classmethod
+    def open(cls, path):
+        """Open a scan, building its LOD files first if missing or older than the scan"""
+        lod_points = path + '.lod.npy'
+        lod_index = path + '.lod.npz'
+        stale = not (os.path.exists(lod_points) and os.path.exists(lod_index))
+        if not stale:
+            stale = os.path.getmtime(lod_index) < os.path.getmtime(path)
+        if not stale:
+            with np.load(lod_index) as index:
+                stale = int(index['version']) != LOD_VERSION
+        if stale:
+            build_lod(open_points(path), lod_points, lod_index)
+        with np.load(lod_index) as index:
+            return cls(np.load(lod_points, mmap_mode='r'), index['level_offsets'],
+                       index['chunk_offsets'], index['chunk_bounds'])
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def chunk_count(self):
+        return len(self.chunk_offsets) - 1
+
+    def chunk(self, c):
+        return self.points[self.chunk_offsets[c]:self.chunk_offsets[c + 1]]
+
+
+def box_corners(bounds):
+    """(C, 2, 3) min/max boxes to (C, 8, 3) corners"""
+    pick = np.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(8)])
+    return bounds[:, pick, np.arange(3)]
+
+
+def visible_boxes(bounds, view, aspect=1.0):
+    """Indices of the (C, 2, 3) boxes at least partly in front of the camera and on screen
+
+    view maps model space {'x', 'y', 'z'} columns to view space, aspect is
+    the screen width / height.
+    """
+    corners = box_corners(bounds).reshape(-1, 3)
+    p = view({'x': corners[:, 0], 'y': corners[:, 1], 'z': corners[:, 2]})
+    z = p['z'].reshape(-1, 8)
+    safe = np.where(z > NEAR, z, NEAR)
+    x = p['x'].reshape(-1, 8) / safe
+    y = p['y'].reshape(-1, 8) / safe
+    in_front = (z > NEAR).any(axis=1)
+    # Corners behind the near plane can project anywhere, keep those boxes
+    straddles = (z <= NEAR).any(axis=1)
+    on_screen = ~((x < -aspect).all(axis=1) | (x > aspect).all(axis=1)
+                  | (y < -1).all(axis=1) | (y > 1).all(axis=1))
+    return np.flatnonzero(in_front & (on_screen | straddles))
+
+
+class PointRenderer:
+    def __init__(self, cloud, width, height, color, background, budget=FRAME_BUDGET):
+        """color/background are (r, g, b) tuples"""
+        self.cloud = cloud
+        self.width = width
+        self.height = height
+        self.color = np.array(color, dtype=np.float32)
+        self.background = np.array(background, dtype=np.float32)
+        self.budget = budget
+        self.depth = np.full(width * height, np.inf, dtype=np.float32)
+        self.camera = None
+        self.queue = []
+        self.splatted = 0
+
+    @property
+    def done(self):
+        """True once every visible chunk has been splatted for the current camera"""
+        return self.camera is not None and not self.queue
+
+    def to_screen(self, p):
+        """View space {'x', 'y', 'z'} columns to pixel indices, depths and a visibility mask"""
+        z = p['z']
+        ok = z > NEAR
+        safe = np.where(ok, z, 1)
+        sx = ((self.width + p['x'] / safe * self.height) / 2).astype(np.int64)
+        sy = ((1 - (p['y'] / safe + 1) / 2) * self.height).astype(np.int64)
+        ok &= (sx >= 0) & (sx < self.width) & (sy >= 0) & (sy < self.height)
+        return sy * self.width + sx, z, ok
+
+    def visible_chunks(self, view):
+        return visible_boxes(self.cloud.chunk_bounds, view, self.width / self.height).tolist()
+
+    def splat(self, points, view):
+        p = view({'x': points[:, 0], 'y': points[:, 1], 'z': points[:, 2]})
+        index, z, ok = self.to_screen(p)
+        index = index[ok]
+        z = z[ok].astype(np.float32)
+        if len(index) == 0:
+            return
+        # Nearest point per pixel within the chunk, then depth test against the buffer
+        order = np.lexsort((z, index))
+        index = index[order]
+        z = z[order]
+        first = np.ones(len(index), dtype=bool)
+        first[1:] = index[1:] != index[:-1]
+        index = index[first]
+        z = z[first]
+        closer = z < self.depth[index]
+        index = index[closer]
+        self.depth[index] = z[closer]
+
+    def image(self):
+        """(height, width, 3) uint8 image of the splatted points, shaded by depth"""
+        # 256 shades from the nearest to the farthest point, entry 256 is the background
+        shades = 1 - (1 - FAR_SHADE) * np.linspace(0, 1, 256, dtype=np.float32)
+        palette = np.empty((257, 3), dtype=np.uint8)
+        palette[:256] = self.background + (self.color - self.background) * shades[:, None]
+        palette[256] = self.background
+
+        index = np.full(self.width * self.height, 256, dtype=np.uint16)
+        hit = np.flatnonzero(self.depth != np.inf)
+        if len(hit):
+            z = self.depth[hit]
+            near, far = z.min(), z.max()
+            index[hit] = (z - near) * (255 / max(far - near, 1e-6))
+        return palette[index].reshape(self.height, self.width, 3)
+
+    def render(self, view, camera):
+        """Splat chunks within the time budget, returns image()
+
+        view maps model space {'x', 'y', 'z'} columns to view space, camera
+        is any hashable describing it. A new camera restarts from the
+        coarsest level, the same camera continues refining.
+        """
+        start = time.perf_counter()
+        if camera != self.camera:
+            self.camera = camera
+            self.depth.fill(np.inf)
+            self.queue = self.visible_chunks(view)
+            self.queue.reverse()  # pop() from the end, coarse chunks first
+            self.splatted = 0
+        # Always make progress, even if the budget is smaller than one chunk
+        while self.queue:
+            c = self.queue.pop()
+            chunk = self.cloud.chunk(c)
+            self.splat(chunk, view)
+            self.splatted += len(chunk)
+            if time.perf_counter() - start >= self.budget:
+                break
+        return self.image()
@@ -0,0 +1,275 @@
+"""Allocation profiling: what each frame allocates and what the GC costs
+
+With profiling on, tracemalloc traces every allocation and gc.callbacks
+time every collection. Per frame the profiler records
+
+    allocated   bytes the frame had in flight at its peak (temporaries)
+    retained    bytes still allocated when the frame ended, net
+    blocks      net change of allocated memory blocks
+    gc          collections during the frame as (generation, ms) pairs
+    buffers     bytes of the mesh buffers (a buffers() dict of arrays)
+
+and report() sums it up: allocation percentiles, the peak mesh buffer
+memory, and how the GC pauses line up with the frame time outliers
+(frames over OUTLIER times the median). tracemalloc makes frames several
+times slower, the numbers are for comparing, not for timing.
+
+    profiler = AllocationProfiler(buffers=lambda: {'vertices': model.vertices})
+    profiler.start()
+    profiler.begin_frame(); draw(); profiler.end_frame(frame_ms)
+    profiler.stop()
+    print(profiler.format())
+
+steady_state() checks that a drawing step reached a steady state: after
+warming up, repeating it retains no memory, starts no collection and keeps
+the bytes in flight per frame under a budget. It is not a zero allocation
+check, NumPy temporaries come and go every frame, the budget bounds them.
+
+Run it to check the engine's draw paths headless, exits 1 if one of them
+keeps allocating or goes over its budget:
+
+    python profiling.py
+"""
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+FRAMES = 600         # frames kept for report()
+OUTLIER = 2.0        # frames slower than this times the median are outliers
+WARMUP = 5           # steady_state(): runs before measuring, fills caches
+STEADY = 20          # steady_state(): runs per window, one to settle and one measured
+TOLERANCE = 0        # steady_state(): bytes of growth allowed per measured run
+TRACE_DEPTH = 1      # tracemalloc frames per traceback, 1 is the cheapest
+
+
+class AllocationProfiler:
+    def __init__(self, buffers=None, frames=FRAMES, outlier=OUTLIER):
+        """buffers() returns a dict of name -> array whose nbytes count as mesh buffer memory"""
+        self.buffers = buffers
+        self.outlier = outlier
+        self.frames = deque(maxlen=frames)
+        self.pauses = []      # (generation, ms) of the collections in the current frame
+        self.gc_started = None
+        self.peak_buffers = 0
+        self.peak_traced = 0  # bytes, everything tracemalloc saw at once
+        self.tracing = False  # tracemalloc was started here
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_DEPTH)
+            self.tracing = True
+        gc.callbacks.append(self.on_gc)
+
+    def stop(self):
+        if self.on_gc in gc.callbacks:
+            gc.callbacks.remove(self.on_gc)
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def on_gc(self, phase, info):
+        if phase == 'start':
+            self.gc_started = time.perf_counter()
+        elif self.gc_started is not None:
+            self.pauses.append((info['generation'], (time.perf_counter() - self.gc_started) * 1000))
+            self.gc_started = None
+
+    def begin_frame(self):
+        self.pauses = []
+        tracemalloc.reset_peak()
+        self.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.start_blocks = sys.getallocatedblocks()
+
+    def end_frame(self, frame_ms):
+        """Record the frame begun with begin_frame(), frame_ms as measured by the caller"""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_traced = max(self.peak_traced, peak)
+        record = {
+            'frame_ms': frame_ms,
+            'allocated': peak - self.start_bytes,
+            'retained': current - self.start_bytes,
+            'blocks': sys.getallocatedblocks() - self.start_blocks,
+            'gc': self.pauses,
+        }
+        if self.buffers is not None:
+            record['buffers'] = sum(a.nbytes for a in self.buffers().values() if a is not None)
+            self.peak_buffers = max(self.peak_buffers, record['buffers'])
+        self.frames.append(record)
+        return record
+
+    def report(self):
+        """Summary of the recorded frames as a dict"""
+        frames = list(self.frames)
+        if not frames:
+            return {'frames': 0}
+        times = [f['frame_ms'] for f in frames]
+        median = statistics.median(times)
+        outliers = [f for f in frames if f['frame_ms'] > self.outlier * median]
+        with_gc = [f for f in frames if f['gc']]
+        pauses = [ms for f in frames for _, ms in f['gc']]
+        allocated = sorted(f['allocated'] for f in frames)
+        return {
+            'frames': len(frames),
+            'median_ms': median,
+            'allocated_p50': allocated[len(allocated) // 2],
+            'allocated_max': allocated[-1],
+            'retained_total': sum(f['retained'] for f in frames),
+            'blocks_per_frame': statistics.mean(f['blocks'] for f in frames),
+            'peak_buffers': self.peak_buffers,
+            'peak_traced': self.peak_traced,
+            'collections': [sum(1 for f in frames for g, _ in f['gc'] if g == n) for n in range(3)],
+            'gc_pause_max_ms': max(pauses, default=0.0),
+            'gc_pause_total_ms': sum(pauses),
+            'outliers': len(outliers),
+            # Outliers that had a collection in them, against the rate over all frames
+            'outliers_with_gc': sum(1 for f in outliers if f['gc']),
+            'gc_frame_rate': len(with_gc) / len(frames),
+            # Share of the outliers' time over the median spent collecting
+            'outlier_gc_share': (sum(ms for f in outliers for _, ms in f['gc'])
+                                 / max(sum(f['frame_ms'] - median for f in outliers), 1e-9)
+                                 if outliers else 0.0),
+        }
+
+    def format(self):
+        r = self.report()
+        if not r['frames']:
+            return "allocation profile: no frames"
+        return "\n".join([
+            f"allocation profile over {r['frames']} frames (median {r['median_ms']:.1f} ms)",
+            f"  allocated per frame  p50 {r['allocated_p50'] / 1024:.1f} KiB, max {r['allocated_max'] / 1024:.1f} KiB",
+            f"  retained             {r['retained_total'] / 1024:+.1f} KiB in total, {r['blocks_per_frame']:+.1f} blocks per frame",
+            f"  mesh buffers peak    {r['peak_buffers'] / (1 << 20):.2f} MiB"
+            f", everything traced {r['peak_traced'] / (1 << 20):.2f} MiB",
+            f"  collections          gen0 {r['collections'][0]}, gen1 {r['collections'][1]}, gen2 {r['collections'][2]}, "
+            f"pauses max {r['gc_pause_max_ms']:.2f} ms, total {r['gc_pause_total_ms']:.1f} ms",
+            f"  outliers (>{self.outlier:g}x median) {r['outliers']}, {r['outliers_with_gc']} with a collection "
+            f"(collections in {r['gc_frame_rate']:.0%} of all frames), "
+            f"GC {r['outlier_gc_share']:.0%} of their excess time",
+        ])
+
+
+def steady_state(step, frames=STEADY, warmup=WARMUP, tolerance=TOLERANCE, budget=None):
+    """Run step() warmup times, then two windows of frames runs traced.
+
+    The first window settles whatever still fills up, a leak grows by about
+    as much in the second, which must stay within tolerance bytes per run
+    and start no collection; with a budget, no run may have more than that
+    many bytes in flight. AssertionError naming the allocation sites
+    otherwise, returns (bytes grown, most bytes in flight in a run).
+    """
+    for _ in range(warmup):
+        step()
+    collections = []
+    def on_gc(phase, info):
+        if phase == 'start':
+            collections.append(info['generation'])
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(TRACE_DEPTH)
+
+    # NumPy keeps freed small blocks (array shapes and strides) in bounded
+    # caches of its own that fill up over the first few hundred frames,
+    # those are ignored; array data lives in NumPy's own domain and counts
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, os.path.join(os.path.dirname(np.__file__), '*'), domain=0),
+              tracemalloc.Filter(False, '<__array_function__ internals>', domain=0)]
+    def snapshot():
+        gc.collect()  # cyclic garbage is counted by the collections below, not as growth
+        taken = tracemalloc.take_snapshot().filter_traces(ignore)
+        gc.collect()  # the snapshot's own objects would count towards the next collection
+        return taken
+
+    # The bytes in flight are measured in the first window, what measuring
+    # them allocates would count as growth in the second
+    start = snapshot()
+    allocated = 0
+    for _ in range(frames):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        step()
+        allocated = max(allocated, tracemalloc.get_traced_memory()[1] - current)
+    middle = snapshot()
+    gc.callbacks.append(on_gc)
+    try:
+        for _ in range(frames):
+            step()
+    finally:
+        gc.callbacks.remove(on_gc)
+    end = snapshot()
+    if not tracing:
+        tracemalloc.stop()
+
+    settling = sum(d.size_diff for d in middle.compare_to(start, 'lineno'))
+    diff = end.compare_to(middle, 'lineno')
+    grown = sum(d.size_diff for d in diff)
+    if grown > tolerance * frames or collections or (budget is not None and allocated > budget):
+        sites = "\n".join(f"  {d}" for d in [d for d in diff if d.size_diff > 0][:5])
+        raise AssertionError(f"{getattr(step, '__name__', step)}: {grown:+d} bytes over {frames} runs "
+                             f"({settling:+d} in the {frames} before), {len(collections)} collections, "
+                             f"up to {allocated} bytes in flight"
+                             f"{'' if budget is None else f' (budget {budget})'}\n{sites}")
+    return grown, allocated
+
+
+# Draw paths of v2.py checked by running this file: (name, settings, spin, budget),
+# budget the bytes in flight per frame at 200x200 with the penguin, about 1.5
+# times what they take (the software backend's temporaries grow with the pixels)
+CHECKS = [
+    ('wireframe_still', {'backend': 'software'}, False, 6 << 20),
+    ('wireframe_spin', {'backend': 'software'}, True, 6 << 20),
+    ('depth_cued', {'backend': 'software', 'edge_shading': 'depth'}, True, 2 << 20),
+    ('solid', {'backend': 'software', 'render_mode': 'solid'}, True, 4 << 20),
+    ('solid_shadows', {'backend': 'software', 'render_mode': 'solid', 'shadows': True}, True, 6 << 20),
+    ('pygame_wireframe', {'backend': 'pygame'}, True, 512 << 10),
+]
+
+
+def main(argv=None):
+    import argparse
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import config
+    import v2
+
+    p = argparse.ArgumentParser(description="Check that the v2.py draw paths reach a steady state")
+    p.add_argument('--frames', type=int, default=STEADY)
+    p.add_argument('--profile', action='store_true', help="also print a per-frame allocation profile")
+    args = p.parse_args(argv)
+
+    failed = 0
+    for name, values, spin, budget in CHECKS:
+        settings = config.update(dict(config.DEFAULTS), {'width': 200, 'height': 200, 'fps': 0, **values})
+        v2.configure(settings)
+
+        def draw():
+            if spin:
+                v2.angle += 0.05
+            v2.draw()
+        draw.__name__ = name
+        try:
+            _, allocated = steady_state(draw, args.frames, budget=budget)
+            print(f"{name:18} steady, {allocated / 1024:.0f} KiB in flight of {budget / 1024:.0f}")
+        except AssertionError as e:
+            failed += 1
+            print(f"{name:18} FAILED {e}")
+
+        if args.profile:
+            profiler = AllocationProfiler(buffers=v2.mesh_buffers)
+            profiler.start()
+            for _ in range(args.frames):
+                profiler.begin_frame()
+                start = time.perf_counter()
+                draw()
+                profiler.end_frame((time.perf_counter() - start) * 1000)
+            profiler.stop()
+            print(profiler.format())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
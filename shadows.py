@@ -0,0 +1,127 @@
+"""Software shadow map for one directional light
+
+The mesh is rasterized once from the light's point of view (orthographic,
+the light is directional) into a NumPy depth texture: per texel the
+distance along the light of the nearest surface. A point is lit if it is
+no farther along the light than what the texture saw there.
+
+The texture only depends on the light direction and the geometry, both in
+model space, so it is cached: camera moves reuse it, it is re-rendered
+when the light turns or vertices change through Mesh.update_vertices().
+
+    shadow = ShadowMap(model)
+    shadow.update(to_light)          # cheap when nothing changed
+    lit = shadow.lit(points, normals)  # (N,) bool for (N, 3) model space points
+
+Points facing away from the light are in shadow without a lookup, the
+others are looked up a little out along their surface normal (normal
+offset): a surface at a grazing angle to the light changes depth by many
+texels within one texel, no depth bias covers that without also letting
+light through where it should not.
+"""
+import numpy as np
+
+import backends
+
+SHADOW_SIZE = 1024   # texels per side
+# Depth slack that keeps lit surfaces from shadowing themselves (acne): a
+# constant part in texels plus a part scaled by the surface's depth slope
+# across a texel (polygon offset), capped for surfaces seen edge on
+SHADOW_BIAS = 1.0
+SLOPE_BIAS = 1.5
+MAX_SLOPE = 8.0
+NORMAL_OFFSET = 0.75  # texels the lookup moves out along the normal, scaled by sin(angle to the light)
+MARGIN = 0.01        # fraction of the extent left free around the mesh
+
+
+def light_basis(to_light):
+    """(3, 3) rows u, v, w: u and v span the texture, w points from the light into the scene"""
+    w = -np.asarray(to_light, dtype=np.float64)
+    w /= np.linalg.norm(w)
+    helper = np.array([0.0, 1.0, 0.0]) if abs(w[1]) < 0.9 else np.array([1.0, 0.0, 0.0])
+    u = np.cross(helper, w)
+    u /= np.linalg.norm(u)
+    return np.stack([u, np.cross(w, u), w])
+
+
+class ShadowMap:
+    def __init__(self, mesh, size=SHADOW_SIZE, bias=SHADOW_BIAS, slope_bias=SLOPE_BIAS,
+                 normal_offset=NORMAL_OFFSET):
+        self.mesh = mesh
+        self.size = size
+        self.bias = bias
+        self.slope_bias = slope_bias
+        self.normal_offset = normal_offset
+        self.dirty = mesh.track()
+        self.to_light = None
+        self.depth = None
+        self.renders = 0  # times the texture was rendered
+
+    def update(self, to_light):
+        """Re-render the texture if the light or the geometry changed, returns True if it did"""
+        to_light = tuple(float(c) for c in to_light)
+        changed = bool(self.dirty.take())
+        if not changed and to_light == self.to_light:
+            return False
+
+        self.basis = light_basis(to_light)
+        self.depth = np.full(self.size * self.size, np.inf, dtype=np.float32)
+        if len(self.mesh.triangles):
+            self.render()
+        else:
+            # Nothing casts a shadow, the cleared texture lights every point
+            self.scale, self.origin, self.near = 1.0, np.zeros(2), 0.0
+
+        self.to_light = to_light
+        self.renders += 1
+        return True
+
+    def render(self):
+        """Fit the texture around the mesh and rasterize its depth into it"""
+        p = self.mesh.vertices.astype(np.float64) @ self.basis.T
+        lo, hi = p.min(axis=0), p.max(axis=0)
+        extent = max(float((hi[:2] - lo[:2]).max()), 1e-9) * (1 + 2 * MARGIN)
+        self.scale = self.size / extent                        # texels per model unit
+        self.origin = (lo[:2] + hi[:2]) / 2 - extent / 2       # model space corner of texel (0, 0)
+        self.near = lo[2]
+
+        t = self.mesh.triangles
+        xy = (p[:, :2] - self.origin) * self.scale
+        # Distance along the light from the nearest vertex, >= 0 as nearest() needs
+        depth = (p[:, 2] - self.near)[t]
+        depth += self.offsets(xy[t], depth)[:, None]
+        for index, _, values in backends.rasterize(xy[t], depth[:, :, None], self.size, self.size):
+            index, z = backends.nearest(index, values[:, 0].astype(np.float32))
+            self.depth[index] = np.minimum(self.depth[index], z)
+
+    def offsets(self, xy, depth):
+        """(M,) depth bias of the (M, 3, 2) texel space triangles with (M, 3) depths"""
+        e1, e2 = xy[:, 1] - xy[:, 0], xy[:, 2] - xy[:, 0]
+        d1, d2 = depth[:, 1] - depth[:, 0], depth[:, 2] - depth[:, 0]
+        double_area = e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dx = (d1 * e2[:, 1] - d2 * e1[:, 1]) / double_area
+            dy = (d2 * e1[:, 0] - d1 * e2[:, 0]) / double_area
+            slope = np.nan_to_num(np.hypot(dx, dy) * self.scale, nan=MAX_SLOPE, posinf=MAX_SLOPE)
+        return (self.bias + self.slope_bias * np.minimum(slope, MAX_SLOPE)) / self.scale
+
+    def lit(self, points, normals=None):
+        """(N,) bool, True for the (N, 3) model space points the light reaches
+
+        normals are the (N, 3) unit normals of the surfaces the points lie on,
+        without them the points are looked up as they are.
+        """
+        p = np.asarray(points, dtype=np.float64) @ self.basis.T
+        facing = np.ones(len(p), dtype=bool)
+        if normals is not None:
+            n = np.asarray(normals, dtype=np.float64) @ self.basis.T
+            cos = -n[:, 2]  # w points away from the light
+            facing = cos > 0
+            sin = np.sqrt(np.maximum(1 - cos * cos, 0))
+            p += n * (self.normal_offset / self.scale * sin)[:, None]
+        texel = np.floor((p[:, :2] - self.origin) * self.scale).astype(np.int64)
+        inside = ((texel >= 0) & (texel < self.size)).all(axis=1)
+        index = texel[inside, 1] * self.size + texel[inside, 0]
+        lit = np.ones(len(p), dtype=bool)
+        lit[inside] = p[inside, 2] - self.near <= self.depth[index]
+        return lit & facing
@@ -0,0 +1,294 @@
+"""Skeletal animation with linear blend skinning
+
+    Skeleton   bone hierarchy and bind pose
+    Clip       keyframed bone translations/rotations/scales
+    Skin       per-vertex bone indices and weights (V, K) of a mesh
+
+Everything works on batches: pose matrices have shape (..., B, 4, 4) and
+the leading dimensions are independent characters, so a crowd is skinned
+with the same handful of NumPy calls as a single character. Rotations are
+quaternions stored as (x, y, z, w).
+
+A skin is authored against the vertices of the source file, which
+mesh.optimize() welds, splits at seams and renumbers; Skin.for_mesh()
+reindexes it to the vertices of the preprocessed Mesh.
+
+Run it to check the skinning against hand computed poses, exits 1 on a
+mismatch:
+
+    python skinning.py
+"""
+import sys
+
+import numpy as np
+
+# Most real time assets use at most 4 influences per vertex
+MAX_INFLUENCES = 4
+
+
+# Quaternion and matrix helpers
+
+def quat_to_matrix(q):
+    """(..., 4) unit quaternions to (..., 3, 3) rotation matrices"""
+    x, y, z, w = np.moveaxis(q, -1, 0)
+    xx, yy, zz = x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+    m = np.empty(q.shape[:-1] + (3, 3), dtype=q.dtype)
+    m[..., 0, 0] = 1 - 2 * (yy + zz)
+    m[..., 0, 1] = 2 * (xy - wz)
+    m[..., 0, 2] = 2 * (xz + wy)
+    m[..., 1, 0] = 2 * (xy + wz)
+    m[..., 1, 1] = 1 - 2 * (xx + zz)
+    m[..., 1, 2] = 2 * (yz - wx)
+    m[..., 2, 0] = 2 * (xz - wy)
+    m[..., 2, 1] = 2 * (yz + wx)
+    m[..., 2, 2] = 1 - 2 * (xx + yy)
+    return m
+
+def compose(translations, rotations, scales=None):
+    """(..., 4, 4) matrices that scale, then rotate, then translate"""
+    m = np.zeros(translations.shape[:-1] + (4, 4), dtype=np.float32)
+    r = quat_to_matrix(rotations)
+    if scales is not None:
+        r = r * scales[..., None, :]
+    m[..., :3, :3] = r
+    m[..., :3, 3] = translations
+    m[..., 3, 3] = 1
+    return m
+
+def slerp(q0, q1, t):
+    """Spherical interpolation of (..., 4) quaternions along the shortest arc"""
+    dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+    # Nearly parallel: fall back to normalized lerp, sin(theta) -> 0
+    theta = np.arccos(np.clip(dot, -1, 1))
+    sin_theta = np.sin(theta)
+    near = sin_theta < 1e-5
+    safe = np.where(near, 1, sin_theta)
+    w0 = np.where(near, 1 - t, np.sin((1 - t) * theta) / safe)
+    w1 = np.where(near, t, np.sin(t * theta) / safe)
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+class Skeleton:
+    def __init__(self, parents, bind_local, names=None):
+        """parents[i] is the parent bone of bone i (-1 for roots), bind_local
+        the (B, 4, 4) bind pose of every bone relative to its parent"""
+        self.parents = np.asarray(parents, dtype=np.int32)
+        self.names = list(names) if names is not None else [f"bone{i}" for i in range(len(self.parents))]
+        self.bind_local = np.asarray(bind_local, dtype=np.float32)
+
+        # Bones grouped by depth: every level only needs the level above it,
+        # so the hierarchy is resolved with one batched matmul per level
+        depth = np.zeros(len(self.parents), dtype=np.int32)
+        for bone, parent in enumerate(self.parents):
+            if parent >= bone:
+                raise ValueError(f"bone {bone} comes before its parent {parent}")
+            depth[bone] = depth[parent] + 1 if parent >= 0 else 0
+        self.levels = [np.flatnonzero(depth == d) for d in range(depth.max() + 1 if len(depth) else 0)]
+
+        self.inverse_bind = np.linalg.inv(self.global_transforms(self.bind_local)).astype(np.float32)
+
+    def __len__(self):
+        return len(self.parents)
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def global_transforms(self, local):
+        """(..., B, 4, 4) bone-to-parent matrices to bone-to-model matrices"""
+        world = np.array(local, dtype=np.float32, copy=True)
+        for level in self.levels[1:]:
+            world[..., level, :, :] = world[..., self.parents[level], :, :] @ world[..., level, :, :]
+        return world
+
+    def skin_matrices(self, local):
+        """Matrices taking bind pose vertices to the posed model space"""
+        return self.global_transforms(local) @ self.inverse_bind
+
+
+class Clip:
+    def __init__(self, times, translations, rotations, scales=None, loop=True):
+        """Keys at times (T,), translations (T, B, 3), rotations (T, B, 4) and
+        optional scales (T, B, 3), all bones keyed at the same times"""
+        self.times = np.asarray(times, dtype=np.float32)
+        self.translations = np.asarray(translations, dtype=np.float32)
+        self.rotations = np.asarray(rotations, dtype=np.float32)
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        self.loop = loop
+        if len(self.times) == 0:
+            raise ValueError("clip needs at least one key")
+
+    @property
+    def duration(self):
+        return float(self.times[-1] - self.times[0])
+
+    def sample(self, t):
+        """Local bone matrices at time t, t may be an array of times (one per character)"""
+        t = np.asarray(t, dtype=np.float32)
+        start = self.times[0]
+        if self.loop and self.duration > 0:
+            t = start + np.mod(t - start, self.duration)
+        t = np.clip(t, start, self.times[-1])
+
+        # Key pair around t and the blend factor between them
+        i1 = np.clip(np.searchsorted(self.times, t, side='right'), 1, len(self.times) - 1)
+        i0 = i1 - 1
+        if len(self.times) == 1:
+            i0 = i1 = np.zeros_like(i1)
+        span = self.times[i1] - self.times[i0]
+        f = np.where(span > 0, (t - self.times[i0]) / np.where(span > 0, span, 1), 0)
+        f = f[..., None, None]  # broadcast over bones and components
+
+        translations = self.translations[i0] + (self.translations[i1] - self.translations[i0]) * f
+        rotations = slerp(self.rotations[i0], self.rotations[i1], f)
+        scales = None
+        if self.scales is not None:
+            scales = self.scales[i0] + (self.scales[i1] - self.scales[i0]) * f
+        return compose(translations, rotations, scales)
+
+
+class Skin:
+    def __init__(self, rest_positions, bone_indices, weights):
+        """rest_positions (V, 3) in bind pose, bone_indices/weights (V, K)"""
+        self.rest_positions = np.ascontiguousarray(rest_positions, dtype=np.float32).reshape(-1, 3)
+        bone_indices = np.asarray(bone_indices)
+        weights = np.asarray(weights, dtype=np.float32)
+        if bone_indices.shape != weights.shape or len(weights) != len(self.rest_positions):
+            raise ValueError("bone_indices and weights must both be (V, K) for V rest positions")
+
+        # Keep only the strongest influences and renormalize them
+        if weights.shape[1] > MAX_INFLUENCES:
+            strongest = np.argsort(-weights, axis=1)[:, :MAX_INFLUENCES]
+            bone_indices = np.take_along_axis(bone_indices, strongest, axis=1)
+            weights = np.take_along_axis(weights, strongest, axis=1)
+        total = weights.sum(axis=1, keepdims=True)
+        weights = np.divide(weights, total, out=np.zeros_like(weights), where=total > 0)
+
+        index_type = np.uint8 if bone_indices.size == 0 or bone_indices.max() < 256 else np.uint16
+        self.bone_indices = np.ascontiguousarray(bone_indices, dtype=index_type)
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)
+
+    @classmethod
+    def from_dense(cls, rest_positions, dense_weights, influences=MAX_INFLUENCES):
+        """Build from a (V, B) weight matrix, keeping the strongest influences per vertex"""
+        dense_weights = np.asarray(dense_weights, dtype=np.float32)
+        k = min(influences, dense_weights.shape[1])
+        strongest = np.argsort(-dense_weights, axis=1)[:, :k]
+        return cls(rest_positions, strongest, np.take_along_axis(dense_weights, strongest, axis=1))
+
+    def reindex(self, sources):
+        """Skin of the vertices made from the given rest vertices, sources[i] for vertex i"""
+        sources = np.asarray(sources, dtype=np.int64)
+        return Skin(self.rest_positions[sources], self.bone_indices[sources], self.weights[sources])
+
+    def for_mesh(self, mesh):
+        """This skin, authored against the input vertices, reindexed to mesh's vertices.
+
+        Vertices welded together get the influences of the first of them.
+        """
+        if mesh.sources is not None:
+            return self.reindex(mesh.sources)
+        if len(mesh.vertices) != len(self.rest_positions):
+            raise ValueError(f"mesh has {len(mesh.vertices)} vertices and no sources, "
+                             f"the skin has {len(self.rest_positions)}")
+        return self
+
+    def deform(self, skin_matrices, out=None):
+        """Linear blend skinning
+
+        skin_matrices is (B, 4, 4) for one character or (N, B, 4, 4) for N
+        characters sharing this skin, the result is (V, 3) or (N, V, 3).
+        Pass out to write into an existing buffer, e.g. Mesh.vertices
+        followed by Mesh.mark_dirty(0, V) with a skin from for_mesh().
+        """
+        affine = np.asarray(skin_matrices, dtype=np.float32)[..., :3, :]
+        # Per-vertex blended (3, 4) matrix from its K influences
+        blended = np.einsum('vk,...vkij->...vij', self.weights, affine[..., self.bone_indices, :, :],
+                            optimize=True)
+        positions = np.einsum('...vij,vj->...vi', blended[..., :3], self.rest_positions, optimize=True)
+        positions += blended[..., 3]
+        if out is not None:
+            out[...] = positions
+            return out
+        return positions
+
+    def pose(self, skeleton, clip, t, out=None):
+        """Sample clip at time(s) t and deform, see deform()"""
+        return self.deform(skeleton.skin_matrices(clip.sample(t)), out=out)
+
+
+# Check against poses worked out by hand
+
+def quat(axis, degrees):
+    """(4,) quaternion rotating by degrees about axis"""
+    axis = np.asarray(axis, dtype=np.float32)
+    half = np.radians(degrees) / 2
+    return np.append(axis / np.linalg.norm(axis) * np.sin(half), np.cos(half)).astype(np.float32)
+
+def check():
+    """Raise AssertionError on the first pose that differs from its hand computed result"""
+    import mesh
+
+    def close(name, got, expected):
+        if not np.allclose(got, expected, atol=1e-5):
+            raise AssertionError(f"{name}: got\n{np.round(got, 5)}\nexpected\n{np.asarray(expected)}")
+
+    # Two bones up the y axis, the second with its joint at y = 1
+    identity = np.array([0, 0, 0, 1], dtype=np.float32)
+    bind = compose(np.array([[0, 0, 0], [0, 1, 0]], dtype=np.float32), np.stack([identity, identity]))
+    skeleton = Skeleton([-1, 0], bind)
+    rest = np.array([[0, 0.5, 0], [0, 2, 0], [0, 1.5, 0], [1, 2, 0]], dtype=np.float32)
+    skin = Skin(rest, [[0, 1], [1, 0], [0, 1], [1, 0]], [[1, 0], [1, 0], [0.5, 0.5], [1, 0]])
+
+    close("bind pose", skin.deform(skeleton.skin_matrices(bind)), rest)
+
+    # Second bone 90 degrees about z: (x, y) about the joint goes to (-y, x)
+    # around it; the half weighted vertex averages both bones' results
+    bent = compose(np.array([[0, 0, 0], [0, 1, 0]], dtype=np.float32),
+                   np.stack([identity, quat([0, 0, 1], 90)]))
+    expected = [[0, 0.5, 0], [-1, 1, 0], [-0.25, 1.25, 0], [-1, 2, 0]]
+    close("bent", skin.deform(skeleton.skin_matrices(bent)), expected)
+
+    # Root moved by (2, 0, 0) moves everything with it
+    moved = compose(np.array([[2, 0, 0], [0, 1, 0]], dtype=np.float32), np.stack([identity, identity]))
+    close("moved", skin.deform(skeleton.skin_matrices(moved)), rest + [2, 0, 0])
+
+    # Halfway through a clip from the bind pose to bent is 45 degrees,
+    # a batch of two characters at 0 and half time
+    clip = Clip([0, 1], [[[0, 0, 0], [0, 1, 0]]] * 2, [[identity, identity], [identity, quat([0, 0, 1], 90)]],
+                loop=False)
+    r = np.sqrt(0.5)
+    close("clip", skin.pose(skeleton, clip, [0, 0.5]),
+          [rest, [[0, 0.5, 0], [-r, 1 + r, 0], [-r / 4, 1.25 + r / 4, 0], [0, 1 + 2 * r, 0]]])
+
+    # Through mesh preprocessing: a quad as two triangles with a duplicated
+    # corner (welded) and a UV seam (split), the skin follows the vertices
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [1, 2, 0], [0, 2, 0], [1, 0, 0]], dtype=np.float32)
+    corner_uvs = [[0, 0], [1, 0], [1, 1], [0, 0], [0.5, 1], [0, 1]]
+    prepared = mesh.prepare(vertices, [0, 4, 2, 0, 2, 3], [0, 3, 6], cache_dir=None, corner_uvs=corner_uvs)
+    if sorted(prepared.sources.tolist()) != [0, 1, 2, 2, 3]:
+        raise AssertionError(f"mesh sources {prepared.sources.tolist()}, expected 0, 1, 2, 2, 3 in some order")
+    weights = Skin.from_dense(vertices, [[1, 0], [1, 0], [0, 1], [0, 1], [1, 0]])
+    mesh_skin = weights.for_mesh(prepared)
+    close("mesh bind pose", mesh_skin.deform(skeleton.skin_matrices(bind)), prepared.vertices)
+    expected = weights.deform(skeleton.skin_matrices(bent))[prepared.sources]
+    mesh_skin.deform(skeleton.skin_matrices(bent), out=prepared.vertices)
+    close("mesh bent", prepared.vertices, expected)
+
+
+def main():
+    try:
+        check()
+    except AssertionError as e:
+        print(f"skinning FAILED {e}")
+        return 1
+    print("skinning ok")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
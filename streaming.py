@@ -0,0 +1,390 @@
+"""Out-of-core meshes: spatially chunked files streamed through a bounded LRU
+
+File layout (all little endian):
+
+    8 bytes   magic b"E3DCHNK1"
+    8 bytes   uint64 header size
+    header    UTF-8 JSON index, padded so the data starts 64 byte aligned
+    data      per chunk arrays, each 64 byte aligned
+
+The JSON index holds the overall bounds and, per chunk, its bounding box
+and the byte offset (into the data section) and length of its vertices
+(n, 3) float32, edges (e, 2) int32, face_indices int32 and face_offsets
+int32. Chunk indices are local to the chunk, vertices shared by several
+chunks are duplicated so every chunk can be drawn on its own.
+
+ChunkStore memory-maps the file and copies chunks in on a background
+thread. Resident chunks live in an LRU bounded by a byte budget, so
+memory stays flat however large the file is. StreamingRenderer asks for
+the chunks whose boxes are in view, nearest first, and draws whatever is
+resident; the rest shows up as the loader catches up.
+
+    python streaming.py model.obj model.chunks    # convert
+
+An OBJ is converted in passes over the file (convert_obj()), so it can be
+larger than memory; .npz meshes are loaded whole.
+"""
+import json
+import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import mesh
+from pointcloud import NEAR, visible_boxes
+
+MAGIC = b"E3DCHNK1"
+VERSION = 1
+ALIGN = 64
+CHUNK_FACES = 16384          # target faces per chunk when converting
+OBJ_BLOCK = 1 << 16          # OBJ records parsed per block by convert_obj()
+DEFAULT_BUDGET = 256 << 20   # bytes of resident chunk data
+ARRAYS = (
+    ('vertices', '<f4', 3),
+    ('edges', '<i4', 2),
+    ('face_indices', '<i4', 1),
+    ('face_offsets', '<i4', 1),
+)
+
+
+# Conversion
+
+def split_chunks(m, chunk_faces=CHUNK_FACES):
+    """Split a Mesh into spatial chunks, yields (bounds, arrays) per non-empty chunk"""
+    face_offsets = m.face_offsets
+    counts = np.diff(face_offsets)
+    face_of_corner = np.repeat(np.arange(m.face_count), counts)
+    # Face centroids pick the grid cell, the grid is sized for ~chunk_faces per cell
+    centroids = np.zeros((m.face_count, 3))
+    np.add.at(centroids, face_of_corner, m.vertices[m.face_indices])
+    centroids /= counts[:, None]
+    lo, hi = m.bounds()
+    cells_per_axis = max(1, math.ceil((m.face_count / chunk_faces) ** (1 / 3)))
+    size = np.maximum(hi - lo, 1e-12) / cells_per_axis
+    cell = np.clip(((centroids - lo) / size).astype(np.int64), 0, cells_per_axis - 1)
+    cell_id = (cell[:, 0] * cells_per_axis + cell[:, 1]) * cells_per_axis + cell[:, 2]
+
+    order = np.argsort(cell_id, kind='stable')
+    splits = np.flatnonzero(np.diff(cell_id[order])) + 1
+    for faces in np.split(order, splits):
+        if len(faces) == 0:
+            continue
+        starts = face_offsets[faces]
+        lengths = counts[faces]
+        corners = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) \
+            + np.arange(lengths.sum())
+        used, local = np.unique(m.face_indices[corners], return_inverse=True)
+        local_offsets = np.zeros(len(faces) + 1, dtype=np.int32)
+        local_offsets[1:] = np.cumsum(lengths)
+        vertices = m.vertices[used]
+        arrays = {
+            'vertices': vertices,
+            'edges': mesh.unique_edges(local.astype(np.int32), local_offsets),
+            'face_indices': local.astype(np.int32),
+            'face_offsets': local_offsets,
+        }
+        yield np.stack([vertices.min(axis=0), vertices.max(axis=0)]), arrays
+
+def write_chunked(path, m, chunk_faces=CHUNK_FACES):
+    """Write a Mesh as a chunked file, see the module docstring"""
+    write_chunks(path, m.bounds(), split_chunks(m, chunk_faces))
+
+def write_chunks(path, bounds, chunks):
+    """Write the (bounds, arrays) pairs of an iterable as a chunked file with overall
+    bounds (lo, hi). Chunk data is spooled to a temporary file as it comes in,
+    only the index stays in memory."""
+    folder = os.path.dirname(os.path.abspath(path))
+    index = []
+    offset = 0
+    with tempfile.TemporaryFile(dir=folder) as data:
+        for box, arrays in chunks:
+            entry = {'bounds': np.asarray(box).tolist()}
+            for name, dtype, _ in ARRAYS:
+                raw = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+                padding = -len(raw) % ALIGN
+                data.write(raw + b'\0' * padding)
+                entry[name] = [offset, len(raw)]
+                offset += len(raw) + padding
+            index.append(entry)
+
+        lo, hi = bounds
+        header = {'version': VERSION, 'bounds': [np.asarray(lo).tolist(), np.asarray(hi).tolist()], 'chunks': index}
+        # Offsets in the index are relative to the data section right after the padded header
+        blob = json.dumps(header, separators=(',', ':')).encode()
+        blob += b' ' * (-(len(blob) + 16) % ALIGN)
+
+        f, tmp = mesh.temporary_file(folder)
+        try:
+            with f:
+                f.write(MAGIC)
+                f.write(struct.pack('<Q', len(blob)))
+                f.write(blob)
+                data.seek(0)
+                shutil.copyfileobj(data, f, 1 << 20)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+def convert_obj(obj_path, path, chunk_faces=CHUNK_FACES):
+    """Convert an OBJ file to a chunked file without holding the mesh in memory
+
+    Three passes: the vertices go to a temporary float32 file that is
+    memory-mapped afterwards, the faces are sorted by their centroid's grid
+    cell into per cell spill files, then every cell becomes one chunk.
+    Memory holds a block of OBJ lines, one cell and the pages of the vertex
+    file the OS caches. Unlike mesh.load() vertices are not welded or
+    reordered, chunks are drawn as wireframes where that does not matter.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as work:
+        # Pass 1: vertices, their bounds and the number of faces
+        lo, hi = np.full(3, np.inf, dtype=np.float32), np.full(3, -np.inf, dtype=np.float32)
+        count = faces = 0
+        block = []
+        def flush_vertices():
+            nonlocal lo, hi, count
+            if block:
+                v = np.array(block, dtype=np.float32)
+                out.write(v.tobytes())
+                lo, hi = np.minimum(lo, v.min(axis=0)), np.maximum(hi, v.max(axis=0))
+                count += len(v)
+                block.clear()
+        with open(obj_path) as f, open(os.path.join(work, 'vertices'), 'wb') as out:
+            for line in f:
+                parts = line.split()
+                if parts and parts[0] == 'v':
+                    block.append(parts[1:4])
+                    if len(block) >= OBJ_BLOCK:
+                        flush_vertices()
+                elif parts and parts[0] == 'f' and len(parts) > 1:
+                    faces += 1
+            flush_vertices()
+        if not count:
+            lo = hi = np.zeros(3, dtype=np.float32)
+        vertices = np.memmap(os.path.join(work, 'vertices'), dtype=np.float32, mode='r',
+                             shape=(count, 3)) if count else np.zeros((0, 3), dtype=np.float32)
+
+        # Pass 2: faces into cells, the same grid as split_chunks()
+        cells_per_axis = max(1, math.ceil((faces / chunk_faces) ** (1 / 3)))
+        size = np.maximum(hi - lo, 1e-12) / cells_per_axis
+        cells = set()
+        def flush_faces():
+            if not block:
+                return
+            face_indices, face_offsets = mesh.pack_faces(block)
+            counts = np.diff(face_offsets)
+            centroids = np.add.reduceat(vertices[face_indices].astype(np.float64), face_offsets[:-1]) / counts[:, None]
+            cell = np.clip(((centroids - lo) / size).astype(np.int64), 0, cells_per_axis - 1)
+            cell_id = (cell[:, 0] * cells_per_axis + cell[:, 1]) * cells_per_axis + cell[:, 2]
+            order = np.argsort(cell_id, kind='stable')
+            splits = np.flatnonzero(np.diff(cell_id[order])) + 1
+            for group in np.split(order, splits):
+                corners = mesh.concat_ranges(face_offsets[group], counts[group])[0]
+                name = os.path.join(work, str(cell_id[group[0]]))
+                with open(name + '.lengths', 'ab') as out:
+                    out.write(counts[group].astype(np.int32).tobytes())
+                with open(name + '.indices', 'ab') as out:
+                    out.write(face_indices[corners].astype(np.int32).tobytes())
+                cells.add(int(cell_id[group[0]]))
+            block.clear()
+        seen = 0
+        with open(obj_path) as f:
+            for line in f:
+                parts = line.split()
+                if not parts:
+                    continue
+                if parts[0] == 'v':
+                    seen += 1
+                elif parts[0] == 'f' and len(parts) > 1:
+                    # OBJ indices start from 1, negative ones count back from the last vertex read
+                    block.append([i - 1 if i > 0 else seen + i for i in (int(ref.split('/')[0]) for ref in parts[1:])])
+                    if len(block) >= OBJ_BLOCK:
+                        flush_faces()
+            flush_faces()
+
+        # Pass 3: one chunk per cell, local indices like split_chunks()
+        def chunks():
+            for cell_id in sorted(cells):
+                name = os.path.join(work, str(cell_id))
+                lengths = np.fromfile(name + '.lengths', dtype=np.int32)
+                used, local = np.unique(np.fromfile(name + '.indices', dtype=np.int32), return_inverse=True)
+                local_offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+                local_offsets[1:] = np.cumsum(lengths)
+                chunk_vertices = np.asarray(vertices[used])
+                yield np.stack([chunk_vertices.min(axis=0), chunk_vertices.max(axis=0)]), {
+                    'vertices': chunk_vertices,
+                    'edges': mesh.unique_edges(local.astype(np.int32), local_offsets),
+                    'face_indices': local.astype(np.int32),
+                    'face_offsets': local_offsets,
+                }
+        write_chunks(path, (lo, hi), chunks())
+        del vertices  # the memory map has to go before its file
+
+
+# Streaming
+
+class ChunkStore:
+    """Memory-mapped chunk file with a background loader and a byte bounded LRU"""
+
+    def __init__(self, path, budget=DEFAULT_BUDGET, on_loaded=None, workers=1):
+        """on_loaded(chunk_id) is called from a loader thread after a chunk became resident,
+        workers loader threads read chunks in parallel"""
+        with open(path, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f"{path}: not a chunked mesh file")
+            (size,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(size))
+        if header['version'] != VERSION:
+            raise ValueError(f"{path}: chunked mesh version {header['version']}, expected {VERSION}")
+        self.path = path
+        self.data_start = 16 + size
+        self.index = header['chunks']
+        self.bounds = np.array(header['bounds'], dtype=np.float32)
+        self.chunk_bounds = np.array([c['bounds'] for c in self.index], dtype=np.float32).reshape(-1, 2, 3)
+        self.map = np.memmap(path, dtype=np.uint8, mode='r')
+
+        # Bytes every chunk takes once resident
+        self.chunk_bytes = np.array([sum(c[name][1] for name, _, _ in ARRAYS) for c in self.index],
+                                    dtype=np.int64)
+
+        self.budget = budget
+        self.on_loaded = on_loaded
+        self.resident = OrderedDict()  # chunk id -> arrays, least recently used first
+        self.resident_bytes = 0
+        self.wanted = []  # chunks to load next, most important first
+        self.in_flight = set()  # chunks a loader is reading right now
+        self.closed = False
+        self.cond = threading.Condition()
+        self.threads = [threading.Thread(target=self.loader, name=f"chunk-loader-{i}", daemon=True)
+                        for i in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, chunk_id):
+        """Copy one chunk out of the memory map, this is where the pages get faulted in"""
+        entry = self.index[chunk_id]
+        arrays = {}
+        for name, dtype, width in ARRAYS:
+            offset, nbytes = entry[name]
+            start = self.data_start + offset
+            raw = self.map[start:start + nbytes]
+            shape = (-1, width) if width > 1 else (-1,)
+            arrays[name] = np.frombuffer(raw, dtype=dtype).reshape(shape).copy()
+        return arrays
+
+    def loader(self):
+        while True:
+            with self.cond:
+                while not self.wanted and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                chunk_id = self.wanted.pop(0)
+                self.in_flight.add(chunk_id)
+            # Reading happens outside the lock, the render thread never waits on I/O
+            arrays = self.read(chunk_id)
+            with self.cond:
+                self.in_flight.discard(chunk_id)
+                self.resident[chunk_id] = arrays
+                self.resident_bytes += int(self.chunk_bytes[chunk_id])
+                self.evict()
+            if self.on_loaded is not None:
+                self.on_loaded(chunk_id)
+
+    def evict(self):
+        # Always keep the chunk loaded last, even if it alone is over budget
+        while self.resident_bytes > self.budget and len(self.resident) > 1:
+            chunk_id, _ = self.resident.popitem(last=False)
+            self.resident_bytes -= int(self.chunk_bytes[chunk_id])
+
+    def want(self, chunk_ids):
+        """Replace the load requests with chunk_ids, in priority order
+
+        Chunks no longer wanted are never read, so a moving camera does not
+        leave a backlog of stale loads behind.
+        """
+        with self.cond:
+            self.wanted = [c for c in chunk_ids if c not in self.resident and c not in self.in_flight]
+            self.cond.notify_all()
+
+    def get(self, chunk_id):
+        """Resident chunk arrays (marked as recently used) or None"""
+        with self.cond:
+            arrays = self.resident.get(chunk_id)
+            if arrays is not None:
+                self.resident.move_to_end(chunk_id)
+            return arrays
+
+    @property
+    def loading(self):
+        return bool(self.wanted or self.in_flight)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+
+class StreamingRenderer:
+    def __init__(self, store, width, height):
+        self.store = store
+        self.width = width
+        self.height = height
+        self.drawn_chunks = 0
+
+    def segments(self, view):
+        """(x0, y0, x1, y1) int screen segments of the resident visible chunks
+
+        view maps model space {'x', 'y', 'z'} columns to view space. Visible
+        chunks are requested nearest first, as many as fit in the byte
+        budget, so the working set never evicts itself.
+        """
+        visible = visible_boxes(self.store.chunk_bounds, view, self.width / self.height)
+        centers = self.store.chunk_bounds[visible].mean(axis=1)
+        depth = view({'x': centers[:, 0], 'y': centers[:, 1], 'z': centers[:, 2]})['z']
+        visible = visible[np.argsort(depth)]
+        fits = np.cumsum(self.store.chunk_bytes[visible]) <= self.store.budget
+        fits[:1] = True
+        selected = visible[fits].tolist()
+        self.store.want(selected)
+
+        parts = []
+        for chunk_id in selected:
+            arrays = self.store.get(chunk_id)
+            if arrays is None:
+                continue
+            v = arrays['vertices']
+            p = view({'x': v[:, 0], 'y': v[:, 1], 'z': v[:, 2]})
+            # Vertices behind the camera would project mirrored, their edges are left out
+            ok = p['z'] > NEAR
+            safe = np.where(ok, p['z'], 1)
+            xs = ((self.width + p['x'] / safe * self.height) / 2).astype(int)
+            ys = ((1 - (p['y'] / safe + 1) / 2) * self.height).astype(int)
+            edges = arrays['edges'][ok[arrays['edges']].all(axis=1)]
+            a, b = edges[:, 0], edges[:, 1]
+            parts.append(np.stack([xs[a], ys[a], xs[b], ys[b]], axis=1))
+        self.drawn_chunks = len(parts)
+        if not parts:
+            return np.zeros((0, 4), dtype=int)
+        return np.concatenate(parts)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python streaming.py <mesh.obj|mesh.npz> <output.chunks>")
+        sys.exit(1)
+    if sys.argv[1].lower().endswith('.obj'):
+        convert_obj(sys.argv[1], sys.argv[2])
+    else:
+        write_chunked(sys.argv[2], mesh.load(sys.argv[1]))
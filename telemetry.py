@@ -0,0 +1,150 @@
+"""Frame time telemetry for long running viewers
+
+Frames are recorded into cheap running aggregates (count, sum, min, max and
+a fixed-bucket histogram). Every interval the aggregates are exported as
+one JSON object per line to a file, or as StatsD metrics over UDP, and
+reset. Recording a frame is a few additions, so it can stay on in
+production; sample_rate additionally skips frames at random.
+
+    telemetry = Telemetry(path="metrics.ndjson", interval=10)
+    telemetry.record_frame(frame_time, draw_calls=backend.counts['calls'])
+    telemetry.close()
+
+A path of the form udp://host:port sends StatsD lines instead.
+"""
+import bisect
+import json
+import random
+import socket
+import time
+
+# Upper bounds (ms) of the frame time histogram buckets, the last bucket is open ended
+HISTOGRAM_BUCKETS = (4, 8, 12, 16.7, 20, 25, 33.3, 50, 100, 250)
+
+DEFAULT_INTERVAL = 10.0  # seconds between exports
+STATSD_PREFIX = "engine3d"
+
+
+class Telemetry:
+    def __init__(self, path=None, interval=DEFAULT_INTERVAL, sample_rate=1.0,
+                 buffers=None, clock=time.monotonic):
+        """path is a file path (NDJSON, appended) or udp://host:port (StatsD),
+        buffers a dict of name -> array whose nbytes are reported"""
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f"sample_rate must be in (0, 1], got {sample_rate}")
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.buffers = dict(buffers or {})
+        self.clock = clock
+        self.file = None
+        self.sock = None
+        self.address = None
+        if path is not None and path.startswith("udp://"):
+            host, _, port = path[len("udp://"):].rpartition(":")
+            self.address = (host or "127.0.0.1", int(port))
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+        elif path is not None:
+            self.file = open(path, "a", buffering=1)
+        self.started = self.clock()
+        self.reset()
+
+    def reset(self):
+        self.window_start = self.clock()
+        self.frames = 0
+        self.sampled = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+        self.draw_calls = 0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def record_frame(self, frame_time, draw_calls=0):
+        """Record one frame, frame_time in seconds. Exports when the interval is over."""
+        self.frames += 1
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            ms = frame_time * 1000
+            self.sampled += 1
+            self.total_ms += ms
+            if ms < self.min_ms:
+                self.min_ms = ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+            self.draw_calls += draw_calls
+            self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, ms)] += 1
+        if self.clock() - self.window_start >= self.interval:
+            self.flush()
+
+    def snapshot(self):
+        """Aggregates of the current window as a dict"""
+        now = self.clock()
+        elapsed = now - self.window_start
+        sampled = self.sampled or 1
+        return {
+            "ts": time.time(),
+            "uptime_s": round(now - self.started, 3),
+            "window_s": round(elapsed, 3),
+            "frames": self.frames,
+            "sampled": self.sampled,
+            "fps": round(self.frames / elapsed, 2) if elapsed > 0 else 0.0,
+            "frame_ms": {
+                "mean": round(self.total_ms / sampled, 3),
+                "min": round(self.min_ms, 3) if self.sampled else 0.0,
+                "max": round(self.max_ms, 3),
+            },
+            "frame_ms_histogram": {
+                "le": list(HISTOGRAM_BUCKETS) + ["inf"],
+                "counts": list(self.histogram),
+            },
+            "draw_calls_per_frame": round(self.draw_calls / sampled, 1),
+            "buffer_bytes": {name: int(getattr(b, "nbytes", 0)) for name, b in self.buffers.items()},
+        }
+
+    def flush(self):
+        """Export the current window and start a new one"""
+        if self.frames:
+            record = self.snapshot()
+            if self.file is not None:
+                self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            elif self.sock is not None:
+                self.send_statsd(record)
+        self.reset()
+
+    def send_statsd(self, record):
+        lines = [
+            f"{STATSD_PREFIX}.fps:{record['fps']}|g",
+            f"{STATSD_PREFIX}.frame_ms.mean:{record['frame_ms']['mean']}|g",
+            f"{STATSD_PREFIX}.frame_ms.max:{record['frame_ms']['max']}|g",
+            f"{STATSD_PREFIX}.draw_calls:{record['draw_calls_per_frame']}|g",
+        ]
+        for le, count in zip(record["frame_ms_histogram"]["le"], record["frame_ms_histogram"]["counts"]):
+            lines.append(f"{STATSD_PREFIX}.frame_ms.le_{le}:{count}|c")
+        for name, nbytes in record["buffer_bytes"].items():
+            lines.append(f"{STATSD_PREFIX}.buffer_bytes.{name}:{nbytes}|g")
+        try:
+            self.sock.sendto("\n".join(lines).encode(), self.address)
+        except OSError:
+            pass  # nobody listening or buffer full, metrics are best effort
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def from_settings(settings, buffers=None):
+    """Telemetry configured by the telemetry (path or udp://host:port),
+    telemetry_interval and telemetry_sample settings (see config.py), None
+    without a telemetry path"""
+    if not settings["telemetry"]:
+        return None
+    return Telemetry(
+        settings["telemetry"],
+        interval=settings["telemetry_interval"],
+        sample_rate=settings["telemetry_sample"],
+        buffers=buffers,
+    )
@@ -0,0 +1,149 @@
+"""Textures as NumPy mipmap chains, shared through a byte bounded cache
+
+A texture is decoded once into an (H, W, 3) uint8 array and box filtered
+down to 1x1 (levels[0] is the full image, every level halves both sides).
+Sampling is nearest texel within one level; the level comes from the
+texel footprint of a screen pixel, which the rasterizer works out once
+per screen tile and triangle (see backends.textured()), so neighbouring
+pixels read from the same, small level instead of striding across the
+full image.
+
+Decoded textures are shared: every mesh asking for the same file gets the
+same Texture from the module cache, least recently used ones are dropped
+once the cache holds more than its budget. The cache may be used from
+several threads (see loader.py), decoding happens outside its lock.
+
+    texture = textures.load("models/crate.png")
+    colors = texture.sample(u, v, footprint)
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+TEXTURE_BUDGET = 64 << 20  # bytes of decoded mipmap chains the cache keeps
+
+
+def decode(path):
+    """(H, W, 3) uint8 pixels of an image file, first row at the top"""
+    return np.ascontiguousarray(pygame.surfarray.array3d(pygame.image.load(path)).swapaxes(0, 1))
+
+def mipmaps(image):
+    """[image, half size, ..., 1x1] by averaging 2x2 blocks, odd sides repeat their last row/column"""
+    levels = [np.ascontiguousarray(image, dtype=np.uint8)]
+    while max(levels[-1].shape[:2]) > 1:
+        pixels = levels[-1].astype(np.float32)
+        for axis in (0, 1):
+            if pixels.shape[axis] == 1:
+                continue
+            if pixels.shape[axis] % 2:
+                pixels = np.concatenate([pixels, pixels.take([-1], axis=axis)], axis=axis)
+            pixels = (pixels.take(np.arange(0, pixels.shape[axis], 2), axis=axis)
+                      + pixels.take(np.arange(1, pixels.shape[axis], 2), axis=axis)) * 0.5
+        levels.append((pixels + 0.5).astype(np.uint8))
+    return levels
+
+
+class Texture:
+    def __init__(self, image):
+        """image is (H, W, 3) uint8, the mipmap chain is built right away"""
+        self.levels = mipmaps(image)
+
+    @property
+    def size(self):
+        """(width, height) of the full resolution level"""
+        height, width = self.levels[0].shape[:2]
+        return width, height
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def level(self, footprint):
+        """Mip level for footprints in full resolution texels per screen pixel, the nearest one"""
+        footprint = np.maximum(np.asarray(footprint, dtype=np.float64), 1.0)
+        return np.minimum(np.floor(np.log2(footprint) + 0.5).astype(np.int64), len(self.levels) - 1)
+
+    def sample(self, u, v, footprint):
+        """(N, 3) uint8 texels at texture coordinates u, v (wrapping, v = 0 is the bottom row)"""
+        level = self.level(footprint)
+        out = np.empty((len(level), 3), dtype=np.uint8)
+        for n in np.unique(level).tolist():
+            pick = np.flatnonzero(level == n)
+            image = self.levels[n]
+            height, width = image.shape[:2]
+            x = np.floor(u[pick] * width).astype(np.int64) % width
+            y = np.floor((1 - v[pick]) * height).astype(np.int64) % height
+            out[pick] = image[y, x]
+        return out
+
+
+class TextureCache:
+    """Decoded textures by file, least recently used dropped beyond budget bytes"""
+
+    def __init__(self, budget=TEXTURE_BUDGET):
+        self.budget = budget
+        self.resident = OrderedDict()  # (path, mtime) -> Texture, least recently used first
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Texture of an image file, decoded on first use or after the file changed"""
+        path = os.path.abspath(path)
+        key = (path, os.stat(path).st_mtime_ns)
+        with self.lock:
+            texture = self.resident.get(key)
+            if texture is not None:
+                self.resident.move_to_end(key)
+                self.hits += 1
+                return texture
+            self.misses += 1
+
+        texture = Texture(decode(path))
+        with self.lock:
+            if key not in self.resident:  # another thread may have decoded it meanwhile
+                self.resident[key] = texture
+                self.resident_bytes += texture.nbytes
+                self.evict()
+            return self.resident.get(key, texture)
+
+    def evict(self):
+        # The newest texture stays even if it alone is over budget
+        while self.resident_bytes > self.budget and len(self.resident) > 1:
+            _, texture = self.resident.popitem(last=False)
+            self.resident_bytes -= texture.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.resident.clear()
+            self.resident_bytes = 0
+
+
+# Shared by every mesh in the process
+cache = TextureCache()
+
+def load(path):
+    return cache.get(path)
+
+def material_texture(obj_path):
+    """Diffuse map (map_Kd) of the first material of an OBJ file that has one, None otherwise"""
+    folder = os.path.dirname(os.path.abspath(obj_path))
+    with open(obj_path) as f:
+        libraries = [line.split(None, 1)[1].strip() for line in f if line.startswith('mtllib ')]
+    for library in libraries:
+        path = os.path.join(folder, library)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if parts and parts[0] == 'map_Kd':
+                    # Options (-s, -o, ...) come first, the file name is last
+                    return os.path.join(os.path.dirname(path), parts[-1])
+    return None
@@ -1,23 +1,49 @@
 import pygame
 import math
 import sys
+import time
+
+import numpy as np
+
+import backends
+import config
+import lighting
+import loader
+import mesh
+import pacing
+import pointcloud
+import profiling
+import shadows
+import streaming
+import telemetry
+import textures
 
 # Initialize Pygame
 pygame.init()
 
 
 
+# Settings: defaults overridden by ENGINE_* variables, see config.py.
+# Engine3D (a TOML file, command line flags) reconfigures everything below.
+settings = config.from_environment()
+
 # Constants
-BACKGROUND = "#101010"
-FOREGROUND = "#50FF50"
-WIDTH, HEIGHT = 800, 800
-FPS = 60
+BACKGROUND = settings['background']
+FOREGROUND = settings['foreground']
+WIDTH, HEIGHT = settings['width'], settings['height']
+FPS = settings['fps']  # frame cap, 0 for uncapped
+VSYNC = settings['vsync']
 
 # screen display
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("3D Engine - SchadowRoot17")
+# Offscreen until main() opens the window, so the engine can be imported
+# and rendered headless (see frameserver.py)
+screen = pygame.Surface((WIDTH, HEIGHT))
 clock = pygame.time.Clock()
 
+# Where the drawing goes, see backends.py: 'pygame', 'software' (NumPy
+# rasterizer) or 'null' (no drawing, for timing)
+backend = backends.create(settings['backend'], WIDTH, HEIGHT, screen)
+
 
 
 
@@ -26,8 +52,8 @@ def hex_to_rgb(hex_color):
     hex_color = hex_color.lstrip('#')
     return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
 
-BACKGROUND = hex_to_rgb("#101010")
-FOREGROUND = hex_to_rgb("#50FF50")
+BACKGROUND = hex_to_rgb(BACKGROUND)
+FOREGROUND = hex_to_rgb(FOREGROUND)
 
 
 # x, y, z coordinates
@@ -998,19 +1024,150 @@ fs = [
     [303, 317, 323],
 ]
 
+def load_model(path=None, cache=True, cache_dir=mesh.CACHE_DIR):
+    """Welded, cleaned up and cache ordered mesh of an OBJ/NPZ file, or of vs/fs
+    without a path (preprocessed once, then loaded from cache_dir)"""
+    cache_dir = cache_dir if cache else None
+    if path:
+        return mesh.load(path, cache_dir=cache_dir)
+    return mesh.prepare(*mesh.from_dicts(vs, fs), cache_dir=cache_dir)
+
+# Used for drawing. A mesh file named by the settings loads in the
+# background (see start_loading()), the penguin stands in until it is ready.
+load_in_background = settings['background_load'] and bool(settings['mesh'])
+model = load_model(None if load_in_background else settings['mesh'], settings['cache'], settings['cache_dir'])
+model_points = model.columns()
+
+def model_buffers():
+    return {
+        'vertices': model.vertices,
+        'face_indices': model.face_indices,
+        'face_offsets': model.face_offsets,
+        'edges': model.edges,
+    }
+
+def mesh_buffers():
+    """Every array kept for the model: the mesh and its screen projection"""
+    return {
+        **model_buffers(),
+        'triangles': model.triangles,
+        'tri_faces': model.tri_faces,
+        'uvs': model.uvs,
+        'projected': projected,
+        'projected_z': projected_z,
+    }
+
+# Allocation profiling, enabled by the profile_allocations setting
+# (ENGINE_PROFILE_ALLOCATIONS): main() traces what every frame allocates
+# and times the garbage collections, the summary is printed on exit
+profiler = None
+
+# Frame metrics export, enabled by the telemetry setting (a file path for
+# NDJSON or udp://host:port for StatsD), see telemetry.py
+TELEMETRY_SETTINGS = ('telemetry', 'telemetry_interval', 'telemetry_sample')
+metrics = telemetry.from_settings(settings, buffers=model_buffers())
+
+# Point cloud mode: the point_cloud setting (ENGINE_POINT_CLOUD) is a scan
+# (.npy or raw float32 xyz) rendered instead of the penguin, see pointcloud.py
+def open_cloud(path):
+    return pointcloud.PointRenderer(pointcloud.PointCloud.open(path), WIDTH, HEIGHT,
+                                    color=FOREGROUND, background=BACKGROUND)
+
+cloud = open_cloud(settings['point_cloud']) if settings['point_cloud'] else None
+
+# Solid mode texture for meshes with UVs: the texture setting
+# (ENGINE_TEXTURE), else the diffuse map of the OBJ's material
+textures.cache.budget = int(settings['texture_budget_mb'] * (1 << 20))
+texture = None if load_in_background else loader.load_texture(settings['texture'], settings['mesh'])
+
+# Background loading: mesh and texture files load on worker threads (see
+# loader.py) while the window keeps handling input. Until the mesh is in,
+# draw() shows the bounding box and a sample of the vertices read so far.
+MESH_LOADING = pygame.event.custom_type()
+LOADING_POINTS = 5000  # partial vertices drawn at most
+
+def loading_update(job):
+    # Wakes the loop up in on-demand mode, post() is thread safe
+    if pygame.get_init():
+        pygame.event.post(pygame.event.Event(MESH_LOADING))
+
+assets = loader.Loader(on_update=loading_update)
+loading = {}         # 'mesh' / 'texture' -> loader.Job not picked up yet
+loading_key = None   # what those jobs load
+
+def start_loading(path, texture_path=None, cache_dir=mesh.CACHE_DIR):
+    """Load a mesh file and its texture in the background, finish_loading() swaps them in"""
+    global loading_key
+    key = (path, texture_path, cache_dir)
+    if loading and key == loading_key:
+        return  # already on its way
+    cancel_loading()
+    loading['mesh'] = assets.mesh(path, cache_dir=cache_dir)
+    # Looking for the material's map_Kd reads the OBJ as well
+    loading['texture'] = assets.texture(texture_path, path)
+    loading_key = key
+
+def cancel_loading():
+    for job in loading.values():
+        job.cancel()
+    loading.clear()
+
+def finish_loading():
+    """Swap in the jobs that are done, the texture not before its mesh"""
+    global texture
+    job = loading.get('mesh')
+    if job is not None and job.done:
+        del loading['mesh']
+        try:
+            set_model(job.result())
+        except Exception as e:
+            print(f"Could not load {job.name}: {e}")
+            cancel_loading()
+    job = loading.get('texture')
+    if job is not None and job.done and 'mesh' not in loading:
+        del loading['texture']
+        try:
+            texture = job.result()
+        except Exception as e:
+            print(f"Could not load the texture for {job.name}: {e}")
+
+if load_in_background:
+    start_loading(settings['mesh'], settings['texture'], settings['cache_dir'] if settings['cache'] else None)
+
+# Out-of-core mode: the stream_mesh setting (ENGINE_STREAM_MESH) is a
+# chunked mesh (see streaming.py) streamed instead of drawing the penguin,
+# resident chunks are capped at stream_budget_mb (ENGINE_STREAM_BUDGET_MB)
+CHUNK_LOADED = pygame.event.custom_type()
+
+def open_stream(path, budget_mb, threads=1):
+    return streaming.StreamingRenderer(
+        streaming.ChunkStore(
+            path,
+            budget=int(budget_mb * (1 << 20)),
+            # Wakes the loop up in on-demand mode, post() is thread safe
+            on_loaded=lambda chunk_id: pygame.event.post(pygame.event.Event(CHUNK_LOADED)),
+            workers=threads),
+        WIDTH, HEIGHT)
+
+stream = None
+if settings['stream_mesh']:
+    stream = open_stream(settings['stream_mesh'], settings['stream_budget_mb'], settings['stream_threads'])
+
 
 # Helper functions
 def clear():
-    screen.fill(BACKGROUND)
+    backend.clear(BACKGROUND)
 
 def point(pos, size=10):
-    pygame.draw.rect(screen, FOREGROUND, 
-                    (pos['x'] - size//2, pos['y'] - size//2, size, size))
+    backend.draw_points(np.array([[int(pos['x']), int(pos['y'])]]), FOREGROUND, size)
 
 def line(p1, p2):
-    pygame.draw.line(screen, FOREGROUND, 
-                    (int(p1['x']), int(p1['y'])), 
-                    (int(p2['x']), int(p2['y'])), 3)
+    backend.draw_lines(np.array([[int(p1['x']), int(p1['y']), int(p2['x']), int(p2['y'])]]), FOREGROUND, 3)
+
+def lines(segments, colors=None, color=FOREGROUND, width=None):
+    """Draw (N, 4) x0 y0 x1 y1 segments, all in color or one (r, g, b) row of colors per segment,
+    width defaults to line_width"""
+    backend.draw_lines(segments, color if colors is None else colors, width or line_width)
 
 
 #def screen_coords(p):
@@ -1021,10 +1178,12 @@ def line(p1, p2):
      # }
 
 def screen_coords(p):
-    """Convert -1..1 coordinates to screen coordinates"""
+    """Convert -1..1 coordinates (vertically, wider screens see more in x) to coordinates on
+    the backend, which is smaller than the screen below render scale 1"""
+    width, height = backend.width, backend.height
     return {
-        'x': (p['x'] + 1) / 2 * WIDTH,
-        'y': (1 - (p['y'] + 1) / 2) * HEIGHT,
+        'x': (width + p['x'] * height) / 2,
+        'y': (1 - (p['y'] + 1) / 2) * height,
     }
 
 def project(p):
@@ -1037,6 +1196,9 @@ def project(p):
 def translate_z(p, dz):
     return {'x': p['x'], 'y': p['y'], 'z': p['z'] + dz}
 
+def translate_xy(p, dx, dy):
+    return {'x': p['x'] + dx, 'y': p['y'] + dy, 'z': p['z']}
+
 def rotate_xz(p, angle):
     c = math.cos(angle)
     s = math.sin(angle)
@@ -1046,70 +1208,586 @@ def rotate_xz(p, angle):
         'z': p['x'] * s + p['z'] * c,
     }
 
+def rotate_yz(p, angle):
+    c = math.cos(angle)
+    s = math.sin(angle)
+    return {
+        'x': p['x'],
+        'y': p['y'] * c - p['z'] * s,
+        'z': p['y'] * s + p['z'] * c,
+    }
+
 # Game variables
-dz = 1
+dz = settings['distance']
 angle = 0
 
-def frame():
+# Orbit camera
+# angle is the yaw (also driven by the automatic spin), pitch tilts the
+# model towards the viewer, pan shifts it in view space
+pitch = 0
+pan_x = 0
+pan_y = 0
+spin = settings['spin']
+# On-demand mode: block on input and only redraw when the view changes
+on_demand = settings['on_demand']
+# Wireframe colouring: 'light' (Gouraud shaded), 'depth' (depth cued) or 'flat' (FOREGROUND)
+EDGE_SHADINGS = config.CHOICES['edge_shading']
+edge_shading = settings['edge_shading']
+# Depth cueing: edges are bucketed by depth, each bucket drawn in one colour/width
+DEPTH_BUCKETS = 6
+NEAR_WIDTH, FAR_WIDTH = 3, 1
+# 'wireframe' or 'solid' (flat shaded, depth tested triangles)
+RENDER_MODES = config.CHOICES['render_mode']
+render_mode = settings['render_mode']
+# Solid mode shadows (shadows.py). The light is then fixed to the model
+# instead of the camera, so the cached shadow map survives camera moves.
+cast_shadows = settings['shadows']
+shadow_map = shadows.ShadowMap(model, settings['shadow_size'])
+# Quality knobs, lowered by the adaptive controller (pacing.py) when
+# frames run over target_ms
+line_width = 3       # wireframe line width
+min_edge = 0.0       # wireframe LOD: shortest edge drawn, in pixels
+cull = False         # solid: skip back faces (closed, outward wound meshes only)
+render_scale = 1.0   # below 1 frames are drawn smaller and scaled up to the window
+pacer = pacing.QualityController(settings['target_ms']) if settings['adaptive'] else None
+
+SPIN_SPEED = settings['spin_speed']  # radians per second
+ORBIT_SPEED = 0.01         # radians per dragged pixel
+PAN_SPEED = 0.002          # view units per dragged pixel
+KEY_ORBIT = math.pi / 36   # radians per key press
+KEY_PAN = 0.02             # view units per key press
+ZOOM_STEP = 0.1            # dz change per wheel notch / key press
+# Zoom limits in model radii (the farthest vertex from the origin the
+# camera orbits), the near one keeps the camera outside the model
+MIN_ZOOM, MAX_ZOOM = 1.05, 13
+MAX_PITCH = math.pi / 2
+
+def reset_camera():
+    global dz, angle, pitch, pan_x, pan_y
+    dz = settings['distance']
+    angle = 0
+    pitch = 0
+    pan_x = 0
+    pan_y = 0
+
+def zoom_limits():
+    """(nearest, farthest) camera distance dz for the current model"""
+    radius = float(np.sqrt((model.vertices.astype(np.float64) ** 2).sum(axis=1).max())) if len(model.vertices) else 1.0
+    return radius * MIN_ZOOM + backends.NEAR, radius * MAX_ZOOM
+
+def zoom(steps):
+    global dz
+    near, far = zoom_limits()
+    # A camera set up outside the limits (the distance setting) is not pulled towards them
+    dz = min(max(dz + steps * ZOOM_STEP, min(near, dz)), max(far, dz))
+
+def orbit(d_yaw, d_pitch):
+    global angle, pitch
+    angle += d_yaw
+    pitch = min(max(pitch + d_pitch, -MAX_PITCH), MAX_PITCH)
+
+def pan(dx, dy):
+    global pan_x, pan_y
+    pan_x += dx
+    pan_y += dy
+
+def shutdown():
+    cancel_loading()
+    assets.close()
+    if profiler is not None:
+        print(profiler.format())
+        profiler.stop()
+    if metrics is not None:
+        metrics.close()
+    if stream is not None:
+        stream.store.close()
+    pygame.quit()
+
+def exit_engine():
+    print("\nExiting... \n")
+    print("crated by ShadowRoot17 \n")
+    print("inspired by Tsoding\n")
+    shutdown()
+    sys.exit()
+
+def handle_event(event):
+    """Apply an input event to the camera, returns True if the view changed"""
+    global spin, on_demand, edge_shading, render_mode, cast_shadows
+
+    if event.type == pygame.QUIT:
+        shutdown()
+        sys.exit()
+
+    if event.type == pygame.MOUSEWHEEL:
+        zoom(-event.y)
+        return True
+
+    if event.type == pygame.MOUSEMOTION:
+        dx, dy = event.rel
+        if event.buttons[0]:  # left drag orbits
+            orbit(-dx * ORBIT_SPEED, -dy * ORBIT_SPEED)
+            return True
+        if event.buttons[1] or event.buttons[2]:  # middle/right drag pans
+            pan(dx * PAN_SPEED, -dy * PAN_SPEED)
+            return True
+        return False
+
+    if event.type == pygame.KEYDOWN:
+        key = event.key
+        if key == pygame.K_ESCAPE:
+            exit_engine()
+        if key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN):
+            sign = 1 if key in (pygame.K_RIGHT, pygame.K_UP) else -1
+            horizontal = key in (pygame.K_LEFT, pygame.K_RIGHT)
+            if event.mod & pygame.KMOD_SHIFT:
+                pan(sign * KEY_PAN if horizontal else 0,
+                    0 if horizontal else sign * KEY_PAN)
+            elif horizontal:
+                orbit(-sign * KEY_ORBIT, 0)
+            else:
+                orbit(0, sign * KEY_ORBIT)
+            return True
+        if key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+            zoom(-1)
+            return True
+        if key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+            zoom(1)
+            return True
+        if key == pygame.K_r:
+            reset_camera()
+            return True
+        if key == pygame.K_SPACE:
+            spin = not spin
+            return True
+        if key == pygame.K_o:
+            on_demand = not on_demand
+            return False
+        if key == pygame.K_l:
+            edge_shading = EDGE_SHADINGS[(EDGE_SHADINGS.index(edge_shading) + 1) % len(EDGE_SHADINGS)]
+            return True
+        if key == pygame.K_m:
+            render_mode = RENDER_MODES[(RENDER_MODES.index(render_mode) + 1) % len(RENDER_MODES)]
+            return True
+        if key == pygame.K_s:
+            cast_shadows = not cast_shadows
+            return render_mode == 'solid'
+        if key == pygame.K_a:
+            set_adaptive(pacer is None)
+            return True
+
+    # A streamed chunk became resident
+    if event.type == CHUNK_LOADED:
+        return True
+
+    # A background load made progress or finished
+    if event.type == MESH_LOADING:
+        return True
+
+    # Window exposed/resized/restored: the surface needs repainting
+    if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED,
+                      pygame.WINDOWRESTORED, pygame.WINDOWSIZECHANGED):
+        return True
+
+    return False
+
+def transform(p):
+    """Model space to view space for the current camera"""
+    p = rotate_yz(rotate_xz(p, angle), pitch)
+    return translate_z(translate_xy(p, pan_x, pan_y), dz)
+
+# Screen coordinates (and view space depth) of model_points for the
+# camera they were computed with. While the camera stays put only vertices
+# changed through model.update_vertices() are reprojected.
+projected = None
+projected_z = None
+projected_camera = None
+projected_dirty = model.track()
+
+def project_model():
+    """Screen x/y rows of every model vertex for the current camera, meaningless for
+    vertices at or behind the near plane (projected_z <= backends.NEAR), see in_front()"""
+    global projected, projected_z, projected_camera
+
+    camera = (angle, pitch, pan_x, pan_y, dz)
+    # A vertex at z = 0 projects to infinity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if camera != projected_camera:
+            projected_dirty.take()
+            view = transform(model_points)
+            points = screen_coords(project(view))
+            projected = np.stack([points['x'], points['y']]).astype(int)
+            projected_z = view['z']
+            projected_camera = camera
+        else:
+            for start, stop in projected_dirty.take():
+                part = {k: c[start:stop] for k, c in model_points.items()}
+                view = transform(part)
+                points = screen_coords(project(view))
+                projected[0, start:stop] = points['x']
+                projected[1, start:stop] = points['y']
+                projected_z[start:stop] = view['z']
+    return projected
+
+def in_front(primitives):
+    """(N,) True for the (N, K) vertex index rows (edges, triangles) entirely in front of the near plane"""
+    return (projected_z[primitives] > backends.NEAR).all(axis=1)
+
+def model_light(fixed=False):
+    """lighting.LIGHT_DIRECTION in model space for the current camera, taken as
+    model space as it is if the light is fixed to the model"""
+    if fixed:
+        return lighting.LIGHT_DIRECTION
+    # Rotate the light back into model space instead of every normal into view space
+    l = dict(zip('xyz', lighting.LIGHT_DIRECTION))
+    l = rotate_xz(rotate_yz(l, -pitch), -angle)
+    return (l['x'], l['y'], l['z'])
+
+def edge_colors():
+    """(E, 3) colours of the model edges for the current edge_shading, None for plain FOREGROUND"""
+    if edge_shading != 'light':
+        return None
+    intensity = lighting.edge_intensity(lighting.gouraud(model, model_light()), model.edges)
+    return lighting.tint(intensity, FOREGROUND, BACKGROUND)
+
+def depth_cued_lines(segments, edges):
+    """Draw the segments of edges in depth buckets, far to near, fading and thinning with depth"""
+    if not len(segments):
+        return
+    edge_z = (projected_z[edges[:, 0]] + projected_z[edges[:, 1]]) * 0.5
+    bucket = lighting.depth_buckets(edge_z, DEPTH_BUCKETS)
+    colors = lighting.tint(lighting.bucket_intensity(DEPTH_BUCKETS), FOREGROUND, BACKGROUND)
+    widths = np.linspace(min(NEAR_WIDTH, line_width), FAR_WIDTH, DEPTH_BUCKETS).round().astype(int).tolist()
+
+    # Group the segments by bucket, farthest bucket first so near edges end up on top
+    order = np.argsort(-bucket, kind='stable')
+    counts = np.bincount(bucket, minlength=DEPTH_BUCKETS)[::-1]
+    batches = np.split(segments[order], np.cumsum(counts)[:-1])
+    for k, batch in zip(range(DEPTH_BUCKETS - 1, -1, -1), batches):
+        lines(batch, color=colors[k], width=widths[k])
+
+def solid(xs, ys):
+    """Draw the model triangles flat shaded (and textured if it has UVs), the backend does the depth test"""
+    to_light = model_light(fixed=cast_shadows)
+    # Triangles reaching behind the camera would project mirrored
+    tri = np.flatnonzero(in_front(model.triangles))
+    t = model.triangles[tri]
+    intensity = lighting.flat(model, to_light)[model.tri_faces[tri]]
+    corners = np.stack([xs[t], ys[t]], axis=-1)
+    if cull:
+        keep = front_facing(corners)
+        tri, t, intensity, corners = tri[keep], t[keep], intensity[keep], corners[keep]
+    albedo = None
+    if texture is not None and model.uvs is not None:
+        albedo = backend.draw_textured(corners, projected_z[t], model.uvs[t], texture, intensity)
+    else:
+        backend.draw_triangles(corners, projected_z[t], lighting.tint(intensity, FOREGROUND, BACKGROUND))
+    if cast_shadows:
+        shadow_pass(tri, corners, to_light, albedo)
+
+def front_facing(corners):
+    """Which (N, 3, 2) screen triangles face the camera: clockwise on screen, where y points down"""
+    a, b, c = corners[:, 0], corners[:, 1], corners[:, 2]
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0]) > 0
+
+def shadow_pass(tri, corners, to_light, albedo=None):
+    """Paint the pixels of model triangles tri (drawn at the (N, 3, 2) screen corners)
+    the light does not reach in the ambient colour, or their texels (albedo, per pixel)
+    at ambient intensity"""
+    shadow_map.update(to_light)
+    # The model space point of every pixel, interpolated from the triangle's
+    # corners: the corners are whole pixels on screen, so a point taken back
+    # from the drawn depth would be up to a pixel off the surface, several
+    # shadow map texels in depth
+    t = model.triangles[tri]
+    index, drawn, points = backends.nearest_fragments(corners, projected_z[t], model.vertices[t],
+                                                      backend.width, backend.height)
+    lit = shadow_map.lit(points, model.face_normals()[model.tri_faces[tri[drawn]]])
+    index = index[~lit]
+    if albedo is not None:
+        backend.set_pixels(index, (albedo[index] * lighting.AMBIENT).astype(np.uint8))
+    else:
+        backend.set_pixels(index, lighting.tint(np.array([lighting.AMBIENT]), FOREGROUND, BACKGROUND)[0])
+
+def screen_points(points):
+    """(N, 2) screen coordinates of (N, 3) model space points, (N,) True for those in front of the camera"""
+    view = transform({'x': points[:, 0], 'y': points[:, 1], 'z': points[:, 2]})
+    front = view['z'] > backends.NEAR
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = screen_coords(project(view))
+    return np.stack([p['x'], p['y']], axis=1), front
+
+def draw_loading(job):
+    """Bounding box and a sample of the vertices the mesh job read so far, and its progress"""
+    bounds = job.bounds()
+    if bounds is not None:
+        lo, hi = bounds
+        corners = np.array([[x, y, z] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+        box, front = screen_points(corners)
+        if front.all():
+            # Corner index bits are z, y, x: an edge joins corners one bit apart
+            a, b = np.array([(i, i | bit) for i in range(8) for bit in (1, 2, 4) if not i & bit]).T
+            lines(np.concatenate([box[a], box[b]], axis=1), color=FOREGROUND, width=1)
+        vertices = job.partial()
+        points, front = screen_points(vertices[::max(1, len(vertices) // LOADING_POINTS)])
+        backend.draw_points(points[front], FOREGROUND)
+
+    # Progress bar along the bottom edge
+    x0, x1, y = 20, backend.width - 20, backend.height - 12
+    track = lighting.tint(np.array([lighting.AMBIENT]), FOREGROUND, BACKGROUND)[0]
+    backend.draw_lines([[x0, y, x1, y]], track, 6)
+    if job.progress > 0:
+        backend.draw_lines([[x0, y, x0 + round((x1 - x0) * job.progress), y]], FOREGROUND, 6)
+
+def refining():
+    return cloud is not None and not cloud.done
+
+def frame(events):
+    """Process events and advance the animation, redraws if the view changed"""
     global angle
-    
-    # Handle events
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-        if event.type == pygame.KEYDOWN:  # ESC key
-            if event.key == pygame.K_ESCAPE:
-                print("\nExiting... \n")
-                print("crated by ShadowRoot17 \n")
-                print("inspired by Tsoding\n")
-                pygame.quit()
-                sys.exit()
+
+    changed = False
+    for event in events:
+        if handle_event(event):
+            changed = True
 
     # Update
-    dt = 1 / FPS
-    angle += math.pi / 4 * dt  # Rotate slower
-    # angle += 0 # No rotation
-    #angle+= math.pi *dt  # Rotate faster
-    
+    if spin:
+        # Uncapped: advance by the measured time of the last frame
+        dt = 1 / FPS if FPS else clock.get_time() / 1000
+        angle += SPIN_SPEED * dt
+        changed = True
+
+    # Vertices edited in place or a point cloud still refining need a redraw as well
+    if not changed and not projected_dirty and not refining():
+        return False
+
+    draw()
+
+    # Update display
+    present()
+    return True
+
+def present():
+    """Show the frame, scaled up to the window if it was drawn smaller (render_scale)"""
+    backend.present()
+    if backend.surface is not screen:
+        pygame.transform.scale(backend.surface, screen.get_size(), screen)
+        if screen is pygame.display.get_surface():
+            pygame.display.flip()
+
+def draw():
+    """Draw the current view on screen"""
+    if loading:
+        finish_loading()
+
+    if cloud is not None:
+        # Splats as many chunks as fit in the frame budget, coarse first
+        image = cloud.render(transform, (angle, pitch, pan_x, pan_y, dz))
+        backend.blit(image)
+        return
+
     # Draw
     clear()
+
+    if stream is not None:
+        # Only what is resident, missing chunks are loading in the background
+        lines(stream.segments(transform))
+        return
+
+    if 'mesh' in loading:
+        draw_loading(loading['mesh'])
+        return
     
-    # Draw edges
-    for face in fs:
-        for i in range(len(face)):
-            a = vs[face[i]]
-            b = vs[face[(i + 1) % len(face)]]
-            
-            # Transform vertices
-            a_transformed = translate_z(rotate_xz(a, angle), dz)
-            b_transformed = translate_z(rotate_xz(b, angle), dz)
-            
-            # Project to 2D and convert to screen coordinates
-            a_screen = screen_coords(project(a_transformed))
-            b_screen = screen_coords(project(b_transformed))
-            
-            line(a_screen, b_screen)
+    # Transform every vertex once, the helpers work on whole
+    # x/y/z columns as well as on single vertex dicts
+    xs, ys = project_model()
+
+    if render_mode == 'solid':
+        solid(xs, ys)
+        return
+
+    # Draw edges, each shared edge only once, none reaching behind the camera
+    keep = in_front(model.edges)
+    edges = model.edges[keep]
+    a, b = edges[:, 0], edges[:, 1]
+    segments = np.stack([xs[a], ys[a], xs[b], ys[b]], axis=1)
+    colors = None if edge_shading == 'depth' else edge_colors()
+    colors = None if colors is None else colors[keep]
+    if min_edge:
+        # Screen space LOD: skip edges too short to make out at this quality
+        keep = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]) >= min_edge
+        edges, segments = edges[keep], segments[keep]
+        colors = None if colors is None else colors[keep]
+    if edge_shading == 'depth':
+        depth_cued_lines(segments, edges)
+    else:
+        lines(segments, colors)
     
     # Draw vertices 
     # for v in vs:
-    #     v_transformed = translate_z(rotate_xz(v, angle), dz)
+    #     v_transformed = transform(v)
     #     v_screen = screen_coords(project(v_transformed))
     #     point(v_screen)
-    
-    # Update display
-
-    pygame.display.flip()
 
 
 
 # Main game loop
+def use_backend(name):
+    """Switch the renderer backend (see backends.py), drawing into the same screen,
+    or into a smaller offscreen surface below render scale 1"""
+    global backend, projected_camera
+    if render_scale < 1 and cloud is None and stream is None:
+        size = max(1, round(WIDTH * render_scale)), max(1, round(HEIGHT * render_scale))
+        backend = backends.create(name, *size, pygame.Surface(size))
+    else:
+        backend = backends.create(name, WIDTH, HEIGHT, screen)
+    projected_camera = None  # screen coordinates depend on the backend size
+    settings['backend'] = name
+
+def apply_quality(quality):
+    """Set the quality knobs from one of pacing.QUALITY_LEVELS"""
+    global line_width, min_edge, cull, render_scale
+    line_width, min_edge, cull = quality['line_width'], quality['min_edge'], quality['cull']
+    if quality['scale'] != render_scale:
+        render_scale = quality['scale']
+        use_backend(settings['backend'])
+
+def set_adaptive(enabled):
+    """Turn the adaptive quality controller on or off, off restores full quality"""
+    global pacer
+    pacer = pacing.QualityController(settings['target_ms']) if enabled else None
+    settings['adaptive'] = enabled
+    apply_quality(pacing.QUALITY_LEVELS[0])
+
+def set_model(new_model):
+    """Draw new_model (a Mesh) from now on"""
+    global model, model_points, projected_camera, projected_dirty, shadow_map
+    model = new_model
+    model_points = model.columns()
+    projected_camera = None
+    projected_dirty = model.track()
+    shadow_map = shadows.ShadowMap(model, settings['shadow_size'])
+    if metrics is not None:
+        metrics.buffers = model_buffers()
+
+def configure(new_settings, custom_model=None):
+    """Apply config.py settings to the whole engine, custom_model (a Mesh) replaces the mesh setting"""
+    global settings, BACKGROUND, FOREGROUND, WIDTH, HEIGHT, FPS, VSYNC, SPIN_SPEED
+    global screen, cloud, stream, metrics
+    global spin, on_demand, edge_shading, render_mode, cast_shadows, texture, render_scale
+
+    previous, settings = settings, dict(new_settings)
+    BACKGROUND = hex_to_rgb(settings['background'])
+    FOREGROUND = hex_to_rgb(settings['foreground'])
+    WIDTH, HEIGHT = settings['width'], settings['height']
+    FPS = settings['fps']
+    VSYNC = settings['vsync']
+    SPIN_SPEED = settings['spin_speed']
+    spin = settings['spin']
+    on_demand = settings['on_demand']
+    edge_shading = settings['edge_shading']
+    render_mode = settings['render_mode']
+    cast_shadows = settings['shadows']
+
+    if screen.get_size() != (WIDTH, HEIGHT):
+        screen = pygame.Surface((WIDTH, HEIGHT))
+    render_scale = 1.0
+    use_backend(settings['backend'])
+
+    textures.cache.budget = int(settings['texture_budget_mb'] * (1 << 20))
+    if custom_model is None and settings['background_load'] and settings['mesh']:
+        # The current model stays on until the new one is in
+        start_loading(settings['mesh'], settings['texture'], settings['cache_dir'] if settings['cache'] else None)
+    else:
+        cancel_loading()
+        set_model(custom_model or load_model(settings['mesh'], settings['cache'], settings['cache_dir']))
+        texture = loader.load_texture(settings['texture'], None if custom_model else settings['mesh'])
+
+    cloud = open_cloud(settings['point_cloud']) if settings['point_cloud'] else None
+    if stream is not None:
+        stream.store.close()
+    stream = None
+    if settings['stream_mesh']:
+        stream = open_stream(settings['stream_mesh'], settings['stream_budget_mb'], settings['stream_threads'])
+    if any(settings[key] != previous[key] for key in TELEMETRY_SETTINGS):
+        # The old export flushes what it has, the new one starts empty
+        if metrics is not None:
+            metrics.close()
+        metrics = telemetry.from_settings(settings, buffers=model_buffers())
+    reset_camera()
+    set_adaptive(settings['adaptive'])
+
+def open_window():
+    global screen
+    try:
+        # pygame only syncs scaled or OpenGL windows to the display refresh
+        screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.SCALED if VSYNC else 0, vsync=int(VSYNC))
+    except pygame.error:
+        screen = pygame.display.set_mode((WIDTH, HEIGHT))  # no vsync on this display
+    pygame.display.set_caption("3D Engine - SchadowRoot17")
+    use_backend(settings['backend'])
+
 def main():
+    global profiler
+    open_window()
+    if settings['profile_allocations']:
+        profiler = profiling.AllocationProfiler(buffers=mesh_buffers)
+        profiler.start()
+
+    # Held arrow keys keep orbiting, also while blocked in on-demand mode
+    pygame.key.set_repeat(300, 30)
+
+    # First frame is always drawn
+    pygame.event.post(pygame.event.Event(pygame.VIDEOEXPOSE))
+
     running = True
     while running:
-        frame()
+        if on_demand and not spin and not refining():
+            # Sleep until something happens, then drain the rest of the queue
+            events = [pygame.event.wait()]
+            events.extend(pygame.event.get())
+        else:
+            events = pygame.event.get()
+        if profiler is not None:
+            profiler.begin_frame()
+        start = time.perf_counter()
+        if frame(events):
+            frame_time = time.perf_counter() - start
+            if profiler is not None:
+                profiler.end_frame(frame_time * 1000)
+            if metrics is not None:
+                metrics.record_frame(frame_time, draw_calls=backend.counts['calls'])
+            if pacer is not None and pacer.record(frame_time * 1000):
+                apply_quality(pacer.quality)
         clock.tick(FPS)
 
-if __name__ == "__main__":
-    main()
+class Engine3D:
+    """The engine as one object, configured with config.py settings
 
+        Engine3D(vertices=cube_vertices, faces=cube_faces).run()
+        Engine3D(settings=config.load("fast.toml"), fps=0).run()
+
+    vertices/faces are {'x', 'y', 'z'} dicts and vertex index lists like
+    vs/fs above, keyword options override single settings. The engine
+    state lives in this module, so there is one engine per process.
+    """
+
+    def __init__(self, vertices=None, faces=None, settings=None, **options):
+        if (vertices is None) != (faces is None):
+            raise ValueError("vertices and faces must be given together")
+        settings = config.update(dict(settings or config.from_environment()), options)
+        custom_model = None
+        if vertices is not None:
+            cache_dir = settings['cache_dir'] if settings['cache'] else None
+            custom_model = mesh.prepare(*mesh.from_dicts(vertices, faces), cache_dir=cache_dir)
+        configure(settings, custom_model)
+
+    @property
+    def settings(self):
+        return settings
+
+    def run(self):
+        main()
+
+if __name__ == "__main__":
+    Engine3D(settings=config.from_args()).run()